@@ -0,0 +1,900 @@
+#!/usr/bin/env python3
+"""
+PocketAI benchmark - load and latency harness for api_server.py
+
+Starts the real API server against a throwaway POCKETAI_ROOT whose engine.sh
+is backed by fake_llamafile.py, drives concurrent streaming, blocking and
+model-management requests, and reports latency percentiles, time to first
+token, throughput and the server's CPU/RSS. Results are saved as JSON.
+
+Usage:
+  python3 bench/bench.py run [--concurrency 8] [--requests 200] [--mix stream=6,blocking=2,models=2]
+  python3 bench/bench.py run --async --resident --token-rate 40
+  python3 bench/bench.py compare bench/results/old.json bench/results/new.json
+  python3 bench/bench.py tune [--cores 2,6] [--max-ctx 4096] [--quick]
+  python3 bench/bench.py templates
+  python3 bench/bench.py governor
+
+tune runs the autotuner (data/autotune.py) against fake llamafile servers
+reporting synthetic timings for a CPU layout, and checks that it settles
+on the same settings as a sweep over the timing model itself.
+
+templates sources core/engine.sh and checks that data/prompt_templates.py
+produces the same bytes for every model family.
+
+governor feeds data/governor.py fake /proc and thermal trees and checks its
+admit, install and throttle decisions at each level.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_llamafile  # noqa: E402
+
+MODEL_NAME = 'qwen2.5-0.5b-bench.gguf'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# Model-management operations cycled by the "models" workload
+MODEL_OPS = (
+    ('GET', '/api/models/installed', None),
+    ('GET', '/api/status', None),
+    ('POST', '/api/models/use', {'model': 'qwen2.5'}),
+    ('POST', '/api/models/verify', {'background': False}),
+)
+
+# =============================================================================
+# Statistics
+# =============================================================================
+def percentile(values, pct):
+    """Linear-interpolated percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values, scale=1000, digits=1):
+    """p50/p95/p99/mean/max of a list (seconds -> milliseconds by default)"""
+    if not values:
+        return None
+    return {
+        'p50': round(percentile(values, 50) * scale, digits),
+        'p95': round(percentile(values, 95) * scale, digits),
+        'p99': round(percentile(values, 99) * scale, digits),
+        'mean': round(sum(values) / len(values) * scale, digits),
+        'max': round(max(values) * scale, digits),
+    }
+
+# =============================================================================
+# Benchmark root and server process
+# =============================================================================
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_root():
+    """Throwaway POCKETAI_ROOT with the fake engine, a config and a fake model"""
+    root = tempfile.mkdtemp(prefix='pocketai-bench-')
+    for sub in ('core', 'data', 'models', 'web', 'bin'):
+        os.makedirs(os.path.join(root, sub))
+    shutil.copy(os.path.join(BENCH_DIR, 'fake_engine.sh'), os.path.join(root, 'core', 'engine.sh'))
+
+    model_path = os.path.join(root, 'models', MODEL_NAME)
+    with open(model_path, 'wb') as f:
+        f.write(b'GGUF' + (3).to_bytes(4, 'little') + bytes(64 * 1024))
+    with open(os.path.join(root, 'data', 'config'), 'w') as f:
+        f.write(f'active_model={model_path}\nthreads=4\nctx_size=2048\n')
+    with open(os.path.join(root, 'web', 'index.html'), 'w') as f:
+        f.write('<html><body>PocketAI bench</body></html>\n')
+
+    # proot-distro stand-in for RESIDENT_ENGINE: run the fake llamafile server
+    shim = os.path.join(root, 'bin', 'proot-distro')
+    with open(shim, 'w') as f:
+        f.write('#!/bin/sh\n'
+                '# Skip "login <container> --bind ..." up to "--", then drop the binary path\n'
+                'while [ "$#" -gt 0 ] && [ "$1" != "--" ]; do shift; done\n'
+                'shift 2\n'
+                'exec "$BENCH_PYTHON" "$BENCH_DIR/fake_llamafile.py" server "$@"\n')
+    os.chmod(shim, 0o755)
+    return root
+
+
+class ServerProcess:
+    """api_server.py running against a bench root, with CPU/RSS sampling"""
+
+    def __init__(self, root, args):
+        self.root = root
+        self.port = free_port()
+        self.args = args
+        self.process = None
+        self.log = None
+        self.samples = []  # (time, cpu seconds, children cpu seconds, rss kB)
+        self.stop = threading.Event()
+
+    def env(self):
+        env = dict(os.environ)
+        env.update({
+            'POCKETAI_ROOT': self.root,
+            'POCKETAI_BASH': shutil.which('bash') or '/bin/bash',
+            'API_PORT': str(self.port),
+            'BENCH_DIR': BENCH_DIR,
+            'BENCH_PYTHON': sys.executable,
+            'FAKE_TOKEN_RATE': str(self.args.token_rate),
+            'FAKE_TOKENS': str(self.args.tokens),
+            'FAKE_STARTUP_MS': str(self.args.startup_ms),
+            'FAKE_SPLIT_UTF8': '1' if self.args.split_utf8 else '0',
+            'FAKE_THINK': '1' if self.args.think else '0',
+            'FAKE_MANAGE_MS': str(self.args.manage_ms),
+            'PATH': os.path.join(self.root, 'bin') + os.pathsep + env.get('PATH', ''),
+        })
+        if self.args.use_async:
+            env['ASYNC_SERVER'] = '1'
+        if self.args.resident:
+            env['RESIDENT_ENGINE'] = '1'
+            env['ENGINE_PORT'] = str(free_port())
+        for item in self.args.env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        return env
+
+    def start(self):
+        self.log = open(os.path.join(self.root, 'server.log'), 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, 'data', 'api_server.py')],
+            env=self.env(), stdout=self.log, stderr=subprocess.STDOUT,
+            cwd=os.path.join(REPO_ROOT, 'data')
+        )
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'server exited early, see {self.log.name}')
+            health = self.health()
+            if health and (not self.args.resident or health.get('engine', {}).get('ready')):
+                threading.Thread(target=self._sample, daemon=True).start()
+                return
+            time.sleep(0.1)
+        raise RuntimeError(f'server not ready after 30s, see {self.log.name}')
+
+    def health(self):
+        try:
+            status, body = request('127.0.0.1', self.port, 'GET', '/api/health', timeout=2)
+            return json.loads(body) if status == 200 else None
+        except (OSError, ValueError, http.client.HTTPException):
+            return None
+
+    def metrics_text(self):
+        try:
+            status, body = request('127.0.0.1', self.port, 'GET', '/api/metrics', timeout=5)
+            return body.decode() if status == 200 else ''
+        except (OSError, http.client.HTTPException):
+            return ''
+
+    def read_usage(self):
+        """(cpu seconds, children cpu seconds, rss kB) from /proc"""
+        pid = self.process.pid
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # Fields after the command name start at index 3 (state)
+        utime, stime, cutime, cstime = (int(x) for x in fields[11:15])
+        rss = 0
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])
+                    break
+        return (utime + stime) / CLOCK_TICKS, (cutime + cstime) / CLOCK_TICKS, rss
+
+    def _sample(self):
+        while not self.stop.is_set():
+            try:
+                self.samples.append((time.time(),) + self.read_usage())
+            except (OSError, ValueError, IndexError):
+                return
+            self.stop.wait(0.2)
+
+    def usage(self, since):
+        """CPU and RSS figures for samples taken after `since`"""
+        window = [s for s in self.samples if s[0] >= since]
+        if len(window) < 2:
+            return {}
+        elapsed = window[-1][0] - window[0][0]
+        cpu = window[-1][1] - window[0][1]
+        rss = [s[3] for s in window]
+        return {
+            'cpu_seconds': round(cpu, 3),
+            'cpu_percent': round(cpu / elapsed * 100, 1) if elapsed else 0.0,
+            'children_cpu_seconds': round(window[-1][2] - window[0][2], 3),
+            'rss_start_kb': rss[0],
+            'rss_max_kb': max(rss),
+            'rss_mean_kb': round(sum(rss) / len(rss)),
+        }
+
+    def close(self):
+        self.stop.set()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.log is not None:
+            self.log.close()
+
+# =============================================================================
+# Load generator
+# =============================================================================
+def request(host, port, method, path, body=None, timeout=60):
+    """One HTTP request; returns (status, body bytes)"""
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def run_stream(port, message, timeout, use_cache):
+    """POST /api/chat/stream and time the SSE events"""
+    result = {'kind': 'stream', 'op': '/api/chat/stream'}
+    start = time.monotonic()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('POST', '/api/chat/stream',
+                     body=json.dumps({'message': message, 'cache': use_cache, 'full_response': False}),
+                     headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        result['status'] = resp.status
+        if resp.status != 200:
+            resp.read()
+            return result
+        parts = []
+        first = None
+        while True:
+            line = resp.readline()
+            if not line:
+                break
+            if not line.startswith(b'data: '):
+                continue
+            event = json.loads(line[6:])
+            if 'token' in event:
+                if first is None:
+                    first = time.monotonic()
+                parts.append(event['token'])
+            elif 'error' in event:
+                result['error'] = event['error']
+                break
+            elif event.get('done'):
+                break
+        end = time.monotonic()
+        text = ''.join(parts)
+        result['text'] = text
+        if first is not None:
+            result['ttft'] = first - start
+            if end > first:
+                result['stream_seconds'] = end - first
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        result['error'] = repr(e)
+    finally:
+        # The server may hold the connection open after the done event
+        conn.close()
+        result['latency'] = time.monotonic() - start
+    return result
+
+
+def run_blocking(port, message, timeout, use_cache):
+    """POST /api/chat"""
+    result = {'kind': 'blocking', 'op': '/api/chat'}
+    start = time.monotonic()
+    try:
+        status, body = request('127.0.0.1', port, 'POST', '/api/chat',
+                               {'message': message, 'cache': use_cache}, timeout)
+        result['status'] = status
+        if status == 200:
+            result['text'] = json.loads(body).get('response', '')
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        result['error'] = repr(e)
+    result['latency'] = time.monotonic() - start
+    return result
+
+
+def run_models(port, index, timeout):
+    """One model-management call"""
+    method, path, body = MODEL_OPS[index % len(MODEL_OPS)]
+    result = {'kind': 'models', 'op': f'{method} {path}'}
+    start = time.monotonic()
+    try:
+        result['status'], _ = request('127.0.0.1', port, method, path, body, timeout)
+    except (OSError, http.client.HTTPException) as e:
+        result['error'] = repr(e)
+    result['latency'] = time.monotonic() - start
+    return result
+
+
+def parse_mix(text):
+    """'stream=6,blocking=2,models=2' -> {'stream': 6, ...}"""
+    mix = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in ('stream', 'blocking', 'models'):
+            raise argparse.ArgumentTypeError(f'unknown workload: {kind}')
+        mix[kind] = int(weight or 1)
+    return mix
+
+
+def schedule(mix, total):
+    """Workload kinds interleaved by weight (smooth weighted round-robin)"""
+    weight_sum = sum(mix.values())
+    current = dict.fromkeys(mix, 0)
+    order = []
+    for _ in range(total):
+        for kind, weight in mix.items():
+            current[kind] += weight
+        kind = max(current, key=current.get)
+        current[kind] -= weight_sum
+        order.append(kind)
+    return order
+
+
+def drive(port, args):
+    """Run the request mix with a fixed number of concurrent clients"""
+    jobs = queue.Queue()
+    for i, kind in enumerate(schedule(args.mix, args.requests)):
+        jobs.put((i, kind))
+    results = []
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            try:
+                i, kind = jobs.get_nowait()
+            except queue.Empty:
+                return
+            message = f'bench request {i}' if not args.cache else 'bench request'
+            if kind == 'stream':
+                result = run_stream(port, message, args.timeout, args.cache)
+            elif kind == 'blocking':
+                result = run_blocking(port, message, args.timeout, args.cache)
+            else:
+                result = run_models(port, i, args.timeout)
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+# =============================================================================
+# Reporting
+# =============================================================================
+def report(results, duration, args):
+    """Per-workload and total figures"""
+    expected = fake_llamafile.expected_text()
+    summary = {}
+    total_tokens = 0
+    for kind in ('stream', 'blocking', 'models'):
+        rows = [r for r in results if r['kind'] == kind]
+        if not rows:
+            continue
+        ok = [r for r in rows if r.get('status') == 200 and 'error' not in r]
+        entry = {
+            'requests': len(rows),
+            'ok': len(ok),
+            'rejected': sum(1 for r in rows if r.get('status') == 429),
+            'errors': len(rows) - len(ok) - sum(1 for r in rows if r.get('status') == 429),
+            'latency_ms': summarize([r['latency'] for r in ok]),
+        }
+        if kind in ('stream', 'blocking'):
+            # The PTY turns \n into \r\n, as it does for real llamafile output
+            texts = [r.get('text', '').replace('\r\n', '\n') for r in ok]
+            entry['text_mismatches'] = sum(1 for t in texts if t.strip() != expected.strip())
+            entry['replacement_chars'] = sum(t.count('�') for t in texts)
+            total_tokens += len(ok) * len(fake_llamafile.answer_tokens())
+        if kind == 'stream':
+            entry['ttft_ms'] = summarize([r['ttft'] for r in ok if 'ttft' in r])
+            rates = [len(fake_llamafile.answer_tokens()) / r['stream_seconds']
+                     for r in ok if r.get('stream_seconds')]
+            entry['tokens_per_sec'] = summarize(rates, scale=1)
+        if kind == 'models':
+            entry['by_op'] = {
+                op: summarize([r['latency'] for r in ok if r['op'] == op])
+                for op in sorted({r['op'] for r in ok})
+            }
+        summary[kind] = entry
+    summary['total'] = {
+        'requests': len(results),
+        'duration_s': round(duration, 3),
+        'requests_per_sec': round(len(results) / duration, 2) if duration else 0.0,
+        'tokens_per_sec': round(total_tokens / duration, 1) if duration else 0.0,
+    }
+    return summary
+
+
+def print_summary(summary, server):
+    print()
+    print(f"{'workload':<10} {'ok/total':>9} {'429':>5} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttft p50':>9}")
+    for kind in ('stream', 'blocking', 'models'):
+        entry = summary.get(kind)
+        if not entry:
+            continue
+        lat = entry['latency_ms'] or {}
+        ttft = (entry.get('ttft_ms') or {}).get('p50', '')
+        print(f"{kind:<10} {entry['ok']:>4}/{entry['requests']:<4} {entry['rejected']:>5} {entry['errors']:>5} "
+              f"{lat.get('p50', ''):>9} {lat.get('p95', ''):>9} {lat.get('p99', ''):>9} {ttft:>9}")
+        if entry.get('text_mismatches') or entry.get('replacement_chars'):
+            print(f"  ! {entry['text_mismatches']} garbled answers, {entry['replacement_chars']} U+FFFD characters")
+    total = summary['total']
+    print(f"\n{total['requests']} requests in {total['duration_s']}s: "
+          f"{total['requests_per_sec']} req/s, {total['tokens_per_sec']} tokens/s")
+    if server:
+        print(f"server: {server['cpu_percent']}% CPU ({server['cpu_seconds']}s, children {server['children_cpu_seconds']}s), "
+              f"RSS {server['rss_start_kb']} -> max {server['rss_max_kb']} kB")
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', '-C', REPO_ROOT, 'rev-parse', '--short', 'HEAD'],
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def cmd_run(args):
+    root = make_root()
+    server = ServerProcess(root, args)
+    try:
+        server.start()
+        mode = ('async' if args.use_async else 'threaded') + (' + resident engine' if args.resident else '')
+        print(f"Server on port {server.port} ({mode}), root {root}")
+
+        if args.warmup:
+            warm = argparse.Namespace(**vars(args))
+            warm.requests = args.warmup
+            warm.mix = {'stream': 1}
+            drive(server.port, warm)
+
+        start_wall = time.time()
+        start = time.monotonic()
+        print(f"Running {args.requests} requests, concurrency {args.concurrency}, mix {args.mix}...")
+        results = drive(server.port, args)
+        duration = time.monotonic() - start
+        time.sleep(0.3)  # One more usage sample after the last request
+
+        summary = report(results, duration, args)
+        usage = server.usage(start_wall)
+        print_summary(summary, usage)
+
+        output = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+            },
+            'config': {
+                'server': 'async' if args.use_async else 'threaded',
+                'resident_engine': args.resident,
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'mix': args.mix,
+                'cache': args.cache,
+                'token_rate': args.token_rate,
+                'tokens': args.tokens,
+                'startup_ms': args.startup_ms,
+                'split_utf8': args.split_utf8,
+                'manage_ms': args.manage_ms,
+                'env': args.env,
+            },
+            'results': summary,
+            'server': usage,
+            'server_metrics': server.metrics_text() if args.save_metrics else None,
+        }
+        path = args.output or os.path.join(
+            BENCH_DIR, 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"\nSaved {path}")
+        return 0
+    finally:
+        server.close()
+        if not args.keep_root:
+            shutil.rmtree(root, ignore_errors=True)
+
+# =============================================================================
+# Autotuner check
+# =============================================================================
+def cmd_tune(args):
+    sys.path.insert(0, os.path.join(REPO_ROOT, 'data'))
+    import autotune
+
+    cores = [int(n) for n in args.cores.split(',')]
+    device = {'cpus': sum(cores), 'clusters': cores}
+    threads = autotune.thread_candidates(device, 4, args.quick)
+    batch_sizes = autotune.QUICK_BATCH_SIZES if args.quick else autotune.BATCH_SIZES
+    ctx_sizes = [] if args.quick else list(autotune.CTX_SIZES)
+    base = (4, None, 2048)
+
+    def synthetic(t, b, c):
+        if args.max_ctx and c > args.max_ctx:
+            raise autotune.TuneError('context too large')
+        return fake_llamafile.synthetic_timings(t, b, c, cores)
+
+    expected = autotune.sweep(synthetic, threads, batch_sizes, ctx_sizes, base)
+
+    root = make_root()
+    os.environ.update({
+        'BENCH_DIR': BENCH_DIR,
+        'BENCH_PYTHON': sys.executable,
+        'FAKE_CORES': args.cores,
+        'FAKE_MAX_CTX': str(args.max_ctx),
+        'FAKE_STARTUP_MS': '20',
+        'FAKE_TOKEN_RATE': '0',
+        'PATH': os.path.join(root, 'bin') + os.pathsep + os.environ.get('PATH', ''),
+    })
+    try:
+        model_path = os.path.join(root, 'models', MODEL_NAME)
+        server = autotune.ServerBench(model_path, root, free_port(), repeats=1, load_timeout=10)
+        print(f"Cores {args.cores}: threads {threads}, batch {list(batch_sizes)}, ctx {ctx_sizes}")
+        start = time.monotonic()
+        profile = autotune.sweep(server.measure, threads, batch_sizes, ctx_sizes, base,
+                                 log=lambda line: print(f"  {line}"))
+        store = autotune.ProfileStore(os.path.join(root, 'data', 'tune_profiles.json'),
+                                      dict(device, id='bench'))
+        store.save(model_path, profile)
+        saved = autotune.settings(store.lookup(model_path))
+        print(f"{len(profile['trials'])} settings in {time.monotonic() - start:.1f}s")
+        print(autotune.summary_line(MODEL_NAME, profile))
+
+        fields = ('threads', 'batch_size', 'ctx_size', 'prompt_tps', 'gen_tps')
+        mismatches = [f for f in fields if profile[f] != expected[f]]
+        if saved != autotune.settings(expected):
+            mismatches.append('saved profile')
+        if mismatches:
+            print(f"FAIL: {', '.join(mismatches)} differ from the synthetic optimum "
+                  f"({autotune.summary_line('expected', expected)})")
+            return 1
+        print("OK: matches the synthetic optimum")
+        return 0
+    finally:
+        if not args.keep_root:
+            shutil.rmtree(root, ignore_errors=True)
+
+# =============================================================================
+# Prompt template golden check
+# =============================================================================
+# One model file name per family in prompt_templates.TEMPLATES
+TEMPLATE_MODELS = (
+    'Qwen3-0.6B-Q4_K_M.gguf',
+    'qwen2.5-0.5b-instruct-q4_k_m.gguf',
+    'SmolLM2-360M-Instruct-Q8_0.gguf',
+    'Llama-3.2-1B-Instruct-Q4_K_M.gguf',
+    'tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf',
+    'gemma-2-2b-it-Q4_K_M.gguf',
+    'phi-2.Q4_K_M.gguf',
+    'stablelm-zephyr-3b.Q4_K_M.gguf',
+    'mistral-7b-instruct-v0.2.Q4_K_M.gguf',
+)
+
+# Messages that shell quoting or echo could mangle
+TEMPLATE_MESSAGES = (
+    'What is 2+2?',
+    'First line\nsecond line\n\nafter a blank line',
+    'She said "hi" and it\'s fine',
+    'C:\\path\\to\\file and \\n stays literal',
+    'Costs $5, $HOME and $(date) and `uname` stay as typed',
+    '-n -e flags at the start',
+    'Trailing newline\n',
+    'Unicode: héllo 世界 🚀',
+)
+
+# Runs each "function model message response" group from the arguments and
+# ends every output with a NUL, so any bytes the functions print survive
+TEMPLATE_SCRIPT = '''
+source "$ENGINE_SH"
+while (( $# )); do
+    "$1" "$2" "$3" "$4"
+    printf '\\0'
+    shift 4
+done
+'''
+
+
+def cmd_templates(args):
+    sys.path.insert(0, os.path.join(REPO_ROOT, 'data'))
+    import prompt_templates
+
+    cases = []
+    for model in TEMPLATE_MODELS + tuple(name.upper() for name in TEMPLATE_MODELS):
+        cases.append(('get_model_family', model, '', ''))
+        cases.append(('get_model_args', model, '', ''))
+        cases.append(('get_stop_sequences', model, '', ''))
+        for index, message in enumerate(TEMPLATE_MESSAGES):
+            reply = TEMPLATE_MESSAGES[-index - 1]
+            history = prompt_templates.build_history_entry(model, TEMPLATE_MESSAGES[0], reply)
+            cases.append(('build_prompt', model, message, ''))
+            cases.append(('build_prompt', model, message, history))
+            cases.append(('build_history_entry', model, message, reply))
+
+    argv = [arg for case in cases for arg in case]
+    env = dict(os.environ, ENGINE_SH=os.path.join(REPO_ROOT, 'core', 'engine.sh'))
+    proc = subprocess.run([args.bash, '-c', TEMPLATE_SCRIPT, 'templates'] + argv,
+                          env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    outputs = proc.stdout.decode('utf-8').split('\0')[:-1]
+    if proc.returncode != 0 or len(outputs) != len(cases):
+        print(f"FAIL: engine.sh exited with {proc.returncode} after {len(outputs)} of {len(cases)} cases")
+        print(proc.stderr.decode('utf-8', 'replace').strip())
+        return 1
+
+    failures = []
+    for (function, model, message, extra), expected in zip(cases, outputs):
+        if function == 'build_prompt':
+            actual = prompt_templates.build_prompt(model, message, extra)
+        elif function == 'build_history_entry':
+            actual = prompt_templates.build_history_entry(model, message, extra)
+        else:
+            actual = getattr(prompt_templates, function)(model)
+            if function == 'get_model_family':
+                actual += '\n'
+        if actual != expected:
+            failures.append((function, model, message, extra, expected, actual))
+
+    families = sorted({prompt_templates.get_model_family(model) for model in TEMPLATE_MODELS})
+    print(f"{len(cases)} cases, {len(families)} families: {', '.join(families)}")
+    if len(families) != len(prompt_templates.TEMPLATES):
+        print(f"FAIL: TEMPLATE_MODELS covers {len(families)} of {len(prompt_templates.TEMPLATES)} families")
+        return 1
+    for function, model, message, extra, expected, actual in failures[:10]:
+        print(f"  {function}({model!r}, {message!r}, {extra!r})")
+        print(f"    engine.sh: {expected!r}")
+        print(f"    python:    {actual!r}")
+    if failures:
+        print(f"FAIL: {len(failures)} outputs differ from engine.sh")
+        return 1
+    print("OK: prompt_templates.py matches engine.sh")
+    return 0
+
+# =============================================================================
+# Governor check
+# =============================================================================
+def write_device(root, total_mb=4096, available_mb=3072, memory_some=0.0, memory_full=0.0,
+                 cpu_some=0.0, load=0.0, temperatures=(40.0,)):
+    """(Re)write a fake /proc and /sys/class/thermal under root"""
+    proc = os.path.join(root, 'proc')
+    thermal = os.path.join(root, 'thermal')
+    shutil.rmtree(thermal, ignore_errors=True)
+    os.makedirs(os.path.join(proc, 'pressure'), exist_ok=True)
+    with open(os.path.join(proc, 'meminfo'), 'w') as f:
+        f.write(f"MemTotal:       {total_mb * 1024} kB\n"
+                f"MemFree:        {available_mb * 512} kB\n"
+                f"MemAvailable:   {available_mb * 1024} kB\n")
+    psi = {'memory': (memory_some, memory_full), 'cpu': (cpu_some, 0.0), 'io': (0.0, 0.0)}
+    for resource, (some, full) in psi.items():
+        with open(os.path.join(proc, 'pressure', resource), 'w') as f:
+            for kind, value in (('some', some), ('full', full)):
+                f.write(f"{kind} avg10={value:.2f} avg60={value:.2f} avg300={value:.2f} total=0\n")
+    with open(os.path.join(proc, 'loadavg'), 'w') as f:
+        f.write(f"{load:.2f} {load:.2f} {load:.2f} 1/200 4242\n")
+    for index, celsius in enumerate(temperatures):
+        zone = os.path.join(thermal, f'thermal_zone{index}')
+        os.makedirs(zone)
+        with open(os.path.join(zone, 'temp'), 'w') as f:
+            f.write(f"{int(celsius * 1000)}\n")
+    return proc, thermal
+
+
+def cmd_governor(args):
+    sys.path.insert(0, os.path.join(REPO_ROOT, 'data'))
+    import governor
+
+    MB = governor.MB
+    root = tempfile.mkdtemp(prefix='pocketai-governor-')
+    proc, thermal = write_device(root)
+    gov = governor.Governor(proc, thermal, reserve=256 * MB, cpus=4)
+    checks = []
+
+    def device(label, **state):
+        write_device(root, **state)
+        sample = gov.read()
+        print(f"{label}: level {sample['level']} {sample['levels']}")
+
+    def expect(label, actual, expected):
+        checks.append((label, actual, expected))
+        if actual != expected:
+            print(f"  FAIL {label}: {actual!r}, expected {expected!r}")
+
+    def decision(result):
+        return result['allowed'], result['reason']
+
+    try:
+        device('calm')
+        expect('admit small model', decision(gov.admit('chat', 'm', 512 * MB)), (True, 'ok'))
+        expect('admit model bigger than MemAvailable - reserve',
+               decision(gov.admit('chat', 'm', 3000 * MB)), (False, 'memory'))
+        expect('admit it when warm', decision(gov.admit('chat', 'm', 3000 * MB, warm=True)), (True, 'ok'))
+        expect('admit it after evicting idle models',
+               decision(gov.admit('chat', 'm', 3000 * MB, reclaimable=512 * MB)), (True, 'ok'))
+        expect('limits unchanged', gov.limits('4', '2048'), ('4', '2048'))
+
+        device('memory elevated (12% available)', available_mb=500)
+        expect('admit small model', decision(gov.admit('chat', 'm', 100 * MB)), (True, 'ok'))
+        expect('ctx_size halved', gov.limits('4', '2048'), ('4', '1024'))
+        expect('ctx_size floored at MIN_CTX', gov.limits(4, 768), (4, governor.MIN_CTX))
+        expect('ctx_size below MIN_CTX kept', gov.limits(4, 256), (4, 256))
+
+        device('memory critical (PSI some 50%)', memory_some=50.0)
+        expect('admit cold model', decision(gov.admit('chat', 'm', 100 * MB)), (False, 'pressure'))
+        expect('admit warm model', decision(gov.admit('chat', 'm', 100 * MB, warm=True)), (True, 'ok'))
+        expect('ctx_size quartered', gov.limits('4', '4096'), ('4', '1024'))
+        expect('ctx_size floored at MIN_CTX', gov.limits('4', '1024'), ('4', str(governor.MIN_CTX)))
+
+        device('memory critical (PSI full 25%)', memory_full=25.0)
+        expect('admit cold model', decision(gov.admit('chat', 'm', 100 * MB)), (False, 'pressure'))
+
+        device('memory critical (4% available)', available_mb=160)
+        expect('admit cold model', decision(gov.admit('chat', 'm', 10 * MB)), (False, 'pressure'))
+
+        device('cpu elevated (PSI some 70%)', cpu_some=70.0)
+        expect('admit', decision(gov.admit('chat', 'm', 100 * MB)), (True, 'ok'))
+        expect('threads halved', gov.limits('4', '2048'), ('2', '2048'))
+
+        device('cpu elevated (load 8 on 4 CPUs)', load=8.0)
+        expect('threads halved', gov.limits(8, 2048), (4, 2048))
+
+        device('cpu critical (PSI some 95%)', cpu_some=95.0)
+        expect('threads quartered', gov.limits('8', '2048'), ('2', '2048'))
+        expect('threads floored at 1', gov.limits('2', '2048'), ('1', '2048'))
+
+        device('thermal elevated (hottest zone 75C)', temperatures=(40.0, 75.0, -1.0))
+        expect('admit', decision(gov.admit('chat', 'm', 100 * MB)), (True, 'ok'))
+        expect('threads halved', gov.limits('4', '2048'), ('2', '2048'))
+
+        device('thermal critical (90C)', temperatures=(90.0,))
+        expect('admit cold model', decision(gov.admit('chat', 'm', 100 * MB)), (False, 'thermal'))
+        expect('admit warm model', decision(gov.admit('chat', 'm', 100 * MB, warm=True)), (False, 'thermal'))
+
+        device('memory and cpu critical', memory_some=50.0, cpu_some=95.0)
+        expect('threads and ctx_size quartered', gov.limits('4', '4096'), ('1', '1024'))
+
+        device('calm, 4096MB device')
+        expect('install model needing more than MemTotal',
+               decision(gov.admit_install('big', 6000 * MB)), (False, 'device'))
+        expect('install it forced', decision(gov.admit_install('big', 6000 * MB, force=True)), (True, 'forced'))
+        expect('install model that fits', decision(gov.admit_install('small', 2000 * MB)), (True, 'ok'))
+        expect('install model of unknown size', decision(gov.admit_install('other', None)), (True, 'ok'))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    failures = sum(1 for _, actual, expected in checks if actual != expected)
+    print(f"{len(checks)} checks")
+    if failures:
+        print(f"FAIL: {failures} governor decisions differ")
+        return 1
+    print("OK: governor decisions match the thresholds")
+    return 0
+
+# =============================================================================
+# Comparison
+# =============================================================================
+def cmd_compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    def row(label, old, cur, lower_is_better=True):
+        if old is None or cur is None:
+            return
+        change = (cur - old) / old * 100 if old else 0.0
+        better = change < 0 if lower_is_better else change > 0
+        flag = '' if abs(change) < args.threshold else (' better' if better else ' WORSE')
+        print(f"  {label:<22} {old:>10} {cur:>10} {change:>+8.1f}%{flag}")
+
+    print(f"base: {args.base} ({base['meta'].get('commit')})")
+    print(f"new:  {args.new} ({new['meta'].get('commit')})")
+    for kind in ('stream', 'blocking', 'models'):
+        old_entry = base['results'].get(kind)
+        cur_entry = new['results'].get(kind)
+        if not old_entry or not cur_entry:
+            continue
+        print(f"\n{kind}")
+        for metric in ('latency_ms', 'ttft_ms'):
+            for pct in ('p50', 'p95', 'p99'):
+                row(f'{metric} {pct}', (old_entry.get(metric) or {}).get(pct), (cur_entry.get(metric) or {}).get(pct))
+        if 'tokens_per_sec' in cur_entry:
+            row('tokens/s p50', (old_entry.get('tokens_per_sec') or {}).get('p50'),
+                (cur_entry.get('tokens_per_sec') or {}).get('p50'), lower_is_better=False)
+    print('\ntotal')
+    row('requests/s', base['results']['total']['requests_per_sec'],
+        new['results']['total']['requests_per_sec'], lower_is_better=False)
+    if base.get('server') and new.get('server'):
+        row('server cpu seconds', base['server'].get('cpu_seconds'), new['server'].get('cpu_seconds'))
+        row('server rss max kB', base['server'].get('rss_max_kb'), new['server'].get('rss_max_kb'))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PocketAI API benchmark')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='run a benchmark and save JSON results')
+    run.add_argument('--concurrency', type=int, default=8, help='concurrent clients (default 8)')
+    run.add_argument('--requests', type=int, default=200, help='total requests (default 200)')
+    run.add_argument('--mix', type=parse_mix, default=parse_mix('stream=6,blocking=2,models=2'),
+                     help='workload weights (default stream=6,blocking=2,models=2)')
+    run.add_argument('--warmup', type=int, default=2, help='unrecorded stream requests first (default 2)')
+    run.add_argument('--timeout', type=float, default=120, help='per-request timeout in seconds')
+    run.add_argument('--cache', action='store_true', help='allow response cache hits (same message)')
+    run.add_argument('--async', dest='use_async', action='store_true', help='run with ASYNC_SERVER=1')
+    run.add_argument('--resident', action='store_true', help='run with RESIDENT_ENGINE=1 (fake server)')
+    run.add_argument('--token-rate', type=float, default=20, help='fake tokens per second (default 20)')
+    run.add_argument('--tokens', type=int, default=64, help='fake tokens per answer (default 64)')
+    run.add_argument('--startup-ms', type=int, default=150, help='fake model load time (default 150)')
+    run.add_argument('--no-split-utf8', dest='split_utf8', action='store_false',
+                     help='do not split multi-byte characters across writes')
+    run.add_argument('--think', action='store_true', help='fake answers start with a <think> block to strip')
+    run.add_argument('--manage-ms', type=int, default=200, help='fake install/remove/verify time (default 200)')
+    run.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                     help='extra server environment (e.g. INFERENCE_SLOTS=2), repeatable')
+    run.add_argument('--save-metrics', action='store_true', help='store the final /api/metrics scrape')
+    run.add_argument('--keep-root', action='store_true', help='keep the temporary root and server.log')
+    run.add_argument('-o', '--output', help='result file (default bench/results/<timestamp>.json)')
+
+    compare = sub.add_parser('compare', help='compare two result files')
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=5, help='flag changes above this percent (default 5)')
+
+    tune = sub.add_parser('tune', help='check the autotuner against synthetic timings')
+    tune.add_argument('--cores', default='2,6', help='fake CPU clusters, fastest first (default 2,6)')
+    tune.add_argument('--max-ctx', type=int, default=0, help='fake servers fail above this -c (default no limit)')
+    tune.add_argument('--quick', action='store_true', help='the sweep pai tune --quick runs')
+    tune.add_argument('--keep-root', action='store_true', help='keep the temporary root')
+
+    templates = sub.add_parser('templates', help='check prompt_templates.py against engine.sh')
+    templates.add_argument('--bash', default='bash', help='bash to source engine.sh with (default bash)')
+
+    sub.add_parser('governor', help='check governor decisions against fake /proc files')
+
+    args = parser.parse_args()
+    if args.command == 'tune':
+        return cmd_tune(args)
+    if args.command == 'templates':
+        return cmd_templates(args)
+    if args.command == 'governor':
+        return cmd_governor(args)
+    if args.command == 'run':
+        fake_llamafile.TOKENS = args.tokens
+        return cmd_run(args)
+    return cmd_compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/bin/bash
+# =============================================================================
+# PocketAI benchmark - fake engine.sh
+# =============================================================================
+# Installed as core/engine.sh in the throwaway root bench.py creates. Provides
+# the functions api_server.py calls, backed by fake_llamafile.py instead of
+# proot + llamafile. BENCH_DIR and BENCH_PYTHON are set by bench.py.
+
+MODELS_DIR="$POCKETAI_ROOT/models"
+FAKE_LLAMAFILE="$BENCH_DIR/fake_llamafile.py"
+FAKE_MANAGE_MS="${FAKE_MANAGE_MS:-200}"
+
+# Catalog entry for API installs against fake_hub.py (FAKE_HUB_URL=http://127.0.0.1:<port>)
+declare -A MODEL_CATALOG=(
+    ["bench-hub"]="Bench hub model|64MB|64|${FAKE_HUB_URL:-http://127.0.0.1:8099}/resolve/bench-model.gguf"
+)
+
+fake_sleep() {
+    sleep "$(awk -v ms="$1" 'BEGIN { printf "%.3f", ms / 1000 }')"
+}
+
+# Blocking inference: full answer on stdout, cleaned like the real infer
+infer() {
+    local requested_tokens="${2:-}"
+    "$BENCH_PYTHON" "$FAKE_LLAMAFILE" generate "$requested_tokens" | \
+        "$BENCH_PYTHON" "$BENCH_DIR/../data/stream_filter.py" bench.gguf
+}
+
+# Streaming inference: tokens as they are generated
+infer_stream() {
+    local requested_tokens="${2:-}"
+    "$BENCH_PYTHON" "$FAKE_LLAMAFILE" generate "$requested_tokens"
+}
+
+# Session turn on a pre-built prompt
+infer_prompt_stream() {
+    local max_tokens="${2:-}"
+    "$BENCH_PYTHON" "$FAKE_LLAMAFILE" generate "$max_tokens"
+}
+
+model_install() {
+    fake_sleep "$FAKE_MANAGE_MS"
+    echo "Model $1 installed"
+}
+
+model_remove() {
+    fake_sleep "$FAKE_MANAGE_MS"
+    echo "Model $1 removed"
+}
+
+model_verify_file() {
+    [[ -f "$1" ]]
+}
+
+model_verify_all() {
+    fake_sleep "$FAKE_MANAGE_MS"
+    local model
+    for model in "$MODELS_DIR"/*.gguf; do
+        [[ -f "$model" ]] && echo "$(basename "$model"): OK"
+    done
+}
+
+# Autotuner sweep against fake_llamafile.py servers (synthetic timings, FAKE_CORES)
+tune_run() {
+    local name="$1"
+    shift
+    "$BENCH_PYTHON" "$BENCH_DIR/../data/autotune.py" --profiles "$POCKETAI_ROOT/data/tune_profiles.json" \
+        run "$MODELS_DIR/$name" --root "$POCKETAI_ROOT" --port "${TUNE_PORT:-8084}" "$@"
+}
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+PocketAI benchmark - fake model hub
+
+Serves a generated GGUF file the way Hugging Face does, for testing the
+downloader without a network: /resolve/<name> redirects to /files/<name>
+and carries the file's sha256 in X-Linked-Etag; /files/<name> answers
+single byte-range requests with 206.
+
+Usage:
+  fake_hub.py [--port P] [--size-mb N] [--name model.gguf]
+
+Prints "READY <port>" once listening.
+
+Settings (environment):
+  FAKE_HUB_RATE        bytes per second per connection (default 0 = unlimited)
+  FAKE_HUB_FAIL_EVERY  cut every Nth ranged response off halfway (default 0 = never)
+  FAKE_HUB_NO_RANGES   ignore Range headers and always send the whole file (default 0)
+"""
+import argparse
+import hashlib
+import http.server
+import os
+import random
+import re
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+RATE = int(os.environ.get('FAKE_HUB_RATE', 0))
+FAIL_EVERY = int(os.environ.get('FAKE_HUB_FAIL_EVERY', 0))
+NO_RANGES = os.environ.get('FAKE_HUB_NO_RANGES', '0') not in ('0', 'false', 'no', 'off')
+BLOCK = 64 * 1024
+
+
+def _string(value):
+    data = value.encode()
+    return struct.pack('<Q', len(data)) + data
+
+
+def make_gguf(size, seed=0):
+    """Valid GGUF v3 of about `size` bytes: metadata plus one F32 tensor"""
+    metadata = (
+        _string('general.architecture') + struct.pack('<I', 8) + _string('llama') +
+        _string('general.file_type') + struct.pack('<I', 4) + struct.pack('<I', 0) +
+        _string('llama.context_length') + struct.pack('<I', 4) + struct.pack('<I', 2048)
+    )
+    header_size = 4 + 4 + 8 + 8 + len(metadata)
+    tensor_info_size = len(_string('bench.weight')) + 4 + 8 + 4 + 8
+    data_offset = -(-(header_size + tensor_info_size) // 32) * 32
+    elements = max(1, (size - data_offset) // 4)
+    tensor_info = _string('bench.weight') + struct.pack('<IQIQ', 1, elements, 0, 0)
+    head = b'GGUF' + struct.pack('<IQQ', 3, 1, 3) + metadata + tensor_info
+    head += bytes(data_offset - len(head))
+    return head + random.Random(seed).randbytes(elements * 4)
+
+
+class HubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    files = {}          # name -> bytes
+    digests = {}        # name -> sha256 hex
+    ranged = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        match = re.fullmatch(r'/(resolve|files)/([^/?]+)', self.path)
+        name = match.group(2) if match else None
+        if name not in self.files:
+            self.send_empty(404)
+            return
+        if match.group(1) == 'resolve':
+            self.send_empty(302, [('Location', f'/files/{name}'),
+                                  ('X-Linked-Etag', f'"{self.digests[name]}"')])
+            return
+
+        data = self.files[name]
+        start, end, status = 0, len(data) - 1, 200
+        ranges = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if ranges and not NO_RANGES:
+            start = int(ranges.group(1))
+            end = min(int(ranges.group(2)), end) if ranges.group(2) else end
+            if start > end:
+                self.send_empty(416, [('Content-Range', f'bytes */{len(data)}')])
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', f'"{self.digests[name][:16]}"')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.end_headers()
+        if not body:
+            return
+
+        cut = None
+        if status == 206 and end > start:
+            with self.lock:
+                HubHandler.ranged += 1
+                if FAIL_EVERY and HubHandler.ranged % FAIL_EVERY == 0:
+                    cut = start + (end - start) // 2
+        pos, began = start, time.monotonic()
+        try:
+            while pos <= end:
+                if cut is not None and pos >= cut:
+                    self.close_connection = True
+                    return
+                chunk = data[pos:min(pos + BLOCK, end + 1)]
+                self.wfile.write(chunk)
+                pos += len(chunk)
+                if RATE:
+                    delay = began + (pos - start) / RATE - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class HubServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(name, size, port=0):
+    """Start the hub in a background thread; returns the server"""
+    data = make_gguf(size)
+    HubHandler.files[name] = data
+    HubHandler.digests[name] = hashlib.sha256(data).hexdigest()
+    server = HubServer(('127.0.0.1', port), HubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Fake Hugging Face file server')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--size-mb', type=float, default=64)
+    parser.add_argument('--name', default='bench-model.gguf')
+    args = parser.parse_args(argv[1:])
+    server = serve(args.name, int(args.size_mb * 1024 * 1024), args.port)
+    print(f'READY {server.server_address[1]}', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+PocketAI benchmark - fake llamafile
+
+Stands in for llamafile so api_server.py can be measured without a phone,
+proot or a real model. Tokens are written at a fixed rate and multi-byte
+UTF-8 characters are split across two writes, so the server sees partial
+sequences exactly like it does with a real PTY.
+
+Usage:
+  fake_llamafile.py generate [max_tokens]   # stream tokens to stdout
+  fake_llamafile.py server [llamafile args] # /health + /completion on --port
+
+Settings (environment):
+  FAKE_TOKEN_RATE   tokens per second (default 20)
+  FAKE_TOKENS       tokens per answer, capped by max_tokens (default 64)
+  FAKE_STARTUP_MS   model load delay before the first token (default 150)
+  FAKE_SPLIT_UTF8   split multi-byte characters across writes (default 1)
+  FAKE_THINK        start answers with a <think> block, tags split (default 0)
+  FAKE_CORES        CPU clusters for the synthetic timings, fastest first (default 4)
+  FAKE_MAX_CTX      server exits at startup for a larger -c, like a failed allocation
+                    (default 0, no limit)
+
+The server reports llamafile-style timings computed from its -t, -b and -c
+arguments (synthetic_timings), so the autotuner has a known optimum.
+"""
+import http.server
+import json
+import os
+import socketserver
+import sys
+import time
+
+# Mix of 1-4 byte UTF-8 so every decode_utf8_safe branch is exercised
+VOCAB = (
+    'Hello', ' world', ',', ' wörld', ' café', ' naïve', ' 你好', ' 世界',
+    ' 🙂', ' 🚀', ' the', ' quick', ' brown', ' fox', '.', '\n',
+)
+
+TOKEN_RATE = float(os.environ.get('FAKE_TOKEN_RATE', 20))
+TOKENS = int(os.environ.get('FAKE_TOKENS', 64))
+STARTUP_MS = int(os.environ.get('FAKE_STARTUP_MS', 150))
+SPLIT_UTF8 = os.environ.get('FAKE_SPLIT_UTF8', '1') not in ('0', 'false', 'no', 'off')
+THINK = os.environ.get('FAKE_THINK', '0') not in ('0', 'false', 'no', 'off')
+CORES = [int(n) for n in os.environ.get('FAKE_CORES', '4').split(',') if n.strip()]
+MAX_CTX = int(os.environ.get('FAKE_MAX_CTX', 0))
+
+# Synthetic timings: each cluster runs at CLUSTER_SPEED times the one before
+# it, and a generation step waits for its slowest thread
+GEN_TPS = 5.0      # tokens/s per thread on the fastest cores
+PROMPT_TPS = 40.0  # prompt tokens/s per thread at the best batch size
+CLUSTER_SPEED = 0.4
+
+# Qwen3-style reasoning the server has to strip; tags land in separate reads
+THINK_TOKENS = ('<th', 'ink>', '\n', 'Let', ' me', ' think', '.', '\n', '</', 'think', '>', '\n\n')
+
+
+def answer_tokens(max_tokens=None):
+    """Deterministic token list for an answer"""
+    count = TOKENS if not max_tokens or max_tokens < 0 else min(TOKENS, max_tokens)
+    return [VOCAB[i % len(VOCAB)] for i in range(count)]
+
+
+def expected_text(max_tokens=None):
+    """Full answer text the fake produces (for checking the server's output)"""
+    return ''.join(answer_tokens(max_tokens))
+
+
+def output_tokens(max_tokens=None):
+    """What the model writes: the answer, after a think block with FAKE_THINK"""
+    return (list(THINK_TOKENS) if THINK else []) + answer_tokens(max_tokens)
+
+
+def split_point(data):
+    """Byte offset inside the first multi-byte character, or 0"""
+    for i, byte in enumerate(data):
+        if byte >= 0xC0:
+            return i + 1
+    return 0
+
+
+def paced(tokens):
+    """Yield tokens on the configured schedule (after the startup delay)"""
+    time.sleep(STARTUP_MS / 1000)
+    interval = 1 / TOKEN_RATE if TOKEN_RATE > 0 else 0
+    start = time.monotonic()
+    for i, token in enumerate(tokens):
+        delay = start + i * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield token
+
+
+def synthetic_timings(threads, batch_size=None, ctx_size=2048, cores=None):
+    """{'prompt_tps', 'gen_tps'} the fake reports for llamafile -t/-b/-c"""
+    speeds = []
+    for i, count in enumerate(cores or CORES):
+        speeds += [CLUSTER_SPEED ** i] * count
+    used = speeds[:threads]
+    # Threads beyond the cores share them
+    pace = min(used) * min(1.0, len(speeds) / threads)
+    batch = batch_size or 512
+    batch_factor = (min(batch, 256) / 256) ** 0.5 * (0.9 if batch > 256 else 1.0)
+    return {
+        'prompt_tps': round(PROMPT_TPS * threads * pace * batch_factor, 2),
+        'gen_tps': round(GEN_TPS * threads * pace / (1 + ctx_size / 32768), 2),
+    }
+
+
+def generate(max_tokens=None):
+    """CLI mode: write tokens to stdout the way llamafile -p does"""
+    out = sys.stdout.buffer
+    for token in paced(output_tokens(max_tokens)):
+        data = token.encode()
+        cut = split_point(data) if SPLIT_UTF8 else 0
+        if cut:
+            out.write(data[:cut])
+            out.flush()
+            time.sleep(0.002)  # Lands in a separate PTY read
+            data = data[cut:]
+        out.write(data)
+        out.flush()
+
+
+class FakeServerHandler(http.server.BaseHTTPRequestHandler):
+    """llamafile --server subset used by the resident engine"""
+    protocol_version = 'HTTP/1.1'
+    ready_at = 0
+    rates = None  # synthetic_timings for the server's arguments
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            if time.time() < self.ready_at:
+                self.send_body(503, {'status': 'loading model'})
+            else:
+                self.send_body(200, {'status': 'ok'})
+        else:
+            self.send_body(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        tokens = output_tokens(request.get('n_predict'))
+        if not request.get('stream'):
+            # No startup delay here: the model is already loaded
+            time.sleep(len(tokens) / TOKEN_RATE if TOKEN_RATE > 0 else 0)
+            prompt_n = len(str(request.get('prompt', '')).split())
+            timings = {
+                'prompt_n': prompt_n,
+                'prompt_ms': round(prompt_n / self.rates['prompt_tps'] * 1000, 3),
+                'prompt_per_second': self.rates['prompt_tps'],
+                'predicted_n': len(tokens),
+                'predicted_ms': round(len(tokens) / self.rates['gen_tps'] * 1000, 3),
+                'predicted_per_second': self.rates['gen_tps'],
+            }
+            self.send_body(200, {'content': ''.join(tokens), 'stop': True, 'tokens_predicted': len(tokens),
+                                 'timings': timings})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        interval = 1 / TOKEN_RATE if TOKEN_RATE > 0 else 0
+        try:
+            for i, token in enumerate(tokens):
+                time.sleep(interval)
+                last = i == len(tokens) - 1
+                event = {'content': token, 'stop': last}
+                self.wfile.write(b'data: ' + json.dumps(event).encode() + b'\n\n')
+                self.wfile.flush()
+            if not tokens:
+                self.wfile.write(b'data: {"content": "", "stop": true}\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+class FakeServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(args):
+    """Server mode: accepts the llamafile --server command line"""
+    def option(flag, default):
+        return int(args[args.index(flag) + 1]) if flag in args else default
+
+    port = option('--port', 8080)
+    ctx_size = option('-c', 2048)
+    if MAX_CTX and ctx_size > MAX_CTX:
+        print(f'failed to allocate context of {ctx_size} tokens', file=sys.stderr)
+        sys.exit(1)
+    FakeServerHandler.rates = synthetic_timings(option('-t', 4), option('-b', None), ctx_size)
+    FakeServerHandler.ready_at = time.time() + STARTUP_MS / 1000
+    with FakeServer(('127.0.0.1', port), FakeServerHandler) as server:
+        server.serve_forever()
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    mode = argv[1]
+    if mode == 'generate':
+        generate(int(argv[2]) if len(argv) > 2 and argv[2] else None)
+        return 0
+    if mode == 'server':
+        serve(argv[2:])
+        return 0
+    print(f'Unknown mode: {mode}', file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
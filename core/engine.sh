@@ -72,7 +72,21 @@ config_get() {
 config_set() {
     local key="$1" value="$2"
     config_init
+    # Same lock file as the API server's config writer
+    if command -v flock &>/dev/null; then
+        (
+            flock 9
+            config_write "$key" "$value"
+        ) 9>>"$CONFIG_FILE.lock"
+    else
+        config_write "$key" "$value"
+    fi
+}
+
+config_write() {
+    local key="$1" value="$2"
     if grep -q "^${key}=" "$CONFIG_FILE" 2>/dev/null; then
+        # sed -i writes a temp file and renames it over the config
         sed -i "s|^${key}=.*|${key}=${value}|" "$CONFIG_FILE"
     else
         echo "${key}=${value}" >> "$CONFIG_FILE"
@@ -252,6 +266,7 @@ model_list_installed() {
 
 model_install() {
     local name="$1"
+    local force="${2:-}"  # --force skips the RAM confirmation (also PAI_FORCE=1)
 
     # Check catalog
     if [[ -z "${MODEL_CATALOG[$name]:-}" ]]; then
@@ -264,12 +279,17 @@ model_install() {
     local filename=$(basename "$url")
     local filepath="$MODELS_DIR/$filename"
 
-    # RAM check with warning
+    # RAM check with warning; asks only on a terminal (the API and scripts get an error)
     local ram_mb=$(free -m | awk '/^Mem:/{print $2}')
-    if [[ $ram_mb -lt $min_ram ]]; then
+    if [[ $ram_mb -lt $min_ram && "$force" != "--force" && "${PAI_FORCE:-}" != "1" ]]; then
         log_warn "Your RAM (${ram_mb}MB) may be low for this model (needs ${min_ram}MB)"
+        if [[ ! -t 0 ]]; then
+            log_error "Not installing without confirmation. Run: pai install $name --force"
+            return 1
+        fi
         log_warn "Model may run slowly or crash. Continue anyway? [y/N]"
-        read -r response
+        local response=""
+        read -r response || true
         [[ ! "$response" =~ ^[Yy] ]] && return 1
     fi
 
@@ -302,8 +322,7 @@ model_install() {
 
         log_info "Downloading $filename ($size)..."
 
-        # Use -C - for resume support, --retry for transient failures
-        if curl -L -C - --retry 3 --retry-delay 5 --progress-bar -o "$filepath" "$url"; then
+        if model_download "$url" "$filepath"; then
             log_info "Verifying download..."
             if model_verify_file "$filepath" "full"; then
                 download_success=true
@@ -336,6 +355,23 @@ model_install() {
     fi
 }
 
+# Download a model file. downloader.py fetches parallel byte ranges into
+# <file>.part and resumes from it after a failure; curl is the fallback.
+# Usage: model_download <url> <filepath>
+model_download() {
+    local url="$1" filepath="$2"
+    if command -v python3 &>/dev/null && [[ -f "$DATA_DIR/downloader.py" ]]; then
+        local connections limit
+        connections=$(config_get download_connections)
+        limit=$(config_get download_limit)
+        python3 "$DATA_DIR/downloader.py" "$url" "$filepath" \
+            --connections "${connections:-4}" --limit-rate "${limit:-0}"
+    else
+        # Use -C - for resume support, --retry for transient failures
+        curl -L -C - --retry 3 --retry-delay 5 --progress-bar -o "$filepath" "$url"
+    fi
+}
+
 # Verify model file integrity
 # Usage: model_verify_file <filepath> [quick|full]
 model_verify_file() {
@@ -348,6 +384,18 @@ model_verify_file() {
         return 1
     fi
 
+    # Parse header, metadata and tensor table in place. The tensor bounds
+    # check takes milliseconds, so quick mode gets it too.
+    if command -v python3 &>/dev/null && [[ -f "$DATA_DIR/gguf.py" ]]; then
+        local result
+        if ! result=$(python3 "$DATA_DIR/gguf.py" verify "$filepath" full 2>&1); then
+            log_error "Invalid model file: $result"
+            return 1
+        fi
+        return 0
+    fi
+
+    # Fallback without python3: size, magic bytes and a load test
     # Check minimum file size (at least 50MB for any valid model)
     local filesize
     filesize=$(stat -c%s "$filepath" 2>/dev/null || stat -f%z "$filepath" 2>/dev/null || echo "0")
@@ -389,37 +437,61 @@ model_verify_file() {
 }
 
 # Verify all installed models
+# Usage: model_verify_all [quick|full|deep] [--no-cache]
 model_verify_all() {
+    local mode="${1:-full}"
+    local recheck="${2:-}"
     log_step "Verifying Installed Models"
     echo ""
 
     local found=0
     local valid=0
     local invalid=0
+    local cached=0
+
+    if command -v python3 &>/dev/null && [[ -f "$DATA_DIR/model_verify.py" ]]; then
+        # Parallel check; files unchanged since their last check come from the cache
+        local name size status source detail
+        while IFS=$'\t' read -r name size status source detail; do
+            found=$((found + 1))
+            [[ "$source" == "cached" ]] && cached=$((cached + 1))
+            echo -n "  Checking $name ($size)... "
+            if [[ "$status" == "OK" ]]; then
+                echo -e "${GREEN}OK${RESET}"
+                valid=$((valid + 1))
+            else
+                echo -e "${RED}CORRUPTED${RESET} ${DIM}$detail${RESET}"
+                invalid=$((invalid + 1))
+            fi
+        done < <(python3 "$DATA_DIR/model_verify.py" --mode "$mode" $recheck \
+                    --cache "$DATA_DIR/verify_cache.json" "$MODELS_DIR" 2>/dev/null)
+    else
+        for f in "$MODELS_DIR"/*.gguf; do
+            [[ -f "$f" ]] || continue
+            found=$((found + 1))
 
-    for f in "$MODELS_DIR"/*.gguf; do
-        [[ -f "$f" ]] || continue
-        found=$((found + 1))
-
-        local name=$(basename "$f")
-        local size=$(du -h "$f" | cut -f1)
+            local name=$(basename "$f")
+            local size=$(du -h "$f" | cut -f1)
 
-        echo -n "  Checking $name ($size)... "
+            echo -n "  Checking $name ($size)... "
 
-        if model_verify_file "$f" "quick"; then
-            echo -e "${GREEN}OK${RESET}"
-            valid=$((valid + 1))
-        else
-            echo -e "${RED}CORRUPTED${RESET}"
-            invalid=$((invalid + 1))
-        fi
-    done
+            if model_verify_file "$f" "quick"; then
+                echo -e "${GREEN}OK${RESET}"
+                valid=$((valid + 1))
+            else
+                echo -e "${RED}CORRUPTED${RESET}"
+                invalid=$((invalid + 1))
+            fi
+        done
+    fi
 
     echo ""
     if [[ $found -eq 0 ]]; then
         log_info "No models installed"
     else
-        log_info "Results: $valid valid, $invalid corrupted, $found total"
+        local summary="Results: $valid valid, $invalid corrupted, $found total"
+        [[ $cached -gt 0 ]] && summary+=" ($cached unchanged since last check)"
+        log_info "$summary"
         if [[ $invalid -gt 0 ]]; then
             echo ""
             log_warn "Remove corrupted models with: pai remove <model>"
@@ -476,19 +548,48 @@ model_remove() {
 # Inference
 # =============================================================================
 
+# Threads, context and batch size for a model: its `pai tune` profile for this
+# device (data/tune_profiles.json), else the threads/ctx_size settings.
+# Prints "threads ctx_size batch_size"; batch_size is empty without a profile
+# (llamafile's default). The API passes its choice, lowered by the resource
+# governor under pressure, in PAI_THREADS/PAI_CTX_SIZE/PAI_BATCH_SIZE.
+model_settings() {
+    local model_path="$1"
+    if [[ -n "${PAI_THREADS:-}" && -n "${PAI_CTX_SIZE:-}" ]]; then
+        echo "$PAI_THREADS $PAI_CTX_SIZE ${PAI_BATCH_SIZE:-}"
+        return 0
+    fi
+
+    local tune=$(config_get tune on)
+    if [[ "${tune:-on}" != "off" && -f "$DATA_DIR/autotune.py" ]] && command -v python3 &>/dev/null; then
+        local tuned
+        if tuned=$(python3 "$DATA_DIR/autotune.py" get "$model_path" 2>/dev/null) && [[ -n "$tuned" ]]; then
+            echo "$tuned"
+            return 0
+        fi
+    fi
+
+    local threads=$(config_get threads 4)
+    local ctx_size=$(config_get ctx_size 2048)
+    echo "${PAI_THREADS:-${threads:-4}} ${PAI_CTX_SIZE:-${ctx_size:-2048}} "
+}
+
 infer() {
     local prompt="$1"
     local requested_tokens="${2:-}"  # Optional: override max_tokens
     local model_path
-    model_path=$(config_get active_model)
+    # PAI_MODEL (set by the API for a request naming a model) overrides the active model
+    model_path=${PAI_MODEL:-$(config_get active_model)}
 
     if [[ -z "$model_path" || ! -f "$model_path" ]]; then
         log_error "No model active. Run: pai install qwen3"
         return 1
     fi
 
-    local threads=$(config_get threads 4)
-    local ctx_size=$(config_get ctx_size 2048)
+    local threads ctx_size batch_size
+    read -r threads ctx_size batch_size <<< "$(model_settings "$model_path")"
+    local batch_arg=""
+    [[ -n "$batch_size" ]] && batch_arg="-b $batch_size"
     local container_model="$CONTAINER_MODELS/$(basename "$model_path")"
     local model_name=$(basename "$model_path")
     local family=$(get_model_family "$model_name")
@@ -520,19 +621,17 @@ infer() {
 
     # Run inference with model-specific settings
     if [[ "$family" == "qwen3" ]]; then
-        # Qwen3: No token limit, handle thinking blocks
-        # Strip <think>...</think> if present (multiline), otherwise output everything
+        # Qwen3: No token limit, thinking blocks are stripped by filter_response
         eval container_run '"$container_model"' \
             -t '"$threads"' \
             -c '"$ctx_size"' \
+            $batch_arg \
             -p '"$formatted_prompt"' \
             $model_args \
             $stop_args \
             --log-disable \
             --no-display-prompt 2>/dev/null | \
-            awk 'BEGIN{skip=0} /<think>/{skip=1} /<\/think>/{skip=0; sub(/.*<\/think>/, ""); if(length>0) print; next} !skip{print}' | \
-            sed 's/^[[:space:]]*//' | \
-            clean_response
+            filter_response "$model_name"
     else
         # Other models: Use token limit
         local token_arg=""
@@ -541,13 +640,14 @@ infer() {
         eval container_run '"$container_model"' \
             -t '"$threads"' \
             -c '"$ctx_size"' \
+            $batch_arg \
             -p '"$formatted_prompt"' \
             $token_arg \
             $model_args \
             $stop_args \
             --log-disable \
             --no-display-prompt 2>/dev/null | \
-            clean_response
+            filter_response "$model_name"
     fi
 }
 
@@ -556,15 +656,17 @@ infer_stream() {
     local prompt="$1"
     local requested_tokens="${2:-}"
     local model_path
-    model_path=$(config_get active_model)
+    model_path=${PAI_MODEL:-$(config_get active_model)}
 
     if [[ -z "$model_path" || ! -f "$model_path" ]]; then
         echo "Error: No model active"
         return 1
     fi
 
-    local threads=$(config_get threads 4)
-    local ctx_size=$(config_get ctx_size 2048)
+    local threads ctx_size batch_size
+    read -r threads ctx_size batch_size <<< "$(model_settings "$model_path")"
+    local batch_arg=""
+    [[ -n "$batch_size" ]] && batch_arg="-b $batch_size"
     local container_model="$CONTAINER_MODELS/$(basename "$model_path")"
     local model_name=$(basename "$model_path")
     local family=$(get_model_family "$model_name")
@@ -602,6 +704,7 @@ infer_stream() {
         -- "$CONTAINER_BIN" -m "$container_model" \
         -t "$threads" \
         -c "$ctx_size" \
+        $batch_arg \
         -p "$formatted_prompt" \
         $token_arg \
         $model_args \
@@ -610,6 +713,58 @@ infer_stream() {
         --no-display-prompt 2>/dev/null
 }
 
+# Streaming inference on an already formatted prompt (REST API sessions)
+# Usage: infer_prompt_stream <formatted_prompt> [max_tokens] [prompt_cache]
+# prompt_cache is relative to data/; llamafile reloads the saved KV state and
+# only evaluates the tokens added since the previous turn.
+infer_prompt_stream() {
+    local formatted_prompt="$1"
+    local max_tokens="${2:-}"
+    local prompt_cache="${3:-}"
+    local model_path
+    model_path=${PAI_MODEL:-$(config_get active_model)}
+
+    if [[ -z "$model_path" || ! -f "$model_path" ]]; then
+        echo "Error: No model active"
+        return 1
+    fi
+
+    local threads ctx_size batch_size
+    read -r threads ctx_size batch_size <<< "$(model_settings "$model_path")"
+    local batch_arg=""
+    [[ -n "$batch_size" ]] && batch_arg="-b $batch_size"
+    local container_model="$CONTAINER_MODELS/$(basename "$model_path")"
+    local model_name=$(basename "$model_path")
+    local model_args=$(get_model_args "$model_name")
+
+    # Stop sequences
+    local stop_args=""
+    while IFS= read -r stop_seq; do
+        [[ -n "$stop_seq" ]] && stop_args="$stop_args -r \"$stop_seq\""
+    done <<< "$(get_stop_sequences "$model_name")"
+
+    local token_arg=""
+    [[ -n "$max_tokens" ]] && token_arg="-n $max_tokens"
+
+    local cache_args=""
+    [[ -n "$prompt_cache" ]] && cache_args="--prompt-cache /opt/pocketai/data/$prompt_cache --prompt-cache-all"
+
+    proot-distro login "$CONTAINER_NAME" \
+        --bind "$POCKETAI_ROOT/data:/opt/pocketai/data" \
+        --bind "$POCKETAI_ROOT/models:/opt/pocketai/models" \
+        -- "$CONTAINER_BIN" -m "$container_model" \
+        -t "$threads" \
+        -c "$ctx_size" \
+        $batch_arg \
+        -p "$formatted_prompt" \
+        $token_arg \
+        $model_args \
+        $stop_args \
+        $cache_args \
+        --log-disable \
+        --no-display-prompt 2>/dev/null
+}
+
 # Minimal cleanup - just stop at turn markers
 cut_response() {
     sed -n '/^###/q; /^User:/q; /^Human:/q; /^<|/q; p'
@@ -909,6 +1064,24 @@ clean_response() {
         -e 's/[[:space:]]*$//'
 }
 
+# Clean model output as it arrives: think blocks, stop sequences, special tokens
+# and LaTeX (data/stream_filter.py), so chat shows tokens as they are generated.
+# Without python3, falls back to the line-based awk/sed pipeline.
+# Usage: ... | filter_response <model_name>
+filter_response() {
+    local model_name="$1"
+    if command -v python3 &>/dev/null && [[ -f "$DATA_DIR/stream_filter.py" ]]; then
+        python3 "$DATA_DIR/stream_filter.py" "$model_name"
+    elif [[ "$(get_model_family "$model_name")" == "qwen3" ]]; then
+        # Strip <think>...</think> if present (multiline), otherwise output everything
+        awk 'BEGIN{skip=0} /<think>/{skip=1} /<\/think>/{skip=0; sub(/.*<\/think>/, ""); if(length>0) print; next} !skip{print}' | \
+            sed 's/^[[:space:]]*//' | \
+            clean_response
+    else
+        clean_response
+    fi
+}
+
 chat_interactive() {
     local model_path
     model_path=$(config_get active_model)
@@ -924,19 +1097,39 @@ chat_interactive() {
     log_info "Chat with $model_name"
     log_info "Model family: $family"
     log_info "Commands: 'exit' to quit, '/clear' to reset context"
-    log_info "Context: Remembers last 4 exchanges"
-    echo ""
 
-    local threads=$(config_get threads 4)
-    local ctx_size=$(config_get ctx_size 2048)
+    local threads ctx_size batch_size
+    read -r threads ctx_size batch_size <<< "$(model_settings "$model_path")"
+    local batch_arg=""
+    [[ -n "$batch_size" ]] && batch_arg="-b $batch_size"
     local container_model="$CONTAINER_MODELS/$model_name"
 
+    # History is sized in tokens by context_window.py (recent turns that fit
+    # in ctx_size, or history_tokens if set); without python3 the history
+    # file is trimmed by bytes instead
+    local history_tokens=$(config_get history_tokens 0)
+    history_tokens="${history_tokens:-0}"
+    local system_prompt=$(config_get system_prompt)
+    local summary_flag=""
+    [[ "$(config_get history_summary on)" == "off" ]] && summary_flag="--no-summary"
+    local context_window=""
+    if command -v python3 &>/dev/null && [[ -f "$DATA_DIR/context_window.py" ]]; then
+        context_window="$DATA_DIR/context_window.py"
+        local context_tokens="$ctx_size"
+        [[ "$history_tokens" -gt 0 ]] 2>/dev/null && context_tokens="$history_tokens"
+        log_info "Context: Recent exchanges that fit in $context_tokens tokens"
+    else
+        log_info "Context: Remembers the last few exchanges"
+    fi
+    echo ""
+
     # Use temp file for history (Termux-compatible path)
     local tmp_dir="${TMPDIR:-$HOME/.cache/pocketai}"
     mkdir -p "$tmp_dir"
     local history_file="$tmp_dir/pocketai_history_$$"
+    local state_file="$tmp_dir/pocketai_context_$$.json"
     echo -n "" > "$history_file"
-    trap "rm -f '$history_file'" EXIT
+    trap "rm -f '$history_file' '$state_file'" EXIT
 
     # Get model-specific parameters
     local model_args=$(get_model_args "$model_name")
@@ -958,16 +1151,11 @@ chat_interactive() {
         # Clear history command
         if [[ "$user_input" == "/clear" ]]; then
             echo -n "" > "$history_file"
+            rm -f "$state_file"
             log_success "Context cleared"
             continue
         fi
 
-        # Read history
-        local history=""
-        if [[ -s "$history_file" ]]; then
-            history=$(cat "$history_file")
-        fi
-
         # Token limits - Qwen3 has no limit (uses stop sequences)
         # Default: 500 tokens (~375 words) - enough for most responses
         local max_tokens=500
@@ -979,6 +1167,18 @@ chat_interactive() {
             max_tokens=600  # Extended for explanations
         fi
 
+        # Read history
+        local history=""
+        if [[ -n "$context_window" ]]; then
+            # The trailing "." keeps the history's last newline through $(...)
+            history=$(python3 "$context_window" history "$model_path" "$state_file" "$user_input" \
+                --ctx "$ctx_size" --reserve "$max_tokens" --budget "$history_tokens" \
+                --system "$system_prompt" $summary_flag 2>/dev/null && echo .) || history=""
+            history="${history%.}"
+        elif [[ -s "$history_file" ]]; then
+            history=$(cat "$history_file")
+        fi
+
         echo -ne "${GREEN}AI>${RESET} "
 
         # Build model-specific prompt with history
@@ -988,19 +1188,17 @@ chat_interactive() {
         local response_file="$tmp_dir/response_$$"
 
         if [[ "$family" == "qwen3" ]]; then
-            # Qwen3: No token limit, handle thinking blocks
-            # Strip <think>...</think> if present (multiline), otherwise output everything
+            # Qwen3: No token limit, thinking blocks are stripped by filter_response
             eval container_run '"$container_model"' \
                 -t '"$threads"' \
                 -c '"$ctx_size"' \
+                $batch_arg \
                 -p '"$formatted_prompt"' \
                 $model_args \
                 $stop_args \
                 --log-disable \
                 --no-display-prompt 2>/dev/null | \
-                awk 'BEGIN{skip=0} /<think>/{skip=1} /<\/think>/{skip=0; sub(/.*<\/think>/, ""); if(length>0) print; next} !skip{print}' | \
-                sed 's/^[[:space:]]*//' | \
-                clean_response | tee "$response_file"
+                filter_response "$model_name" | tee "$response_file"
         else
             # Other models: Use token limit
             local token_arg=""
@@ -1009,13 +1207,14 @@ chat_interactive() {
             eval container_run '"$container_model"' \
                 -t '"$threads"' \
                 -c '"$ctx_size"' \
+                $batch_arg \
                 -p '"$formatted_prompt"' \
                 $token_arg \
                 $model_args \
                 $stop_args \
                 --log-disable \
                 --no-display-prompt 2>/dev/null | \
-                clean_response | \
+                filter_response "$model_name" | \
                 tee "$response_file"
         fi
 
@@ -1023,18 +1222,25 @@ chat_interactive() {
         rm -f "$response_file"
         echo ""
 
+        if [[ -n "$context_window" ]]; then
+            [[ -n "$response" ]] && python3 "$context_window" append "$state_file" "$user_input" "$response" 2>/dev/null || true
+            continue
+        fi
+
         # Append to history file using model-specific format
         local history_entry=$(build_history_entry "$model_name" "$user_input" "$response")
         echo "$history_entry" >> "$history_file"
 
-        # Trim history to last 4 exchanges (keep file under ~2000 bytes)
-        if [[ $(wc -c < "$history_file") -gt 2000 ]]; then
-            tail -c 1500 "$history_file" > "${history_file}.tmp"
+        # Trim history (~3 bytes per token; keep file under ~2000 bytes by default)
+        local max_bytes=2000
+        [[ "$history_tokens" -gt 0 ]] 2>/dev/null && max_bytes=$((history_tokens * 3))
+        if [[ $(wc -c < "$history_file") -gt $max_bytes ]]; then
+            tail -c $((max_bytes * 3 / 4)) "$history_file" > "${history_file}.tmp"
             mv "${history_file}.tmp" "$history_file"
         fi
     done
 
-    rm -f "$history_file"
+    rm -f "$history_file" "$state_file"
     echo ""
     log_info "Chat ended"
 }
@@ -1046,6 +1252,8 @@ chat_interactive() {
 SERVER_PID_FILE="$DATA_DIR/server.pid"
 SERVER_PORT="${SERVER_PORT:-8080}"
 API_PORT="${API_PORT:-8081}"
+BATCH_PORT="${BATCH_PORT:-8083}"
+TUNE_PORT="${TUNE_PORT:-8084}"
 
 # =============================================================================
 # PocketAI REST API (Full Control)
@@ -1555,13 +1763,16 @@ server_start() {
         return 0
     fi
 
-    local threads=$(config_get threads 4)
-    local ctx_size=$(config_get ctx_size 2048)
+    local threads ctx_size batch_size
+    read -r threads ctx_size batch_size <<< "$(model_settings "$model_path")"
+    local batch_arg=""
+    [[ -n "$batch_size" ]] && batch_arg="-b $batch_size"
     local container_model="$CONTAINER_MODELS/$(basename "$model_path")"
 
     log_step "Starting PocketAI API Server"
     log_info "Model: $(basename "$model_path")"
     log_info "Port: $SERVER_PORT"
+    log_info "Threads: $threads, context: $ctx_size${batch_size:+, batch: $batch_size}"
     log_info "Endpoint: http://localhost:$SERVER_PORT/v1/chat/completions"
 
     # Start server in background inside proot container
@@ -1572,6 +1783,7 @@ server_start() {
         -m "$container_model" \
         -t "$threads" \
         -c "$ctx_size" \
+        $batch_arg \
         --server \
         --host 0.0.0.0 \
         --port "$SERVER_PORT" \
@@ -1663,6 +1875,114 @@ server_info() {
     echo ""
 }
 
+# =============================================================================
+# Batch Inference
+# =============================================================================
+
+# Usage: batch_run <input.jsonl> [-o out.ndjson] [--max-tokens N] [--order submitted|completed]
+# Loads the model once in a private llamafile server on BATCH_PORT and sends
+# every item to it (data/batch.py). Results go to stdout, or to the -o file,
+# which doubles as the checkpoint: running the same command again resumes.
+batch_run() {
+    local input="${1:-}"
+    shift || true
+    local model_path="${PAI_MODEL:-$(config_get active_model)}"
+
+    if [[ -z "$model_path" || ! -f "$model_path" ]]; then
+        log_error "No model active. Run: pai install qwen3"
+        return 1
+    fi
+    if [[ -z "$input" || ( "$input" != "-" && ! -f "$input" ) ]]; then
+        log_error "Input file not found: $input"
+        return 1
+    fi
+    if ! command -v python3 &>/dev/null || [[ ! -f "$DATA_DIR/batch.py" ]]; then
+        log_error "pai batch needs python3"
+        return 1
+    fi
+
+    local threads ctx_size batch_size
+    read -r threads ctx_size batch_size <<< "$(model_settings "$model_path")"
+    local batch_arg=""
+    [[ -n "$batch_size" ]] && batch_arg="-b $batch_size"
+    local container_model="$CONTAINER_MODELS/$(basename "$model_path")"
+
+    log_info "Loading $(basename "$model_path") for the batch (port $BATCH_PORT)" >&2
+    proot-distro login "$CONTAINER_NAME" \
+        --bind "$POCKETAI_ROOT/data:/opt/pocketai/data" \
+        --bind "$POCKETAI_ROOT/models:/opt/pocketai/models" \
+        -- "$CONTAINER_BIN" \
+        -m "$container_model" \
+        -t "${threads:-4}" \
+        -c "${ctx_size:-2048}" \
+        $batch_arg \
+        --server \
+        --host 127.0.0.1 \
+        --port "$BATCH_PORT" \
+        >/dev/null 2>&1 &
+    local pid=$!
+    trap "kill $pid 2>/dev/null" EXIT
+
+    local status=0
+    python3 "$DATA_DIR/batch.py" run "$input" --port "$BATCH_PORT" --model "$(basename "$model_path")" "$@" || status=$?
+
+    kill "$pid" 2>/dev/null || true
+    wait "$pid" 2>/dev/null || true
+    trap - EXIT
+    return $status
+}
+
+# =============================================================================
+# Autotuning
+# =============================================================================
+
+# Usage: tune_run [model] [--quick]
+# Starts the model (the active one by default) in a private llamafile server
+# on TUNE_PORT once per setting, measures prompt and generation speed, and
+# saves the fastest threads/batch/ctx as this device's profile for it
+# (data/autotune.py). model_settings picks the profile up from then on.
+tune_run() {
+    local model_path=""
+    if [[ -n "${1:-}" && "$1" != -* ]]; then
+        local f
+        for f in "$MODELS_DIR"/*.gguf; do
+            [[ -f "$f" && "$f" == *"$1"* ]] && { model_path="$f"; break; }
+        done
+        if [[ -z "$model_path" ]]; then
+            log_error "Model not found: $1"
+            return 1
+        fi
+        shift
+    else
+        model_path=$(config_get active_model)
+        if [[ -z "$model_path" || ! -f "$model_path" ]]; then
+            log_error "No model active. Run: pai install qwen3"
+            return 1
+        fi
+    fi
+    if ! command -v python3 &>/dev/null || [[ ! -f "$DATA_DIR/autotune.py" ]]; then
+        log_error "pai tune needs python3"
+        return 1
+    fi
+    if server_status >/dev/null 2>&1; then
+        log_warn "pai server is running; it competes for CPU and RAM, so results may be low"
+    fi
+
+    local threads=$(config_get threads 4)
+    local ctx_size=$(config_get ctx_size 2048)
+    python3 "$DATA_DIR/autotune.py" run "$model_path" --root "$POCKETAI_ROOT" --port "$TUNE_PORT" \
+        --threads "${threads:-4}" --ctx "${ctx_size:-2048}" "$@"
+}
+
+tune_show() {
+    python3 "$DATA_DIR/autotune.py" show "$@"
+}
+
+# Usage: tune_reset [model]  (every profile of this device without a model)
+tune_reset() {
+    python3 "$DATA_DIR/autotune.py" reset "$@"
+}
+
 # =============================================================================
 # System Info
 # =============================================================================
@@ -1694,12 +2014,14 @@ system_info() {
 # =============================================================================
 
 # Make functions available when sourced
-export -f config_get config_set
+export -f config_get config_set config_write
 export -f container_exists container_create container_exec container_run
 export -f engine_installed engine_install engine_version
-export -f model_list_available model_list_installed model_install model_activate model_remove model_verify_file model_verify_all
-export -f get_model_family build_prompt build_history_entry get_model_args get_stop_sequences clean_response
-export -f infer infer_stream chat_interactive system_info
+export -f model_list_available model_list_installed model_install model_download model_activate model_remove model_verify_file model_verify_all
+export -f get_model_family build_prompt build_history_entry get_model_args get_stop_sequences clean_response filter_response
+export -f infer infer_stream infer_prompt_stream chat_interactive system_info
 export -f server_start server_stop server_status server_info
+export -f batch_run
+export -f model_settings tune_run tune_show tune_reset
 export -f api_start api_stop
 export -f log_info log_success log_warn log_error log_step
@@ -1,9 +1,24 @@
 #!/usr/bin/env python3
+import asyncio
+import concurrent.futures
+import email.parser
+import email.utils
+import fcntl
+import functools
+import http.client
 import http.server
+import io
+import itertools
 import socketserver
+import heapq
 import json
+import math
 import subprocess
 import os
+import pty
+import re
+import shutil
+import socket
 import sys
 import time
 import signal
@@ -12,8 +27,27 @@ import threading
 from urllib.parse import urlparse, parse_qs
 from datetime import datetime
 
+import autotune
+import batch
+from cancellation import DisconnectMonitor, GenerationRegistry, Reaper, exit_status
+import context_window
+import gguf
+import prompt_templates
+from response_cache import ResponseCache, cache_key
+from downloader import DownloadError, Downloader, parse_rate
+from governor import Governor
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from model_index import ModelIndex
+import model_verify
+from sessions import SessionStore
+from shell_workers import ShellCommand, ShellWorkerPool
+from static_files import StaticFiles
+import stream_filter
+import warm_pool
+
 PORT = int(os.environ.get('API_PORT', 8081))
 POCKETAI_ROOT = os.environ.get('POCKETAI_ROOT', '/data/data/com.termux/files/home/PocketAi')
+BASH = os.environ.get('POCKETAI_BASH', '/data/data/com.termux/files/usr/bin/bash')
 
 # =============================================================================
 # Logging
@@ -42,6 +76,257 @@ def get_request_id():
         _request_count += 1
         return _request_count
 
+# =============================================================================
+# Metrics
+# =============================================================================
+# Served in Prometheus text format on /api/metrics. Values that already live
+# elsewhere (active streams, scheduler and cache counters) are read at scrape
+# time; the rest are recorded where the event happens.
+_metrics = Registry()
+
+_request_seconds = _metrics.histogram(
+    'pocketai_http_request_duration_seconds', 'API request latency (streams: until the last event)',
+    labelnames=('method', 'route'))
+_spawn_seconds = _metrics.histogram(
+    'pocketai_spawn_seconds', 'Time to start an engine.sh or llamafile subprocess',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5), labelnames=('kind',))
+_first_byte_seconds = _metrics.histogram(
+    'pocketai_first_byte_seconds', 'Time from starting a generation to the first output from llamafile',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120), labelnames=('backend',))
+_tokens_per_second = _metrics.histogram(
+    'pocketai_stream_tokens_per_second', 'Streaming generation rate after the first token',
+    buckets=(0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 100), labelnames=('backend',))
+_queue_wait_seconds = _metrics.histogram(
+    'pocketai_queue_wait_seconds', 'Time spent waiting for an inference slot',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300))
+_timeouts = _metrics.counter(
+    'pocketai_timeouts_total', 'Generations and commands stopped by a timeout (overall, idle, command)',
+    ('kind',))
+_client_disconnects = _metrics.counter(
+    'pocketai_client_disconnects_total', 'Clients that went away before their response was complete')
+_cache_lookups = _metrics.counter(
+    'pocketai_cache_lookups_total', 'Cache lookups by cache and result', ('cache', 'result'))
+_batch_items = _metrics.counter(
+    'pocketai_batch_items_total', 'Batch items answered, by result (ok, error)', ('result',))
+
+def cache_hit_ratios():
+    """Hit ratio per cache for the pocketai_cache_hit_ratio gauge"""
+    ratios = {}
+    for cache in ('status', 'models', 'response'):
+        hits = _cache_lookups.get(cache=cache, result='hit')
+        total = hits + _cache_lookups.get(cache=cache, result='miss')
+        ratios[(cache,)] = round(hits / total, 4) if total else 0
+    return ratios
+
+_metrics.gauge('pocketai_cache_hit_ratio', 'Share of cache lookups answered from cache', cache_hit_ratios, ('cache',))
+_metrics.gauge('pocketai_active_streams', 'Generations currently streaming', lambda: _active_streams)
+_metrics.gauge('pocketai_inference_active', 'Inference slots in use', lambda: _scheduler['active'])
+_metrics.gauge('pocketai_inference_queued', 'Requests waiting for an inference slot', lambda: len(_scheduler['queue']))
+_metrics.counter_func('pocketai_inference_rejected_total', 'Requests rejected with 429 (queue full or queue timeout)',
+                      lambda: _scheduler['rejected'] + _scheduler['timed_out'])
+_metrics.counter_func('pocketai_engine_restarts_total', 'Resident engine restarts', lambda: _engine['restarts'])
+_metrics.gauge('pocketai_engine_warm_models', 'Models loaded in resident engines', lambda: len(_engine_pool))
+_metrics.counter_func('pocketai_engine_loads_total', 'Resident engines started for a model that was not warm',
+                      lambda: _engine['loads'])
+_metrics.counter_func('pocketai_engine_evictions_total', 'Warm models unloaded to make room for another',
+                      lambda: _engine_pool.evictions)
+_metrics.gauge('pocketai_sessions', 'Stored chat sessions', lambda: len(_sessions.sessions))
+_metrics.counter_func('pocketai_session_evictions_total', 'Chat sessions evicted by the disk budget',
+                      lambda: _sessions.evictions)
+_metrics.gauge('pocketai_jobs', 'Background jobs by state (finished ones within JOB_HISTORY)',
+               lambda: {(state,): n for state, n in job_counts().items()}, ('state',))
+_metrics.gauge('pocketai_shell_workers', 'Persistent bash workers with engine.sh sourced', lambda: _shell_workers.workers)
+_metrics.counter_func('pocketai_shell_worker_commands_total', 'engine.sh commands run on a shell worker',
+                      lambda: _shell_workers.commands)
+_metrics.counter_func('pocketai_shell_worker_misses_total', 'Commands that spawned bash because every worker was busy',
+                      lambda: _shell_workers.misses)
+_metrics.gauge('pocketai_generations', 'Generations registered for cancellation', lambda: len(_generations))
+_metrics.counter_func('pocketai_generations_cancelled_total', 'Generations cancelled by reason (cancelled, disconnected, reset)',
+                      lambda: {(reason,): n for reason, n in _generations.cancelled.items()}, ('reason',))
+_metrics.counter_func('pocketai_process_kills_total', 'Process groups that needed SIGKILL after CANCEL_GRACE',
+                      lambda: _reaper.killed)
+_metrics.gauge('pocketai_governor_level', 'Resource governor level per resource (0 ok, 1 elevated, 2 critical)',
+               lambda: governor_levels(), ('resource',))
+_metrics.gauge('pocketai_memory_available_bytes', 'MemAvailable at the last governor sample',
+               lambda: _governor.current()['mem_available'] or 0)
+_metrics.counter_func('pocketai_governor_decisions_total', 'Governor decisions (admit, refuse, throttle, install, level)',
+                      lambda: {(action,): n for action, n in _governor.counts.items()}, ('action',))
+
+# Fixed API paths; anything else is reported as "other" to bound label values
+METRIC_ROUTES = (
+    '/api/health', '/api/metrics', '/api/reset', '/api/status', '/api/config',
+    '/api/models', '/api/models/installed', '/api/models/install', '/api/models/remove',
+    '/api/models/use', '/api/models/verify', '/api/chat', '/api/chat/stream', '/api/chat/batch',
+    '/api/sessions', '/api/jobs', '/api/governor', '/api/tune',
+)
+
+def metric_route(path):
+    """Route label for a request path"""
+    if not path.startswith('/api/'):
+        return 'static'
+    if path.startswith('/api/sessions/'):
+        route = parse_session_path(path)
+        return '/api/sessions/:id' + (f'/{route[1]}' if route and route[1] else '')
+    if path.startswith('/api/jobs/'):
+        return '/api/jobs/:id'
+    if path.startswith('/api/models/install/'):
+        return '/api/models/install/:id'
+    if path.startswith('/api/chat/cancel/'):
+        return '/api/chat/cancel/:id'
+    return path if path in METRIC_ROUTES else 'other'
+
+def observe_stream_rate(backend, tokens, first_at, end_at):
+    """Record tokens/sec between the first and last token of a stream"""
+    if tokens > 1 and end_at > first_at:
+        _tokens_per_second.observe((tokens - 1) / (end_at - first_at), backend=backend)
+
+# =============================================================================
+# Config store
+# =============================================================================
+# data/config is parsed once and re-read only when its (mtime, size, inode)
+# changes, so reads are dict lookups. Writes take the same lock file as
+# engine.sh's config_set, re-read the file, apply a batch of changes and
+# replace it atomically (temp file + fsync + rename).
+CONFIG_KEY_RE = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+_config = {
+    'values': {},
+    'lines': [],      # Raw lines so comments and order survive writes
+    'stamp': None,    # (mtime_ns, size, inode) of the parsed file
+    'loaded': False,
+    'listeners': [],  # fn(changes) with changes = {key: (old, new)}
+}
+_config_lock = threading.Lock()
+
+def get_config_file():
+    """Get config file path"""
+    return os.path.join(POCKETAI_ROOT, 'data', 'config')
+
+def on_config_change(fn):
+    """Register fn(changes) to run after any config change (API, CLI or editor)"""
+    _config['listeners'].append(fn)
+    return fn
+
+def _config_stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        return None
+
+def _config_parse(lines):
+    values = {}
+    for line in lines:
+        line = line.strip()
+        if '=' in line and not line.startswith('#'):
+            k, v = line.split('=', 1)
+            values.setdefault(k, v)
+    return values
+
+def _config_read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.readlines()
+    except FileNotFoundError:
+        return []
+
+def _config_apply_locked(lines, stamp):
+    """Install parsed lines as current config; returns {key: (old, new)}"""
+    old = _config['values']
+    new = _config_parse(lines)
+    _config['lines'] = lines
+    _config['values'] = new
+    _config['stamp'] = stamp
+    if not _config['loaded']:
+        _config['loaded'] = True
+        return {}
+    return {k: (old.get(k), new.get(k)) for k in set(old) | set(new) if old.get(k) != new.get(k)}
+
+def _config_notify(changes):
+    for fn in _config['listeners']:
+        try:
+            fn(changes)
+        except Exception as e:
+            log_error(f"Config listener failed: {e}")
+
+def config_values():
+    """Current config as a dict; do not modify (it is replaced on reload)"""
+    path = get_config_file()
+    changes = {}
+    with _config_lock:
+        stamp = _config_stamp(path)
+        if stamp != _config['stamp'] or not _config['loaded']:
+            try:
+                changes = _config_apply_locked(_config_read(path), stamp)
+            except OSError as e:
+                log_warn(f"Config read failed: {e}")
+        values = _config['values']
+    _config_notify(changes)
+    return values
+
+def config_update(updates):
+    """Write {key: value} updates to data/config in one atomic replace
+
+    Raises ValueError for keys or values that would break the file format.
+    """
+    for key, value in updates.items():
+        if not CONFIG_KEY_RE.match(key):
+            raise ValueError(f"Invalid config key: {key!r}")
+        if '\n' in str(value) or '\r' in str(value):
+            raise ValueError(f"Invalid value for {key}: newlines are not allowed")
+
+    path = get_config_file()
+    with _config_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Re-read under the lock so a concurrent `pai config set` is kept
+            lines = _config_read(path)
+            pending = dict(updates)
+            for i, line in enumerate(lines):
+                key = line.split('=', 1)[0]
+                if '=' in line and key in pending:
+                    lines[i] = f'{key}={pending.pop(key)}\n'
+            if lines and not lines[-1].endswith('\n'):
+                lines[-1] += '\n'
+            lines.extend(f'{k}={v}\n' for k, v in pending.items())
+
+            tmp = f'{path}.tmp.{os.getpid()}.{threading.get_ident()}'
+            try:
+                with open(tmp, 'w') as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+            dir_fd = os.open(os.path.dirname(path), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            changes = _config_apply_locked(lines, _config_stamp(path))
+    _config_notify(changes)
+    return changes
+
+def get_config_value_fast(key, default=''):
+    """Get a config value from the in-memory config (no shell)"""
+    return config_values().get(key, default)
+
+def get_active_model_fast():
+    """Get active model from the in-memory config (no shell)"""
+    return get_config_value_fast('active_model')
+
+def set_active_model_fast(model_path):
+    """Set active model in config file directly (no shell)"""
+    try:
+        config_update({'active_model': model_path})
+        return True
+    except Exception as e:
+        log_error(f"set_active_model_fast failed: {e}")
+        return False
+
 # =============================================================================
 # Cache for expensive operations
 # =============================================================================
@@ -54,12 +339,12 @@ _status_cache = {
 
 _models_cache = {
     'catalog': None,
-    'installed': None,
-    'installed_time': 0,
     'catalog_ttl': 300,  # 5 min for catalog (rarely changes)
-    'installed_ttl': 10  # 10 sec for installed (can change)
 }
 
+# Installed models: rescanned only when models/ changes (inotify or dir mtime)
+_model_index = ModelIndex(os.path.join(POCKETAI_ROOT, 'models'))
+
 # Model catalog - hardcoded for instant access
 # Order matters for matching - more specific patterns first
 MODEL_CATALOG = {
@@ -84,141 +369,201 @@ def get_models_dir():
     """Get models directory path"""
     return os.path.join(POCKETAI_ROOT, 'models')
 
-def get_config_file():
-    """Get config file path"""
-    return os.path.join(POCKETAI_ROOT, 'data', 'config')
+def format_size(size_bytes):
+    """Human-readable model file size"""
+    if size_bytes >= 1024 * 1024 * 1024:
+        return f"{size_bytes / (1024*1024*1024):.1f}GB"
+    return f"{size_bytes / (1024*1024):.0f}MB"
 
-def get_active_model_fast():
-    """Get active model from config file directly (no shell)"""
-    try:
-        config_file = get_config_file()
-        if os.path.exists(config_file):
-            with open(config_file, 'r') as f:
-                for line in f:
-                    if line.startswith('active_model='):
-                        return line.strip().split('=', 1)[1]
-    except:
-        pass
-    return ''
+def get_installed_models_fast():
+    """Get installed models from the model index (no directory scan)"""
+    changed = _model_index.refresh()
+    _cache_lookups.inc(cache='models', result='miss' if changed else 'hit')
 
-def set_active_model_fast(model_path):
-    """Set active model in config file directly (no shell)"""
+    active = get_active_model_fast()
+    active_name = os.path.basename(active) if active else ''
+    warm = engine_warm_models()
+    models = []
+    for entry in _model_index.list():
+        model = {
+            'name': entry['name'],
+            'size': format_size(entry['size']),
+            'active': entry['path'] == active or entry['name'] == active_name,
+            'warm': entry['path'] in warm
+        }
+        # Header metadata parsed once per (size, mtime, inode)
+        model.update(entry['meta'])
+        models.append(model)
+    return models
+
+def activate_model_fast(model_name):
+    """Activate model using Python (no shell)"""
+    entry = _model_index.find(model_name)
+    if entry is None:
+        return False, f"Model not found: {model_name}"
     try:
-        config_file = get_config_file()
-        lines = []
-        found = False
+        if set_active_model_fast(entry['path']):
+            # Status and response caches are dropped by the config listeners
+            return True, f"Activated: {entry['name']}"
+        return False, "Failed to update config"
+    except Exception as e:
+        return False, str(e)
 
-        if os.path.exists(config_file):
-            with open(config_file, 'r') as f:
-                for line in f:
-                    if line.startswith('active_model='):
-                        lines.append(f'active_model={model_path}\n')
-                        found = True
-                    else:
-                        lines.append(line)
+def request_model(data):
+    """Model file a chat request runs on; returns (path, None) or (None, error message)
 
-        if not found:
-            lines.append(f'active_model={model_path}\n')
+    data['model'] may name any installed model; without it the active model
+    is used. The active model setting is not changed.
+    """
+    name = data.get('model')
+    if not name:
+        return get_active_model_fast(), None
+    entry = _model_index.find(str(name))
+    if entry is None:
+        return None, f"Model not found: {name}"
+    return entry['path'], None
 
-        with open(config_file, 'w') as f:
-            f.writelines(lines)
-        return True
-    except Exception as e:
-        log_error(f"set_active_model_fast failed: {e}")
-        return False
+def request_max_tokens(data):
+    """Token limit a chat request asks for; returns (limit or '', None) or (None, error message)"""
+    value = data.get('max_tokens')
+    if value is None or value == '':
+        return '', None
+    try:
+        limit = int(value)
+    except (TypeError, ValueError, OverflowError):
+        limit = 0
+    if isinstance(value, bool) or limit < 1:
+        return None, 'max_tokens must be a positive integer'
+    return limit, None
 
-def get_installed_models_fast():
-    """Get installed models using Python (no shell)"""
-    now = time.time()
+def model_env(model_path):
+    """Environment making engine.sh's infer functions use model_path instead of the active model
 
-    # Return cache if fresh
-    if (_models_cache['installed'] is not None and
-        now - _models_cache['installed_time'] < _models_cache['installed_ttl']):
-        return _models_cache['installed']
+    Also carries the model's tuned settings, lowered by the governor under pressure.
+    """
+    env = governor_env(model_path)
+    if model_path:
+        env['PAI_MODEL'] = model_path
+    return env or None
 
-    models = []
-    models_dir = get_models_dir()
-    active = get_active_model_fast()
+def infer_command(message, max_tokens='', model_path=None, stream=False):
+    """infer (or infer_stream) command and environment for a chat message
 
-    try:
-        if os.path.isdir(models_dir):
-            for f in os.listdir(models_dir):
-                if f.endswith('.gguf'):
-                    filepath = os.path.join(models_dir, f)
-                    try:
-                        size_bytes = os.path.getsize(filepath)
-                        if size_bytes >= 1024 * 1024 * 1024:
-                            size_str = f"{size_bytes / (1024*1024*1024):.1f}GB"
-                        else:
-                            size_str = f"{size_bytes / (1024*1024):.0f}MB"
-                    except:
-                        size_str = "?"
-
-                    models.append({
-                        'name': f,
-                        'size': size_str,
-                        'active': filepath == active or f in active
-                    })
-    except Exception as e:
-        log_error(f"get_installed_models_fast failed: {e}")
+    The message and token limit go through the environment, so nothing from
+    the request is ever part of the command line.
+    """
+    env = dict(model_env(model_path) or {})
+    env.update({'PAI_MESSAGE': message, 'PAI_MAX_TOKENS': str(max_tokens or '')})
+    return f'{"infer_stream" if stream else "infer"} "$PAI_MESSAGE" "$PAI_MAX_TOKENS"', env
 
-    _models_cache['installed'] = models
-    _models_cache['installed_time'] = now
-    return models
+def get_verify_cache():
+    """Verification results shared with `pai verify` (data/verify_cache.json)"""
+    return model_verify.VerifyCache(os.path.join(POCKETAI_ROOT, 'data', 'verify_cache.json'))
 
-def activate_model_fast(model_name):
-    """Activate model using Python (no shell)"""
-    models_dir = get_models_dir()
-
-    try:
-        if os.path.isdir(models_dir):
-            for f in os.listdir(models_dir):
-                if f.endswith('.gguf') and model_name.lower() in f.lower():
-                    filepath = os.path.join(models_dir, f)
-                    if set_active_model_fast(filepath):
-                        # Invalidate caches
-                        _status_cache['last_update'] = 0
-                        _models_cache['installed_time'] = 0
-                        return True, f"Activated: {f}"
-                    else:
-                        return False, "Failed to update config"
-        return False, f"Model not found: {model_name}"
-    except Exception as e:
-        return False, str(e)
+def verify_model_fast(model_name, mode='quick', recheck=False):
+    """Verify an installed model in-process; unchanged files answer from the verify cache"""
+    entry = _model_index.find(model_name)
+    if entry is None:
+        return {'success': False, 'message': f"Model not found: {model_name}"}
+    if mode not in model_verify.MODES:
+        return {'success': False, 'message': f"Unknown verify mode: {mode}"}
+    result = model_verify.verify_models([entry['path']], mode, get_verify_cache(), jobs=1,
+                                        use_cache=not recheck)[0]
+    return {
+        'success': result['ok'],
+        'model': entry['name'],
+        'mode': mode,
+        'detail': result['detail'],
+        'cached': result['cached'],
+        'message': 'Model verified' if result['ok'] else 'Model corrupted or not found'
+    }
+
+def models_changed():
+    """Drop model-derived caches after an install or remove"""
+    _model_index.invalidate()
+    _status_cache['last_update'] = 0
 
 def get_cached_status():
     """Get cached status or refresh if stale - uses fast Python methods"""
     try:
         now = time.time()
         if now - _status_cache['last_update'] > _status_cache['cache_ttl']:
+            _cache_lookups.inc(cache='status', result='miss')
             # Use fast Python method instead of shell
             model = get_active_model_fast()
             _status_cache['model'] = os.path.basename(model) if model else ''
             _status_cache['version'] = os.environ.get('VERSION', '2.0')
             _status_cache['last_update'] = now
+        else:
+            _cache_lookups.inc(cache='status', result='hit')
         return _status_cache['model'], _status_cache['version']
     except Exception as e:
         log_error(f"get_cached_status failed: {e}")
         return _status_cache.get('model', ''), _status_cache.get('version', '')
 
+@on_config_change
+def status_config_changed(changes):
+    if 'active_model' in changes:
+        _status_cache['last_update'] = 0
+
 # =============================================================================
 # Command execution
 # =============================================================================
-def run_cmd(cmd, timeout=30):
-    """Run shell command with optional timeout and error handling"""
+# engine.sh commands run on persistent bash workers (data/shell_workers.py)
+# that source the script once, instead of a bash start and a full parse of
+# engine.sh per call. A command finding every worker busy is spawned as
+# before; SHELL_WORKERS=0 spawns every command.
+SHELL_WORKERS = int(os.environ.get('SHELL_WORKERS', 2))
+SHELL_WORKER_MAX_COMMANDS = int(os.environ.get('SHELL_WORKER_MAX_COMMANDS', 100))
+
+_shell_workers = ShellWorkerPool(BASH, os.path.join(POCKETAI_ROOT, 'core', 'engine.sh'),
+                                 SHELL_WORKERS, SHELL_WORKER_MAX_COMMANDS)
+
+# Generations are registered under their request ID (X-Request-ID) together
+# with the process groups they start (data/cancellation.py). A cancel request,
+# a client closing its connection, or /api/reset ends exactly those groups:
+# SIGTERM at once, SIGKILL from a background thread after CANCEL_GRACE
+# seconds, so no handler waits for a process to die.
+CANCEL_GRACE = float(os.environ.get('CANCEL_GRACE', 2))
+DISCONNECT_CHECK = 0.25  # seconds between checks for clients that closed the connection
+
+_reaper = Reaper(CANCEL_GRACE)
+_generations = GenerationRegistry(_reaper)
+_disconnects = DisconnectMonitor(DISCONNECT_CHECK)
+
+def end_process(process, generation=None):
+    """Hand a process that may still run to the reaper (unless a cancel already did)"""
+    owned = generation.detach(process) if generation is not None else True
+    if owned and exit_status(process) is None:
+        log_debug(f"Ending process group {process.pid}")
+        _reaper.terminate(process)
+
+def run_cmd(cmd, timeout=30, env=None, generation=None):
+    """Run shell command with optional timeout and error handling
+
+    env adds variables; a generation owns the process, so cancelling it ends the command.
+    """
     process = None
     try:
-        process = subprocess.Popen(
-            f'source {POCKETAI_ROOT}/core/engine.sh && {cmd}',
-            shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            text=True, executable='/data/data/com.termux/files/usr/bin/bash',
-            preexec_fn=os.setsid  # Create new process group for clean kill
-        )
+        spawn_start = time.monotonic()
+        process = _shell_workers.popen(cmd, env)
+        if process is None:
+            process = subprocess.Popen(
+                f'source {POCKETAI_ROOT}/core/engine.sh && {cmd}',
+                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                text=True, executable=BASH,
+                env=dict(os.environ, **env) if env else None,
+                preexec_fn=os.setsid  # Create new process group for clean kill
+            )
+        _spawn_seconds.observe(time.monotonic() - spawn_start, kind='command')
+        if generation is not None:
+            generation.attach(process)
         # timeout=None means wait forever
         stdout, stderr = process.communicate(timeout=timeout)
         return stdout.strip(), process.returncode == 0
     except subprocess.TimeoutExpired:
         log_error(f"Command timed out after {timeout}s: {cmd[:50]}...")
+        _timeouts.inc(kind='command')
         if process:
             try:
                 os.killpg(process.pid, signal.SIGKILL)
@@ -226,7 +571,7 @@ def run_cmd(cmd, timeout=30):
                 pass
             try:
                 process.kill()
-                process.wait(timeout=1)
+                process.communicate(timeout=1)
             except:
                 pass
         return f"Command timed out after {timeout}s", False
@@ -235,46 +580,13 @@ def run_cmd(cmd, timeout=30):
         if process:
             try:
                 process.kill()
+                process.communicate(timeout=1)
             except:
                 pass
         return str(e), False
-
-def run_cmd_async(cmd, timeout=30, callback=None):
-    """Run command in background thread with timeout"""
-    result = {'output': '', 'success': False, 'done': False}
-
-    def worker():
-        try:
-            out, ok = run_cmd(cmd, timeout=timeout)
-            result['output'] = out
-            result['success'] = ok
-        except Exception as e:
-            result['output'] = str(e)
-            result['success'] = False
-        finally:
-            result['done'] = True
-            if callback:
-                callback(result)
-
-    thread = threading.Thread(target=worker, daemon=True)
-    thread.start()
-    return result, thread
-
-def kill_process_tree(pid):
-    """Kill process and all its children"""
-    try:
-        # Kill entire process group
-        os.killpg(pid, signal.SIGTERM)
-        time.sleep(0.5)
-        os.killpg(pid, signal.SIGKILL)
-    except (OSError, ProcessLookupError):
-        pass
-
-    # Also try to kill any leftover llamafile processes
-    try:
-        subprocess.run(['pkill', '-f', 'llamafile.*-m'], timeout=2, capture_output=True)
-    except:
-        pass
+    finally:
+        if process is not None and generation is not None:
+            generation.detach(process)
 
 def decode_utf8_safe(data, leftover=b''):
     """Decode UTF-8 bytes safely, handling incomplete multi-byte sequences"""
@@ -294,9 +606,15 @@ def decode_utf8_safe(data, leftover=b''):
         # If all else fails, replace bad bytes
         return combined.decode('utf-8', errors='replace'), b''
 
-def run_cmd_stream(cmd, timeout=300):
-    """Run shell command and yield output in real-time using PTY"""
-    import pty
+def run_cmd_stream(cmd, timeout=300, status=None, env=None, generation=None, deadline=None):
+    """Run shell command and yield output in real-time using PTY
+
+    If a status dict is given, status['complete'] is set when the command
+    ran to the end and exited 0 (no timeout, no error). env adds variables
+    for the command (for values that should not go through shell quoting).
+    A generation owns the process: cancelling it ends the stream. With a
+    FlushDeadline, '' is yielded when it passes while no output arrives.
+    """
     import select
 
     global _active_streams
@@ -314,39 +632,62 @@ def run_cmd_stream(cmd, timeout=300):
         master_fd, slave_fd = pty.openpty()
 
         # Use process group so we can kill all children
-        process = subprocess.Popen(
-            f'source {POCKETAI_ROOT}/core/engine.sh && {cmd}',
-            shell=True,
-            stdout=slave_fd,
-            stderr=slave_fd,  # Merge stderr to stdout
-            executable='/data/data/com.termux/files/usr/bin/bash',
-            preexec_fn=os.setsid  # Create new process group
-        )
+        spawn_start = time.monotonic()
+        process = _shell_workers.popen(cmd, env, stdout=os.ttyname(slave_fd), merge_stderr=True)
+        if process is None:
+            process = subprocess.Popen(
+                f'source {POCKETAI_ROOT}/core/engine.sh && {cmd}',
+                shell=True,
+                stdout=slave_fd,
+                stderr=slave_fd,  # Merge stderr to stdout
+                executable=BASH,
+                env=dict(os.environ, **env) if env else None,
+                preexec_fn=os.setsid  # Create new process group
+            )
+        _spawn_seconds.observe(time.monotonic() - spawn_start, kind='stream')
+        if generation is not None:
+            generation.attach(process)
         os.close(slave_fd)
         slave_fd = None
 
-        token_count = 0
+        byte_count = 0
+        reads = 0  # llamafile flushes every token, so each read is roughly one token
+        first_data_time = None
         last_data_time = time.time()
+        timed_out = False
 
         while True:
             now = time.time()
 
+            if generation is not None and generation.cancelled:
+                log_info(f"Stream cancelled ({generation.reason})")
+                break
+
             # Check overall timeout
             if now - start_time > timeout:
                 log_warn(f"Stream timeout after {timeout}s")
+                _timeouts.inc(kind='overall')
+                timed_out = True
                 break
 
             # Check idle timeout (no data for 60s)
             if now - last_data_time > 60:
                 log_warn(f"Stream idle timeout (no data for 60s)")
+                _timeouts.inc(kind='idle')
+                timed_out = True
                 break
 
-            ready, _, _ = select.select([master_fd], [], [], 0.5)
+            poll = 0.5 if deadline is None else deadline.wait(0.5)
+            ready, _, _ = select.select([master_fd], [], [], poll)
             if ready:
                 try:
                     data = os.read(master_fd, 4096)  # Read larger chunks
                     if data:
-                        token_count += len(data)
+                        if first_data_time is None:
+                            first_data_time = time.time()
+                            _first_byte_seconds.observe(first_data_time - start_time, backend='spawn')
+                        byte_count += len(data)
+                        reads += 1
                         last_data_time = now
                         # Safely decode UTF-8, preserving incomplete sequences for next read
                         text, utf8_buffer = decode_utf8_safe(data, utf8_buffer)
@@ -381,9 +722,19 @@ def run_cmd_stream(cmd, timeout=300):
                     if utf8_buffer:
                         yield utf8_buffer.decode('utf-8', errors='replace')
                     break
+                if deadline is not None and deadline.at is not None:
+                    yield ''  # let the consumer flush what it is holding
+
+        if status is not None and not timed_out and not (generation is not None and generation.cancelled):
+            try:
+                status['complete'] = process.wait(timeout=2) == 0
+            except subprocess.TimeoutExpired:
+                pass
 
         duration = time.time() - start_time
-        log_info(f"Stream complete: {token_count} chars in {duration:.1f}s")
+        if first_data_time is not None:
+            observe_stream_rate('spawn', reads, first_data_time, last_data_time)
+        log_info(f"Stream complete: {byte_count} bytes in {duration:.1f}s")
 
     except GeneratorExit:
         log_warn("Stream generator closed by client")
@@ -408,301 +759,3496 @@ def run_cmd_stream(cmd, timeout=300):
             except:
                 pass
 
-        # Kill process tree
+        # Ends the process tree in the background if it is still running
         if process is not None:
-            try:
-                if process.poll() is None:
-                    log_debug(f"Killing process tree {process.pid}")
-                    kill_process_tree(process.pid)
-                process.wait(timeout=1)
-            except:
-                pass
+            end_process(process, generation)
 
         log_debug("Stream cleanup complete")
 
-class APIHandler(http.server.BaseHTTPRequestHandler):
-    # Suppress default logging
-    def log_message(self, format, *args):
-        pass
+# =============================================================================
+# Tuned settings
+# =============================================================================
+# `pai tune` and POST /api/tune save the fastest threads/batch/ctx of a model
+# on this device in data/tune_profiles.json (data/autotune.py). Engines and
+# engine.sh commands run with them instead of the threads/ctx_size settings,
+# unless tune=off is set. The file is re-read when it changes.
+TUNE_TIMEOUT = int(os.environ.get('TUNE_TIMEOUT', 1800))  # whole sweep, seconds
 
-    # Socket-level timeout for all requests
-    timeout = 30
+_tune_profiles = autotune.ProfileStore(os.path.join(POCKETAI_ROOT, 'data', 'tune_profiles.json'))
 
-    def send_json(self, data, status=200):
-        try:
-            self.send_response(status)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-            self.end_headers()
-            self.wfile.write(json.dumps(data).encode())
-        except (BrokenPipeError, ConnectionResetError) as e:
-            log_debug(f"Client disconnected during JSON response: {e}")
-        except Exception as e:
-            log_error(f"send_json error: {e}")
+def model_settings(model_path=None):
+    """(threads, ctx_size, batch_size) for a model (the active one by default)
 
-    def send_error_json(self, message, status=500):
-        """Send error response as JSON"""
-        log_error(f"HTTP {status}: {message}")
-        self.send_json({'error': message, 'status': status}, status)
+    From its tune profile for this device, else the config; batch_size is
+    '' (llamafile's default) without a profile.
+    """
+    model_path = model_path or get_active_model_fast()
+    if model_path and get_config_value_fast('tune', 'on') != 'off':
+        profile = _tune_profiles.lookup(model_path)
+        if profile is not None:
+            return autotune.settings(profile)
+    threads = get_config_value_fast('threads', '4') or '4'
+    ctx_size = get_config_value_fast('ctx_size', '2048') or '2048'
+    return threads, ctx_size, ''
 
-    def send_sse_stream(self, generator):
-        """Send Server-Sent Events stream with robust error handling"""
-        req_id = get_request_id()
-        log_info(f"[REQ-{req_id}] SSE stream started")
-        buffer = ""
-        token_count = 0
+def tune_view():
+    """GET /api/tune: this device and its tuned models"""
+    return {
+        'device': _tune_profiles.device,
+        'enabled': get_config_value_fast('tune', 'on') != 'off',
+        'profiles': _tune_profiles.profiles()
+    }
 
-        try:
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/event-stream')
-            self.send_header('Cache-Control', 'no-cache')
-            self.send_header('Connection', 'keep-alive')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('X-Request-ID', str(req_id))
-            self.end_headers()
+# =============================================================================
+# Resident inference engine
+# =============================================================================
+# With RESIDENT_ENGINE=1 the API keeps llamafile --server processes alive (the
+# same launch server_start does, bound to localhost) and proxies chat requests
+# to them, so models stay loaded instead of cold-starting proot per request.
+# Up to WARM_POOL_SIZE models stay warm, each on its own port from ENGINE_PORT
+# up. A request can name any installed model and is served by that model's
+# engine without changing the active model. A model that doesn't fit next to
+# the warm ones (MemAvailable minus WARM_POOL_RESERVE_MB) evicts idle engines,
+# least recently used first.
+RESIDENT_ENGINE = os.environ.get('RESIDENT_ENGINE', '').lower() in ('1', 'true', 'yes', 'on')
+ENGINE_PORT = int(os.environ.get('ENGINE_PORT', 8082))
+WARM_POOL_SIZE = max(1, int(os.environ.get('WARM_POOL_SIZE', 2)))
+WARM_POOL_RESERVE_MB = float(os.environ.get('WARM_POOL_RESERVE_MB', 256))
+PROC_ROOT = os.environ.get('PROC_ROOT', '/proc')
 
-            for char in generator:
-                buffer += char
-                token_count += 1
-                try:
-                    self.wfile.write(f"data: {json.dumps({'token': char})}\n\n".encode())
-                    self.wfile.flush()
-                except (BrokenPipeError, ConnectionResetError):
-                    log_warn(f"[REQ-{req_id}] Client disconnected during stream")
-                    return
+CONTAINER_NAME = 'pocketai'
+CONTAINER_BIN = '/opt/pocketai/bin/llamafile'
+CONTAINER_MODELS = '/opt/pocketai/models'
 
-            # Send completion event
-            self.wfile.write(f"data: {json.dumps({'done': True, 'full_response': buffer})}\n\n".encode())
-            self.wfile.flush()
-            log_info(f"[REQ-{req_id}] SSE complete: {token_count} tokens")
+_engine = {
+    'restarts': 0,
+    'loads': 0,           # engines started for a model that wasn't warm
+    'preloaded': None,    # active model key last loaded ahead of a request
+    'tuning': set(),      # models a tune job is benchmarking (not preloaded meanwhile)
+    'check_interval': 5,
+    'load_timeout': 180,  # grace period for the model to load
+    'max_failures': 3
+}
+_engine_lock = threading.Lock()
+_engine_pool = warm_pool.WarmPool(WARM_POOL_SIZE, int(WARM_POOL_RESERVE_MB * 1024 * 1024),
+                                  os.path.join(PROC_ROOT, 'meminfo'))
 
-        except (BrokenPipeError, ConnectionResetError) as e:
-            log_warn(f"[REQ-{req_id}] Client disconnected: {e}")
-        except Exception as e:
-            log_error(f"[REQ-{req_id}] SSE error: {e}\n{traceback.format_exc()}")
-            try:
-                self.wfile.write(f"data: {json.dumps({'error': str(e)})}\n\n".encode())
-                self.wfile.flush()
-            except:
-                pass
+# Same trigger words infer/infer_stream use to pick a token limit
+_CODE_WORDS = re.compile(r'(code|program|write|implement|function|script|algorithm|example|binary|search|sort)')
+_EXPLAIN_WORDS = re.compile(r'(create|explain|describe|what|how|why|list|steps|detailed)')
+_STREAM_CODE_WORDS = re.compile(r'(code|program|write|implement|function|script)')
 
-    def do_OPTIONS(self):
-        self.send_json({})
+def engine_desired_key(model_path=None):
+    """Model/threads/ctx/batch an engine should run with (the active model by default)"""
+    model = model_path or get_active_model_fast()
+    if not model or not os.path.isfile(model):
+        return None
+    return (model,) + model_settings(model)
 
-    def do_GET(self):
-        global _active_streams
-        req_id = get_request_id()
-        path = urlparse(self.path).path
+def engine_spawn(key, port):
+    """Launch llamafile --server inside the container (mirrors server_start)"""
+    model_path, threads, ctx_size, batch_size = key
+    container_model = f"{CONTAINER_MODELS}/{os.path.basename(model_path)}"
+    cmd = [
+        'proot-distro', 'login', CONTAINER_NAME,
+        '--bind', f'{POCKETAI_ROOT}/data:/opt/pocketai/data',
+        '--bind', f'{POCKETAI_ROOT}/models:/opt/pocketai/models',
+        '--', CONTAINER_BIN,
+        '-m', container_model,
+        '-t', threads,
+        '-c', ctx_size,
+    ]
+    if batch_size:
+        cmd += ['-b', batch_size]
+    cmd += ['--server', '--host', '127.0.0.1', '--port', str(port)]
+    log_info(f"Engine starting: {os.path.basename(model_path)} (threads={threads}, ctx={ctx_size}, "
+             f"batch={batch_size or 'default'}, port={port})")
+    spawn_start = time.monotonic()
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        preexec_fn=os.setsid  # Own process group so the whole proot tree can be killed
+    )
+    _spawn_seconds.observe(time.monotonic() - spawn_start, kind='engine')
+    return process
 
-        try:
-            if path == '/api/health':
-                self.send_json({'healthy': True, 'active_streams': _active_streams, 'uptime': time.time() - _server_start_time})
+class Engine:
+    """One resident llamafile --server; state changes happen under _engine_lock"""
 
-            elif path == '/api/reset':
-                # Kill any stuck llamafile processes
-                log_warn(f"[REQ-{req_id}] Reset requested - killing stuck processes")
-                try:
-                    subprocess.run(['pkill', '-9', '-f', 'llamafile'], timeout=5, capture_output=True)
-                except:
-                    pass
-                # Reset counters
-                with _lock:
-                    _active_streams = 0
-                _status_cache['last_update'] = 0
-                self.send_json({'reset': True, 'message': 'Killed stuck processes'})
+    def __init__(self, key, port, ram):
+        self.key = key            # (model_path, threads, ctx_size, batch_size) from the tune profile or config
+        self.limits = key[1:3]    # (threads, ctx_size) the process runs with, after the governor
+        self.port = port
+        self.ram = ram          # estimated bytes, for the warm pool budget
+        self.process = None
+        self.ready = False
+        self.started_at = 0
+        self.failures = 0       # consecutive failed health checks
+        self.active = 0         # requests in flight; busy engines are not evicted
+        self.batches = 0        # batches holding the engine (not evicted between their items)
 
-            elif path == '/api/status':
-                model_name, version = get_cached_status()
-                self.send_json({'status': 'ok', 'version': version, 'model': model_name})
+    @property
+    def name(self):
+        return os.path.basename(self.key[0])
 
-            elif path == '/api/models':
-                # Instant - uses hardcoded catalog
-                models = [
-                    {'name': name, 'description': info['desc'], 'size': info['size'], 'ram': info['ram']}
-                    for name, info in MODEL_CATALOG.items()
-                ]
-                self.send_json({'models': models})
+    def running(self):
+        return self.process is not None and self.process.poll() is None
 
-            elif path == '/api/models/installed':
-                # Fast - uses Python file operations with caching
-                models = get_installed_models_fast()
-                self.send_json({'models': models})
+    def start(self):
+        model_path, threads, ctx_size, batch_size = self.key
+        self.limits = governor_limits(threads, ctx_size)
+        self.process = engine_spawn((model_path,) + self.limits + (batch_size,), self.port)
+        self.started_at = time.time()
+        self.ready = False
+        self.failures = 0
 
-            elif path == '/api/config':
-                # Fast: read config file directly with Python
-                config = {}
+    def stop(self):
+        """Stop the process tree"""
+        process = self.process
+        self.process = None
+        self.ready = False
+        if process is None:
+            return
+        try:
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGTERM)
                 try:
-                    config_file = get_config_file()
-                    if os.path.exists(config_file):
-                        with open(config_file, 'r') as f:
-                            for line in f:
-                                line = line.strip()
-                                if '=' in line and not line.startswith('#'):
-                                    k, v = line.split('=', 1)
-                                    config[k] = v
-                except Exception as e:
-                    log_error(f"Config read failed: {e}")
-                self.send_json(config)
+                    process.wait(timeout=3)
+                except subprocess.TimeoutExpired:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.wait(timeout=1)
+        except (OSError, ProcessLookupError, subprocess.TimeoutExpired):
+            pass
 
-            elif path == '/api/models/verify':
-                # GET: Verify all models
-                log_info(f"[REQ-{req_id}] Verifying all models (GET)")
-                out, ok = run_cmd('model_verify_all', timeout=120)
-                self.send_json({'success': ok, 'message': out})
+    def health(self):
+        """Return True when llamafile answers /health with 200"""
+        conn = None
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+            conn.request('GET', '/health')
+            return conn.getresponse().status == 200
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
 
-            else:
-                self.send_json({'error': 'Not found'}, 404)
+    def check(self):
+        """Health-check, restarting after an exit or repeated failures; True when ready"""
+        if not self.running():
+            if self.process is not None:
+                log_warn(f"Engine {self.name} exited (code {self.process.returncode}), restarting")
+                _engine['restarts'] += 1
+            self.stop()
+            self.start()
+            return False
 
-        except Exception as e:
-            log_error(f"[REQ-{req_id}] GET {path} error: {e}\n{traceback.format_exc()}")
-            self.send_error_json(str(e), 500)
+        if self.health():
+            if not self.ready:
+                log_info(f"Engine {self.name} ready after {time.time() - self.started_at:.1f}s")
+            self.ready = True
+            self.failures = 0
+            return True
 
-    def do_POST(self):
-        req_id = get_request_id()
-        path = urlparse(self.path).path
+        # Still loading the model - not a failure yet
+        if not self.ready and time.time() - self.started_at < _engine['load_timeout']:
+            return False
 
-        try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode() if content_length > 0 else '{}'
+        self.ready = False
+        self.failures += 1
+        if self.failures >= _engine['max_failures']:
+            log_warn(f"Engine {self.name} unhealthy ({self.failures} failed checks), restarting")
+            _engine['restarts'] += 1
+            self.stop()
+        return False
 
-            try:
-                data = json.loads(body)
-            except json.JSONDecodeError as e:
-                log_warn(f"[REQ-{req_id}] Invalid JSON: {e}")
-                data = {}
+    def status(self):
+        return {
+            'model': self.name,
+            'running': self.running(),
+            'ready': self.ready,
+            'pid': self.process.pid if self.process is not None else None,
+            'port': self.port,
+            'active': self.active,
+            'ram_mb': round(self.ram / (1024 * 1024)),
+            'threads': self.limits[0],
+            'ctx_size': self.limits[1],
+            'batch_size': self.key[3] or None
+        }
 
-            if path == '/api/models/install':
-                model = data.get('model', '')
-                log_info(f"[REQ-{req_id}] Installing model: {model}")
-                # No timeout - let it complete
-                out, ok = run_cmd(f'model_install "{model}"', timeout=None)
-                self.send_json({'success': ok, 'message': out or f'Model {model} installed'})
+def engine_ram(model_path):
+    """Estimated RAM of a resident engine for a model file"""
+    try:
+        size = os.path.getsize(model_path)
+    except OSError:
+        size = 0
+    return warm_pool.estimate_ram(os.path.basename(model_path), size, MODEL_CATALOG)
 
-            elif path == '/api/models/remove':
-                model = data.get('model', '')
-                log_info(f"[REQ-{req_id}] Removing model: {model}")
-                # No timeout - let it complete
-                out, ok = run_cmd(f'model_remove "{model}"', timeout=None)
-                self.send_json({'success': ok, 'message': out or f'Model {model} removed'})
+def _engine_get_locked(key):
+    """Engine for key, loaded (after evicting idle engines) if not warm; None if it can't fit now"""
+    engine = _engine_pool.get(key[0])
+    if engine is not None:
+        if engine.key != key and not engine.active:
+            log_info(f"Engine {engine.name} settings changed, restarting")
+            engine.stop()
+            engine.key = key
+            engine.start()
+        return engine
+    ram = engine_ram(key[0])
+    evicted = _engine_pool.admit(key[0], ram, busy=lambda e: e.active > 0 or e.batches > 0)
+    if evicted is None:
+        return None
+    for old in evicted:
+        log_info(f"Warm pool: evicting {old.name} to load {os.path.basename(key[0])}")
+        old.stop()
+    used = {e.port for e in _engine_pool.values()}
+    port = next(p for p in range(ENGINE_PORT, ENGINE_PORT + WARM_POOL_SIZE) if p not in used)
+    engine = Engine(key, port, ram)
+    engine.start()
+    _engine['loads'] += 1
+    _engine_pool.add(key[0], engine, ram)
+    return engine
 
-            elif path == '/api/models/use':
-                model = data.get('model', '')
-                log_info(f"[REQ-{req_id}] Activating model: {model}")
-                # Fast activation using Python (no shell) - instant!
-                ok, msg = activate_model_fast(model)
-                log_info(f"[REQ-{req_id}] Activation result: {ok} - {msg}")
-                self.send_json({'success': ok, 'message': msg})
+def engine_stop():
+    """Stop every resident engine"""
+    with _engine_lock:
+        for engine in _engine_pool.clear():
+            log_info(f"Engine stopping: {engine.name}")
+            engine.stop()
 
-            elif path == '/api/models/verify':
-                model = data.get('model', '')
-                log_info(f"[REQ-{req_id}] Verifying model: {model or 'all'}")
-                if model:
-                    # Verify specific model
-                    out, ok = run_cmd(f'model_verify_file "$MODELS_DIR"/*{model}*.gguf quick', timeout=30)
-                    self.send_json({'success': ok, 'message': 'Model verified' if ok else 'Model corrupted or not found'})
-                else:
-                    # Verify all models
-                    out, ok = run_cmd('model_verify_all', timeout=120)
-                    self.send_json({'success': ok, 'message': out})
+def engine_check(model_path=None):
+    """Start or health-check the engine for a model (the active one by default)
 
-            elif path == '/api/chat':
-                message = data.get('message', '')
-                max_tokens = data.get('max_tokens', '')
-                log_info(f"[REQ-{req_id}] Chat request (blocking): {len(message)} chars")
-                # Escape message for shell
-                message = message.replace('"', '\\"').replace('$', '\\$')
-                if max_tokens:
-                    out, ok = run_cmd(f'infer "{message}" "{max_tokens}"', timeout=120)
-                else:
-                    out, ok = run_cmd(f'infer "{message}"', timeout=120)
-                log_info(f"[REQ-{req_id}] Chat complete: {len(out)} chars")
-                self.send_json({'response': out})
+    Returns the engine once it serves requests, else None.
+    """
+    key = engine_desired_key(model_path)
+    if key is None:
+        return None
+    with _engine_lock:
+        engine = _engine_get_locked(key)
+        if engine is not None and engine.check():
+            return engine
+    return None
 
-            elif path == '/api/chat/stream':
-                message = data.get('message', '')
-                log_info(f"[REQ-{req_id}] Chat request (streaming): {len(message)} chars")
-                # Escape message for shell
-                message = message.replace('"', '\\"').replace('$', '\\$').replace('`', '\\`')
-                self.send_sse_stream(run_cmd_stream(f'infer_stream "{message}"'))
+def engine_sweep():
+    """Health-check every warm engine; unload models whose file is gone"""
+    with _engine_lock:
+        for engine in _engine_pool.values():
+            if not os.path.isfile(engine.key[0]):
+                if not engine.active:
+                    log_info(f"Engine {engine.name}: model removed, stopping")
+                    _engine_pool.remove(engine.key[0])
+                    engine.stop()
+                continue
+            engine.check()
 
-            elif path == '/api/config':
-                key = data.get('key', '')
-                value = data.get('value', '')
-                log_info(f"[REQ-{req_id}] Config set: {key}={value}")
-                # Fast: use Python file operations
-                try:
-                    config_file = get_config_file()
-                    lines = []
-                    found = False
-                    if os.path.exists(config_file):
-                        with open(config_file, 'r') as f:
-                            for line in f:
-                                if line.startswith(f'{key}='):
-                                    lines.append(f'{key}={value}\n')
-                                    found = True
-                                else:
-                                    lines.append(line)
-                    if not found:
-                        lines.append(f'{key}={value}\n')
-                    with open(config_file, 'w') as f:
-                        f.writelines(lines)
-                    self.send_json({'success': True})
-                except Exception as e:
-                    log_error(f"Config set failed: {e}")
-                    self.send_json({'success': False, 'error': str(e)})
+def engine_preload():
+    """Load the active model ahead of the first chat (at startup and after a switch)
 
-            else:
-                self.send_json({'error': 'Not found'}, 404)
+    Only once per switch, so models that requests chose since then are
+    not evicted to bring the active one back.
+    """
+    key = engine_desired_key()
+    if key is None or key == _engine['preloaded'] or key[0] in _engine['tuning']:
+        return
+    with _engine_lock:
+        if _engine_get_locked(key) is not None:
+            _engine['preloaded'] = key
 
+def engine_supervisor():
+    """Background loop preloading the active model and keeping the pool healthy"""
+    while True:
+        try:
+            engine_preload()
+            engine_sweep()
         except Exception as e:
-            log_error(f"[REQ-{req_id}] POST {path} error: {e}\n{traceback.format_exc()}")
-            self.send_error_json(str(e), 500)
+            log_error(f"Engine supervisor error: {e}")
+        time.sleep(_engine['check_interval'])
 
-class CombinedHandler(APIHandler):
-    """Serve both API and static web files"""
-    def do_GET(self):
-        path = urlparse(self.path).path
+def engine_wait_ready(model_path=None, timeout=120):
+    """Wait until the engine for a model (active by default) serves requests
 
-        # API routes
-        if path.startswith('/api/'):
-            return super().do_GET()
+    Returns the engine, or None if the resident engine is disabled or not ready.
+    """
+    if not RESIDENT_ENGINE:
+        return None
+    deadline = time.time() + timeout
+    while True:
+        # Always re-check so a model/config switch restarts the engine right away
+        try:
+            engine = engine_check(model_path)
+            if engine is not None:
+                return engine
+        except Exception as e:
+            log_error(f"Engine check failed: {e}")
+            return None
+        if time.time() >= deadline:
+            log_warn(f"Engine not ready after {timeout}s, falling back to per-request inference")
+            return None
+        time.sleep(0.5)
 
-        # Static files
-        web_dir = os.path.join(POCKETAI_ROOT, 'web')
-        if path == '/' or path == '':
-            path = '/index.html'
+def engine_warm_models():
+    """Paths of models whose resident engine is ready"""
+    with _engine_lock:
+        return {e.key[0] for e in _engine_pool.values() if e.ready}
 
-        file_path = os.path.join(web_dir, path.lstrip('/'))
+def engine_status():
+    """Snapshot of resident engine state for /api/health
 
-        if os.path.isfile(file_path):
-            try:
-                self.send_response(200)
-                if file_path.endswith('.html'):
-                    self.send_header('Content-Type', 'text/html')
-                elif file_path.endswith('.js'):
-                    self.send_header('Content-Type', 'application/javascript')
-                elif file_path.endswith('.css'):
-                    self.send_header('Content-Type', 'text/css')
-                self.end_headers()
-                with open(file_path, 'rb') as f:
-                    self.wfile.write(f.read())
-            except (BrokenPipeError, ConnectionResetError):
-                pass
-        else:
-            self.send_json({'error': 'Not found'}, 404)
+    The top-level fields describe the active model's engine; pool lists
+    every warm model, most recently used first.
+    """
+    with _engine_lock:
+        engine = _engine_pool.peek(get_active_model_fast())
+        engines = [e.status() for e in reversed(_engine_pool.values())]
+        pool = _engine_pool.snapshot()
+    return {
+        'enabled': RESIDENT_ENGINE,
+        'running': engine is not None and engine.running(),
+        'ready': engine is not None and engine.ready,
+        'model': engine.name if engine is not None else '',
+        'pid': engine.process.pid if engine is not None and engine.process is not None else None,
+        'restarts': _engine['restarts'],
+        'loads': _engine['loads'],
+        'port': engine.port if engine is not None else ENGINE_PORT,
+        'pool': dict(pool, engines=engines)
+    }
 
-class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+def default_max_tokens(message, family, requested='', stream=False):
+    """Token limit infer/infer_stream would pick (None = no limit)"""
+    if requested:
+        return int(requested)
+    if family == 'qwen3':
+        return None
+    if stream:
+        return 800 if _STREAM_CODE_WORDS.search(message) else 500
+    if _CODE_WORDS.search(message):
+        return 800
+    if _EXPLAIN_WORDS.search(message):
+        return 600
+    return 500
+
+def filtered_stream(chunks, model_name=None, status=None):
+    """Model output cleaned as it streams (think blocks, stop sequences, special tokens, LaTeX)
+
+    Uses the active model's template unless model_name is given; status as
+    in run_cmd_stream.
+    """
+    model_name = model_name or os.path.basename(get_active_model_fast())
+    return stream_filter.filter_stream(chunks, stream_filter.for_model(model_name), status)
+
+def engine_payload(message, max_tokens='', stream=False, model_name=None):
+    """Build the llamafile /completion request body; returns (payload, model file name)"""
+    model_name = model_name or os.path.basename(get_active_model_fast())
+    family = prompt_templates.get_model_family(model_name)
+    n_predict = default_max_tokens(message, family, max_tokens, stream)
+    payload = prompt_templates.completion_payload(prompt_templates.format_prompt(model_name, message),
+                                                  model_name, n_predict, stream)
+    return payload, model_name
+
+def engine_abort(sock):
+    """Cancel callback: shut the engine connection down so llamafile drops the generation
+
+    Takes the socket itself: http.client lets go of conn.sock once a
+    "Connection: close" response owns it.
+    """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+def engine_infer(engine, message, max_tokens='', timeout=120, generation=None):
+    """Blocking completion on a resident engine; None if the engine is unreachable or cancelled"""
+    conn = None
+    abort = None
+    with _engine_lock:
+        engine.active += 1
+    try:
+        payload, model_name = engine_payload(message, max_tokens, model_name=engine.name)
+        conn = http.client.HTTPConnection('127.0.0.1', engine.port, timeout=timeout)
+        if generation is not None:
+            conn.connect()
+            abort = functools.partial(engine_abort, conn.sock)
+            generation.on_cancel(abort)
+        conn.request('POST', '/completion', body=json.dumps(payload),
+                     headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.status != 200:
+            log_warn(f"Engine returned HTTP {resp.status}")
+            return None
+        return stream_filter.clean_text(json.loads(body).get('content', ''), model_name)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        if generation is not None and generation.cancelled:
+            return None
+        log_warn(f"Engine request failed: {e}")
+        with _engine_lock:
+            engine.ready = False
+        return None
+    finally:
+        with _engine_lock:
+            engine.active -= 1
+        if abort is not None:
+            generation.remove_callback(abort)
+        if conn is not None:
+            conn.close()
+
+def engine_stream(engine, message, max_tokens='', timeout=300, status=None, payload=None, generation=None):
+    """Stream completion tokens from a resident engine (status and generation as in run_cmd_stream)
+
+    payload overrides the request body built from message (used by sessions).
+    """
+    global _active_streams
+    conn = None
+    abort = None
+    start_time = time.time()
+    char_count = 0
+    tokens = 0  # llamafile sends one event per token
+    first_token_time = last_token_time = None
+
+    try:
+        with _lock:
+            _active_streams += 1
+        with _engine_lock:
+            engine.active += 1
+        log_info(f"Engine stream started: {engine.name} (active: {_active_streams})")
+
+        if payload is None:
+            payload, _ = engine_payload(message, max_tokens, stream=True, model_name=engine.name)
+        # Socket timeout doubles as the idle timeout between tokens
+        conn = http.client.HTTPConnection('127.0.0.1', engine.port, timeout=60)
+        if generation is not None:
+            conn.connect()
+            abort = functools.partial(engine_abort, conn.sock)
+            generation.on_cancel(abort)
+        conn.request('POST', '/completion', body=json.dumps(payload),
+                     headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        if resp.status != 200:
+            yield f"[Error: engine returned HTTP {resp.status}]"
+            return
+
+        while True:
+            if time.time() - start_time > timeout:
+                log_warn(f"Engine stream timeout after {timeout}s")
+                _timeouts.inc(kind='overall')
+                break
+            line = resp.readline()
+            if not line:
+                if generation is not None and generation.cancelled:
+                    log_info(f"Engine stream cancelled ({generation.reason})")
+                break
+            if not line.startswith(b'data: '):
+                continue
+            event = json.loads(line[6:])
+            content = event.get('content', '')
+            if content:
+                last_token_time = time.time()
+                if first_token_time is None:
+                    first_token_time = last_token_time
+                    _first_byte_seconds.observe(first_token_time - start_time, backend='engine')
+                tokens += 1
+                char_count += len(content)
+                yield content
+            if event.get('stop'):
+                if status is not None:
+                    status['complete'] = True
+                break
+
+        if first_token_time is not None:
+            observe_stream_rate('engine', tokens, first_token_time, last_token_time)
+        log_info(f"Engine stream complete: {char_count} chars in {time.time() - start_time:.1f}s")
+
+    except GeneratorExit:
+        log_warn("Engine stream closed by client")
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        if generation is not None and generation.cancelled:
+            log_info(f"Engine stream cancelled ({generation.reason})")
+            return
+        log_error(f"Engine stream error: {e}")
+        if isinstance(e, TimeoutError):
+            _timeouts.inc(kind='idle')
+        with _engine_lock:
+            engine.ready = False
+        yield f"[Error: {str(e)}]"
+    finally:
+        with _lock:
+            _active_streams -= 1
+        with _engine_lock:
+            engine.active -= 1
+        if abort is not None:
+            generation.remove_callback(abort)
+        # Closing the connection makes llamafile abort the generation
+        if conn is not None:
+            conn.close()
+
+# =============================================================================
+# Resource governor
+# =============================================================================
+# data/governor.py samples meminfo, PSI and the load average under PROC_ROOT,
+# and thermal zones under THERMAL_ROOT, every GOVERNOR_INTERVAL seconds.
+# Chat, stream and session requests whose model doesn't fit in memory right
+# now (MemAvailable minus GOVERNOR_RESERVE_MB, plus idle warm models that can
+# be evicted) or that would load a model under critical memory pressure get
+# 503 with Retry-After, as does everything while the device is too hot.
+# Installs of models needing more RAM than the device has fail unless forced.
+# Under pressure, engines and engine.sh commands start with fewer threads and
+# a smaller context. GOVERNOR=0 turns admission and throttling off.
+GOVERNOR = os.environ.get('GOVERNOR', '1').lower() not in ('0', 'false', 'no', 'off')
+GOVERNOR_INTERVAL = float(os.environ.get('GOVERNOR_INTERVAL', 2))
+GOVERNOR_RESERVE_MB = float(os.environ.get('GOVERNOR_RESERVE_MB', WARM_POOL_RESERVE_MB))
+GOVERNOR_RETRY_AFTER = 10  # seconds, for refusals that may clear up
+THERMAL_ROOT = os.environ.get('THERMAL_ROOT', '/sys/class/thermal')
+
+_governor = Governor(PROC_ROOT, THERMAL_ROOT, int(GOVERNOR_RESERVE_MB * 1024 * 1024))
+
+def governor_admit(model_path, kind):
+    """Refusal decision for a generation on model_path, or None to go ahead"""
+    if not GOVERNOR or not model_path:
+        return None
+    with _engine_lock:
+        engine = _engine_pool.peek(model_path)
+        warm = engine is not None and engine.running()
+        reclaimable = sum(e.ram for e in _engine_pool.values() if e is not engine and not e.active)
+    decision = _governor.admit(kind, os.path.basename(model_path), engine_ram(model_path), warm, reclaimable)
+    if decision['allowed']:
+        return None
+    log_warn(f"Governor refused {kind}: {decision['message']}")
+    return decision
+
+def governor_refusal(decision):
+    """(status, body, headers) for a refused request"""
+    body = {'error': decision['message'], 'status': 503, 'reason': decision['reason'],
+            'retry_after': GOVERNOR_RETRY_AFTER, 'governor': decision}
+    return 503, body, {'Retry-After': str(GOVERNOR_RETRY_AFTER)}
+
+def governor_limits(threads, ctx_size):
+    """threads/ctx_size lowered for the current pressure (unchanged with GOVERNOR=0)"""
+    if not GOVERNOR:
+        return threads, ctx_size
+    return _governor.limits(threads, ctx_size)
+
+def governor_env(model_path=None):
+    """PAI_THREADS/PAI_CTX_SIZE/PAI_BATCH_SIZE for engine.sh: the model's settings, lowered under pressure"""
+    threads, ctx_size, batch_size = model_settings(model_path)
+    threads, ctx_size = governor_limits(threads, ctx_size)
+    env = {'PAI_THREADS': str(threads), 'PAI_CTX_SIZE': str(ctx_size)}
+    if batch_size:
+        env['PAI_BATCH_SIZE'] = batch_size
+    return env
+
+def governor_install(job):
+    """Refusal decision for an install job, or None to go ahead"""
+    if not GOVERNOR:
+        return None
+    entry = catalog_entry(job.model)
+    decision = _governor.admit_install(job.model, entry['ram'] if entry else None, bool(job.options.get('force')))
+    if decision['allowed']:
+        return None
+    log_warn(f"Governor refused install: {decision['message']}")
+    return decision
+
+def governor_health():
+    """Short governor state for /api/health (the full one is /api/governor)"""
+    snapshot = _governor.snapshot()
+    health = {key: snapshot[key] for key in ('level', 'levels', 'mem_available_mb', 'throttle')}
+    health['enabled'] = GOVERNOR
+    return health
+
+def governor_levels():
+    levels = _governor.current()['levels']
+    return {(resource,): ('ok', 'elevated', 'critical').index(level) for resource, level in levels.items()}
+
+# =============================================================================
+# SSE output coalescing
+# =============================================================================
+# Chunks arriving within SSE_FLUSH_MS of the previous write (up to
+# SSE_FLUSH_BYTES) are merged into one event / one socket write
+SSE_FLUSH_MS = int(os.environ.get('SSE_FLUSH_MS', 20))
+SSE_FLUSH_BYTES = int(os.environ.get('SSE_FLUSH_BYTES', 256))
+SSE_FLUSH_MS_MAX = 1000  # longest window a client may ask for
+
+def request_flush_ms(data):
+    """Coalescing window a stream request asks for; returns (ms, None) or (None, error message)
+
+    Values above SSE_FLUSH_MS_MAX are lowered to it; 0 turns coalescing off.
+    """
+    value = data.get('flush_ms', SSE_FLUSH_MS)
+    if isinstance(value, str):
+        try:
+            value = int(value.strip())
+        except ValueError:
+            pass
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value < float('inf'):
+        return None, 'flush_ms must be a non-negative integer'
+    return min(int(value), SSE_FLUSH_MS_MAX), None
+
+def sse_frame(data):
+    """Encode one SSE event"""
+    return b'data: ' + json.dumps(data).encode() + b'\n\n'
+
+class FlushDeadline:
+    """When the text a threaded SSE stream is holding back is due out
+
+    send_sse_stream coalesces in the handler thread, so it can only flush
+    when its source yields. It sets `at` (time.monotonic(), None while
+    nothing is pending); run_cmd_stream caps its select() with wait() and
+    yields '' once the deadline passes.
+    """
+
+    def __init__(self):
+        self.at = None
+
+    def wait(self, limit):
+        """Seconds a source may block on I/O before it should yield ''"""
+        if self.at is None:
+            return limit
+        return min(limit, max(0, self.at - time.monotonic()))
+
+# =============================================================================
+# Response cache
+# =============================================================================
+# Exact-match cache of chat answers keyed on model file, prompt, token limit
+# and sampling settings. RESPONSE_CACHE_MB=0 disables it; RESPONSE_CACHE_DISK=1
+# persists entries to data/response_cache.jsonl.
+RESPONSE_CACHE_MB = float(os.environ.get('RESPONSE_CACHE_MB', 8))
+RESPONSE_CACHE_DISK = os.environ.get('RESPONSE_CACHE_DISK', '').lower() in ('1', 'true', 'yes', 'on')
+
+# Config keys whose change alters generated text
+GENERATION_KEYS = ('active_model', 'ctx_size')
+
+_response_cache = ResponseCache(
+    int(RESPONSE_CACHE_MB * 1024 * 1024),
+    os.path.join(POCKETAI_ROOT, 'data', 'response_cache.jsonl') if RESPONSE_CACHE_DISK else None
+)
+
+@on_config_change
+def response_config_changed(changes):
+    for key in GENERATION_KEYS:
+        if key in changes:
+            invalidate_response_cache(f'{key} changed')
+            return
+
+def response_cache_key(message, max_tokens='', stream=False, model=None):
+    """Cache key for a chat request (on the active model unless model is given); None if it can't be cached"""
+    if not _response_cache.enabled:
+        return None
+    model = model or get_active_model_fast()
+    try:
+        st = os.stat(model)
+        model_name = os.path.basename(model)
+        family = prompt_templates.get_model_family(model_name)
+        return cache_key(
+            model, st.st_mtime, st.st_size,
+            model_settings(model)[1],
+            'stream' if stream else 'blocking',
+            prompt_templates.format_prompt(model_name, message),
+            default_max_tokens(message, family, max_tokens, stream),
+            prompt_templates.sampling_params(model_name)
+        )
+    except (OSError, ValueError):
+        return None
+
+def cached_response(key):
+    """Cached answer for a request key, or None (counted in metrics)"""
+    if not key:
+        return None
+    text = _response_cache.get(key)
+    _cache_lookups.inc(cache='response', result='miss' if text is None else 'hit')
+    return text
+
+def cache_response(key, text):
+    """Store a finished answer unless it is empty or an error"""
+    if key and text and not text.startswith('[Error'):
+        _response_cache.put(key, text)
+
+def invalidate_response_cache(reason):
+    """Drop cached answers after a generation-relevant change"""
+    if _response_cache.enabled:
+        log_info(f"Response cache cleared ({reason})")
+        _response_cache.clear()
+
+def replay_response(text):
+    """Generator yielding a cached answer for send_sse_stream"""
+    yield text
+
+# =============================================================================
+# Chat sessions
+# =============================================================================
+# Multi-turn conversations for the REST API. History is formatted with
+# build_history_entry and sized in tokens by context_window.fit: as many
+# recent turns as fit in the context next to the message and its answer
+# (history_tokens caps it, system_prompt is pinned in front). The spawn path
+# keeps a llamafile --prompt-cache file per session so each turn only
+# evaluates its new tokens, the resident engine reuses its KV cache through
+# cache_prompt. Sessions beyond SESSION_DISK_MB are evicted least recently
+# used first; SESSION_MAX_TURNS only bounds what a session stores.
+SESSION_DISK_MB = float(os.environ.get('SESSION_DISK_MB', 512))
+SESSION_MAX_TURNS = int(os.environ.get('SESSION_MAX_TURNS', 100))
+
+_sessions = SessionStore(
+    os.path.join(POCKETAI_ROOT, 'data', 'sessions'),
+    int(SESSION_DISK_MB * 1024 * 1024),
+    SESSION_MAX_TURNS
+)
+
+def parse_session_path(path):
+    """Split /api/sessions/<id>[/<action>] into (id, action); None if no match"""
+    parts = path.rstrip('/').split('/')[3:]
+    if not parts or len(parts) > 2:
+        return None
+    return parts[0], parts[1] if len(parts) == 2 else ''
+
+def session_request(path, data):
+    """Validate a turn request and mark the session busy
+
+    Returns (session, action) or (None, (status, error)). The caller must
+    release the session once the turn is over.
+    """
+    route = parse_session_path(path)
+    if route is None or route[1] not in ('messages', 'stream'):
+        return None, (404, 'Not found')
+    session = _sessions.get(route[0])
+    if session is None:
+        return None, (404, 'Session not found')
+    if not data.get('message'):
+        return None, (400, 'message is required')
+    _, error = request_model(data)
+    if error:
+        return None, (404, error)
+    _, error = request_max_tokens(data)
+    if error:
+        return None, (400, error)
+    if route[1] == 'stream':
+        _, error = request_flush_ms(data)
+        if error:
+            return None, (400, error)
+    if not _sessions.acquire(session['id']):
+        return None, (409, 'Session is busy')
+    return session, route[1]
+
+def session_view(session):
+    """Session as returned by GET /api/sessions/<id>"""
+    return {
+        'session_id': session['id'],
+        'model': session['model'],
+        'turns': [{'user': t['user'], 'assistant': t['assistant']} for t in session['turns']],
+        'context_start': session.get('context_start', 0),
+        'created': session['created'],
+        'last_used': session['last_used']
+    }
+
+def session_ctx_size(model_path, env):
+    """Context size the turn will run with: the warm engine's, else the configured one as lowered by the governor"""
+    if RESIDENT_ENGINE:
+        with _engine_lock:
+            engine = _engine_pool.peek(model_path)
+        if engine is not None and engine.ready:
+            return engine.limits[1]
+    return env.get('PAI_CTX_SIZE') or model_settings(model_path)[1]
+
+def session_model(session):
+    """Model file a session's turns run on when they don't name one
+
+    The model the session was created with (or last asked for), while it is
+    installed; otherwise the active model.
+    """
+    model_path = session.get('model_path')
+    if model_path and os.path.isfile(model_path):
+        return model_path
+    return get_active_model_fast()
+
+def session_request_model(data):
+    """Model file a session turn names, or None to stay on session_model
+
+    session_request has already turned an unknown name into a 404.
+    """
+    return request_model(data)[0] if data.get('model') else None
+
+def session_turn(session, message, max_tokens='', stream=False, model_path=None):
+    """Prompt and token limit for the next turn
+
+    Rebinds the session to model_path (and keeps it there), or to
+    session_model if not given. Reads model vocabularies, so async callers
+    run it in the executor.
+    """
+    requested = model_path
+    model_path = model_path or session_model(session)
+    model_name = os.path.basename(model_path)
+    _sessions.bind_model(session, model_path, pin=bool(requested))
+    family = prompt_templates.get_model_family(model_name)
+    n_predict = default_max_tokens(message, family, max_tokens, stream)
+    env = governor_env(model_path)
+    try:
+        limit = int(get_config_value_fast('history_tokens', '0') or 0)
+    except ValueError:
+        limit = 0
+    history, start, context = context_window.fit(
+        model_path, session['turns'], session.get('context_start', 0), message,
+        session_ctx_size(model_path, env), n_predict, limit,
+        system=get_config_value_fast('system_prompt', ''),
+        summarize=get_config_value_fast('history_summary', 'on') != 'off'
+    )
+    _sessions.set_context_start(session, start)
+    return {
+        'message': message,
+        'model_path': model_path,
+        'model_name': model_name,
+        'family': family,
+        'prompt': prompt_templates.format_prompt(model_name, message, history),
+        'n_predict': n_predict,
+        'context': context,
+        'env': env
+    }
+
+def session_payload(turn, stream=True):
+    """Resident engine request body for a session turn"""
+    return prompt_templates.completion_payload(turn['prompt'], turn['model_name'], turn['n_predict'], stream)
+
+def session_command(session, turn):
+    """infer_prompt_stream command and environment for a session turn
+
+    The prompt goes through the environment so it needs no shell quoting.
+    """
+    env = dict(turn['env'])
+    env.update({
+        'PAI_PROMPT': turn['prompt'],
+        'PAI_MAX_TOKENS': str(turn['n_predict'] or ''),
+        'PAI_PROMPT_CACHE': _sessions.cache_name(session['id']),
+        'PAI_MODEL': turn['model_path']
+    })
+    return 'infer_prompt_stream "$PAI_PROMPT" "$PAI_MAX_TOKENS" "$PAI_PROMPT_CACHE"', env
+
+def chat_stream(message, max_tokens, model_path, status=None, generation=None, deadline=None):
+    """Token generator for a chat message (resident engine or spawn path)
+
+    Nothing runs until the first token is asked for, so a queued stream
+    looks up (and maybe loads) its engine only once it holds a slot.
+    deadline goes to run_cmd_stream.
+    """
+    engine = engine_wait_ready(model_path)
+    if engine:
+        yield from engine_stream(engine, message, max_tokens, status=status, generation=generation)
+    else:
+        cmd, env = infer_command(message, max_tokens, model_path, stream=True)
+        yield from run_cmd_stream(cmd, status=status, env=env, generation=generation, deadline=deadline)
+
+def session_stream(session, turn, status=None, generation=None, deadline=None):
+    """Filtered token generator for a session turn (resident engine or spawn path; lazy like chat_stream)"""
+    engine = engine_wait_ready(turn['model_path'])
+    if engine:
+        source = engine_stream(engine, '', timeout=300, status=status, payload=session_payload(turn),
+                               generation=generation)
+    else:
+        cmd, env = session_command(session, turn)
+        source = run_cmd_stream(cmd, timeout=300, status=status, env=env, generation=generation,
+                                deadline=deadline)
+    yield from filtered_stream(source, turn['model_name'], status)
+
+def session_commit(session, turn, text, status):
+    """Record a finished turn (text is session_stream output); returns the answer"""
+    response = text.strip()
+    if status.get('complete') and response and not response.startswith('[Error'):
+        _sessions.append_turn(session, turn['message'], response)
+    return response
+
+# =============================================================================
+# Batch inference
+# =============================================================================
+# POST /api/chat/batch runs a list of items (data/batch.py) on one resident
+# engine and streams NDJSON back: a header line, a result per item, then a
+# summary with throughput. Without RESIDENT_ENGINE the engine is loaded for
+# the batch and stopped when no batch holds it any more. Every item takes an
+# inference slot at PRIORITY_BATCH. Answered items are checkpointed in
+# data/batches/<batch_id>.jsonl until the batch ends without errors; sending
+# the same items with that batch_id resumes it.
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 10000))
+BATCH_LOAD_TIMEOUT = int(os.environ.get('BATCH_LOAD_TIMEOUT', 180))
+BATCH_KEEP_HOURS = float(os.environ.get('BATCH_KEEP_HOURS', 24))
+BATCH_DIR = os.path.join(POCKETAI_ROOT, 'data', 'batches')
+_BATCH_ID = re.compile(r'^[0-9a-f]{16}$')
+
+def batch_data(target, content_type, body, data):
+    """Request fields for /api/chat/batch: the JSON object, or a JSONL body with options in the query string"""
+    if 'ndjson' not in content_type and 'jsonl' not in content_type:
+        return data
+    fields = {name: values[0] for name, values in parse_qs(urlparse(target).query).items()}
+    fields['jsonl'] = body
+    return fields
+
+def batch_prune():
+    """Delete checkpoints of batches abandoned more than BATCH_KEEP_HOURS ago"""
+    cutoff = time.time() - BATCH_KEEP_HOURS * 3600
+    try:
+        names = os.listdir(BATCH_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(BATCH_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def batch_prepare(data):
+    """Validate a batch request; returns (run, None) or (None, (status, error))"""
+    model_path, error = request_model(data)
+    if error:
+        return None, (404, error)
+    if not model_path or not os.path.isfile(model_path):
+        return None, (400, 'No model active. Install one with: pai install qwen3')
+    try:
+        if 'jsonl' in data:
+            items = batch.parse_lines(str(data['jsonl']).splitlines())
+        else:
+            items = batch.parse_list(data.get('items'))
+        order = data.get('order') or 'submitted'
+        if order not in batch.ORDERS:
+            raise batch.BatchError(f"order must be one of: {', '.join(batch.ORDERS)}")
+        concurrency = min(max(1, int(data.get('concurrency') or 1)), INFERENCE_SLOTS)
+        max_tokens = int(data['max_tokens']) if data.get('max_tokens') else ''
+    except (batch.BatchError, ValueError) as e:
+        return None, (400, str(e))
+    if not items:
+        return None, (400, 'items is empty')
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, (413, f"Too many items ({len(items)}, limit {BATCH_MAX_ITEMS})")
+    batch_id = str(data.get('batch_id') or os.urandom(8).hex())
+    if not _BATCH_ID.match(batch_id):
+        return None, (400, 'Invalid batch_id')
+
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    batch_prune()
+    checkpoint = batch.Checkpoint(os.path.join(BATCH_DIR, f'{batch_id}.jsonl'), batch.digest(items))
+    try:
+        finished = checkpoint.load()
+    except batch.BatchError as e:
+        return None, (409, str(e))
+    return {
+        'id': batch_id,
+        'model_path': model_path,
+        'items': items,
+        'todo': [item for item in items if str(item['id']) not in finished],
+        'finished': sorted(finished.values(), key=lambda result: result.get('index', 0)),
+        'checkpoint': checkpoint,
+        'order': order,
+        'concurrency': concurrency,
+        'max_tokens': max_tokens
+    }, None
+
+def batch_engine(model_path):
+    """Ready engine for a batch, held until batch_release; None if it isn't up within BATCH_LOAD_TIMEOUT"""
+    key = engine_desired_key(model_path)
+    deadline = time.time() + BATCH_LOAD_TIMEOUT
+    while key is not None:
+        with _engine_lock:
+            engine = _engine_get_locked(key)
+            if engine is not None and engine.check():
+                engine.batches += 1
+                return engine
+        if time.time() >= deadline:
+            break
+        time.sleep(0.5)
+    return None
+
+def batch_release(engine):
+    """Drop a batch's hold on its engine; without RESIDENT_ENGINE the last batch stops it"""
+    with _engine_lock:
+        engine.batches -= 1
+        if RESIDENT_ENGINE or engine.batches or engine.active:
+            return
+        if _engine_pool.peek(engine.key[0]) is engine:
+            _engine_pool.remove(engine.key[0])
+        log_info(f"Engine stopping: {engine.name} (batch finished)")
+        engine.stop()
+
+def batch_answer(engine, item, max_tokens, generation):
+    """Result fields for one batch item (waits for an inference slot first)"""
+    ticket = scheduler_submit(PRIORITY_BATCH)
+    while ticket is None:
+        # Queue full of chat requests: batches wait instead of failing
+        if generation.cancelled:
+            raise batch.BatchError('cancelled')
+        time.sleep(1)
+        ticket = scheduler_submit(PRIORITY_BATCH)
+    abort = None
+    try:
+        if not scheduler_wait(ticket, None, generation):
+            raise batch.BatchError('cancelled')
+        deadline = time.time() + BATCH_LOAD_TIMEOUT
+        while True:
+            # A failed item marks the engine down; check() restarts it if it exited
+            with _engine_lock:
+                if engine.ready or engine.check():
+                    engine.active += 1
+                    break
+            if time.time() >= deadline:
+                raise batch.BatchError(f"engine for {engine.name} is not ready")
+            time.sleep(0.5)
+
+        def on_connect(sock):
+            nonlocal abort
+            abort = functools.partial(engine_abort, sock)
+            generation.on_cancel(abort)
+
+        try:
+            family = prompt_templates.get_model_family(engine.name)
+            n_predict = default_max_tokens(item['message'], family, item['max_tokens'] or max_tokens)
+            payload = batch.item_payload(item, engine.name, n_predict)
+            body = batch.complete(engine.port, payload, timeout=300, on_connect=on_connect)
+        except (OSError, http.client.HTTPException, ValueError):
+            if not generation.cancelled:
+                with _engine_lock:
+                    engine.ready = False
+            raise
+        finally:
+            with _engine_lock:
+                engine.active -= 1
+        return batch.result_fields(body, engine.name)
+    finally:
+        if abort is not None:
+            generation.remove_callback(abort)
+        scheduler_release(ticket)
+
+def batch_stream(run, generation):
+    """NDJSON lines for a prepared batch: header, checkpointed results, new results, summary"""
+    def line(data):
+        return json.dumps(data, ensure_ascii=False).encode() + b'\n'
+
+    model_name = os.path.basename(run['model_path'])
+    checkpoint = run['checkpoint']
+    stats = batch.Stats(len(run['items']), len(run['finished']))
+    engine = None
+    try:
+        yield line({'batch_id': run['id'], 'model': model_name, 'items': len(run['items']),
+                    'resumed': len(run['finished']), 'order': run['order'], 'concurrency': run['concurrency']})
+        for result in run['finished']:
+            yield line(dict(result, resumed=True))
+        if run['todo']:
+            engine = batch_engine(run['model_path'])
+            if engine is None:
+                yield line(dict(stats.summary(), batch_id=run['id'],
+                                error=f"Engine for {model_name} not ready after {BATCH_LOAD_TIMEOUT}s"))
+                return
+        results = batch.run(run['todo'], lambda item: batch_answer(engine, item, run['max_tokens'], generation),
+                            run['concurrency'], run['order'])
+        try:
+            for result in results:
+                if generation.cancelled:
+                    break
+                stats.add(result)
+                _batch_items.inc(result='error' if result.get('error') else 'ok')
+                if not result.get('error'):
+                    checkpoint.add(result)
+                yield line(result)
+        finally:
+            results.close()
+        summary = dict(stats.summary(), batch_id=run['id'])
+        if generation.cancelled or stats.errors:
+            summary['resumable'] = True
+        else:
+            checkpoint.remove()
+        log_info(f"Batch {run['id']}: {stats.ok} ok, {stats.errors} errors, "
+                 f"{summary['items_per_s']} items/s, {summary['tokens_per_s']} tokens/s")
+        yield line(summary)
+    finally:
+        checkpoint.close()
+        if engine is not None:
+            batch_release(engine)
+
+# =============================================================================
+# Background jobs
+# =============================================================================
+# Model management (install, remove, verify-all) runs on a small worker pool
+# instead of a request thread: the request gets 202 and a job id, and the job
+# can be polled or tailed as SSE on /api/jobs/<job_id>. Pool threads run at a
+# lower CPU priority (JOB_NICE) that the download threads and engine.sh
+# processes they start inherit, so a download doesn't slow token generation.
+# A second request for the same operation on the same model joins the job
+# already queued or running.
+#
+# Installs download inside the API process (data/downloader.py): parallel
+# range requests into a resumable .part file with a streaming sha256, checked
+# with the GGUF reader before it is moved into models/.
+JOB_WORKERS = max(1, int(os.environ.get('JOB_WORKERS', 2)))
+JOB_HISTORY = int(os.environ.get('JOB_HISTORY', 50))  # finished jobs kept for polling
+JOB_NICE = int(os.environ.get('JOB_NICE', 10))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 600))  # engine.sh commands (not downloads)
+MODEL_NAME_RE = re.compile(r'^[A-Za-z0-9._-]+$')
+_ANSI_RE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+
+_jobs = {}  # job id -> Job, oldest first
+_jobs_lock = threading.Lock()
+_catalog_entries = {}
+
+def _job_thread_init():
+    """Lower the pool thread's priority (nice values are per thread on Linux)"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), JOB_NICE)
+    except (AttributeError, OSError) as e:
+        log_debug(f"Job worker priority unchanged: {e}")
+
+_job_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=JOB_WORKERS, thread_name_prefix='pocketai-job', initializer=_job_thread_init)
+
+class Job:
+    """One background operation; its events are kept for polling and SSE"""
+    def __init__(self, kind, model='', options=None):
+        self.id = os.urandom(6).hex()
+        self.kind = kind
+        self.model = model
+        self.options = options or {}
+        self.filename = ''
+        self.state = 'queued'
+        self.message = ''
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self.future = None
+        self.downloader = None
+        self.process = None
+        self.cancel_requested = False
+        self.cond = threading.Condition()
+        self.listeners = []  # called (without arguments) after every event
+
+    @property
+    def active(self):
+        return self.state in ('queued', 'running')
+
+    def emit(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+        self.notify()
+
+    def notify(self):
+        for fn in list(self.listeners):
+            fn()
+
+    def start(self):
+        self.state = 'running'
+        self.started = time.time()
+        self.emit({'state': 'running'})
+
+    def finish(self, state, message, result=None):
+        with self.cond:
+            if not self.active:
+                return
+            self.state = state
+            self.message = message
+            self.result = result
+            self.finished = time.time()
+            self.events.append({'done': True, 'state': state, 'message': message})
+            self.cond.notify_all()
+        self.notify()
+        log_info(f"Job {self.id} ({self.kind} {self.model or 'all'}) {state}: {message}")
+
+    def cancel(self):
+        """Stop the job; a cancelled download keeps its chunks for a later resume"""
+        self.cancel_requested = True
+        if self.future is not None and self.future.cancel():
+            self.finish('cancelled', 'Cancelled before it started')
+            return
+        if self.downloader is not None:
+            self.downloader.cancel()
+        if self.process is not None:
+            _reaper.terminate(self.process)
+
+    def join(self):
+        with self.cond:
+            while self.active:
+                self.cond.wait()
+
+    def wait(self, after=0, timeout=None):
+        """Events after index `after`, blocking until there is one or the job ends"""
+        with self.cond:
+            if len(self.events) <= after and self.active:
+                self.cond.wait(timeout)
+            return self.events[after:]
+
+    def view(self):
+        progress = next((e for e in reversed(self.events) if 'phase' in e), None)
+        return {
+            'job_id': self.id,
+            'type': self.kind,
+            'model': self.model,
+            'options': self.options,
+            'file': self.filename,
+            'state': self.state,
+            'message': self.message,
+            'progress': progress,
+            'output': [e['line'] for e in self.events if 'line' in e],
+            'result': self.result,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+def run_job_cmd(job, cmd, timeout=JOB_TIMEOUT):
+    """Run an engine.sh command for a job, emitting its output line by line"""
+    process = subprocess.Popen(
+        f'source {POCKETAI_ROOT}/core/engine.sh && {cmd}',
+        shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+        text=True, errors='replace', executable=BASH, preexec_fn=os.setsid
+    )
+    job.process = process
+    timed_out = []
+
+    def expire():
+        timed_out.append(True)
+        job.cancel()
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    lines = []
+    try:
+        for line in process.stdout:
+            line = _ANSI_RE.sub('', line).rstrip()
+            if line:
+                lines.append(line)
+                job.emit({'line': line})
+        process.wait()
+    finally:
+        timer.cancel()
+        job.process = None
+        process.stdout.close()
+    if timed_out:
+        log_error(f"Job {job.id} timed out after {timeout}s: {cmd[:50]}")
+        _timeouts.inc(kind='command')
+        job.finish('failed', f"Command timed out after {timeout}s")
+    elif job.cancel_requested:
+        job.finish('cancelled', 'Cancelled')
+    return '\n'.join(lines), process.returncode == 0
+
+def catalog_entry(name):
+    """{'url', 'ram'} of a catalog model (from engine.sh's MODEL_CATALOG); None if unknown
+
+    ram is in bytes (None when the entry has no usable figure).
+    """
+    if not MODEL_NAME_RE.match(name or ''):
+        return None
+    if name not in _catalog_entries:
+        out, ok = run_cmd(f'echo "${{MODEL_CATALOG[{name}]:-}}"')
+        fields = out.rsplit('|', 3) if ok else []
+        if len(fields) != 4 or not fields[3]:
+            return None
+        _catalog_entries[name] = {'url': fields[3], 'ram': warm_pool.parse_size(fields[2])}
+    return _catalog_entries[name]
+
+def catalog_url(name):
+    """Download URL of a catalog model; '' if unknown"""
+    entry = catalog_entry(name)
+    return entry['url'] if entry else ''
+
+def run_install(job):
+    """Download, verify, register and auto-activate the first model"""
+    url = catalog_url(job.model)
+    if not url:
+        job.finish('failed', f"Unknown model: {job.model}")
+        return
+    refusal = governor_install(job)
+    if refusal is not None:
+        job.finish('failed', refusal['message'], {'governor': refusal})
+        return
+    job.filename = os.path.basename(url)
+    path = os.path.join(get_models_dir(), job.filename)
+    os.makedirs(get_models_dir(), exist_ok=True)
+    if os.path.isfile(path) and gguf.verify_gguf(path, 'full')[0]:
+        job.finish('done', f"Model already installed and verified: {job.filename}")
+        return
+
+    connections = int(get_config_value_fast('download_connections', '4') or 4)
+    rate_limit = parse_rate(get_config_value_fast('download_limit', '0'))
+    job.downloader = Downloader(url, path, connections, rate_limit, progress=job.emit,
+                                verify=lambda part: gguf.verify_gguf(part, 'full'))
+    if job.cancel_requested:
+        job.downloader.cancel()
+    log_info(f"Job {job.id}: downloading {url} ({connections} connections)")
+    result = job.downloader.run()
+    models_changed()
+    if not get_active_model_fast():
+        config_update({'active_model': path})
+    job.finish('done', f"Model installed and verified: {job.filename}", result)
+
+def run_remove(job):
+    """Delete an installed model (engine.sh also clears it if active)"""
+    entry = _model_index.find(job.model)
+    if entry is None:
+        job.finish('failed', f"Model not found: {job.model}")
+        return
+    job.filename = entry['name']
+    out, ok = run_job_cmd(job, f'model_remove "{job.filename}"')
+    models_changed()
+    job.finish('done' if ok else 'failed', out or f'Model {job.model} removed')
+
+def run_verify_all(job):
+    """Verify every installed model (in parallel; unchanged files come from the cache)"""
+    recheck = ' --no-cache' if job.options.get('recheck') else ''
+    out, ok = run_job_cmd(job, f'model_verify_all "{job.options.get("mode", "full")}"{recheck}')
+    job.finish('done' if ok else 'failed', out, {'success': ok})
+
+def run_tune(job):
+    """Sweep threads/batch/ctx for a model and save its profile for this device"""
+    if job.model:
+        entry = _model_index.find(job.model)
+        model_path = entry['path'] if entry else None
+    else:
+        model_path = get_active_model_fast()
+    if not model_path or not os.path.isfile(model_path):
+        job.finish('failed', f"Model not found: {job.model}" if job.model else 'No model active')
+        return
+    job.filename = os.path.basename(model_path)
+    # The sweep loads the model in its own server; an idle warm copy would only take RAM from it
+    with _engine_lock:
+        _engine['tuning'].add(model_path)
+        engine = _engine_pool.peek(model_path)
+        if engine is not None and not engine.active and not engine.batches:
+            log_info(f"Engine stopping for tuning: {engine.name}")
+            _engine_pool.remove(model_path)
+            engine.stop()
+    try:
+        refusal = governor_admit(model_path, 'tune')
+        if refusal is not None:
+            job.finish('failed', refusal['message'], {'governor': refusal})
+            return
+        quick = ' --quick' if job.options.get('quick') else ''
+        out, ok = run_job_cmd(job, f'tune_run "{job.filename}"{quick}', TUNE_TIMEOUT)
+    finally:
+        with _engine_lock:
+            _engine['tuning'].discard(model_path)
+    profile = _tune_profiles.lookup(model_path) if ok else None
+    message = out.rsplit('\n', 1)[-1] if out else ''
+    job.finish('done' if profile else 'failed', message or 'Tuning failed', {'profile': profile})
+
+JOB_RUNNERS = {'install': run_install, 'remove': run_remove, 'verify': run_verify_all, 'tune': run_tune}
+
+def run_job(job):
+    """Pool entry point; finish() is a no-op once the job body has set a state"""
+    if job.cancel_requested:
+        job.finish('cancelled', 'Cancelled before it started')
+        return
+    job.start()
+    try:
+        JOB_RUNNERS[job.kind](job)
+        job.finish('failed', 'Job ended without a result')
+    except (DownloadError, ValueError) as e:
+        job.finish('cancelled' if str(e) == 'cancelled' else 'failed', str(e))
+    except Exception as e:
+        log_error(f"Job {job.id} error: {e}\n{traceback.format_exc()}")
+        job.finish('failed', str(e))
+
+def start_job(kind, model='', options=None):
+    """Queue a job, or return the queued/running one for the same kind, model and options"""
+    if kind not in JOB_RUNNERS:
+        raise ValueError(f"Unknown job type: {kind}")
+    options = options or {}
+    with _jobs_lock:
+        for job in _jobs.values():
+            if job.kind == kind and job.model == model and job.options == options and job.active:
+                return job
+        job = Job(kind, model, options)
+        _jobs[job.id] = job
+        finished = [j.id for j in _jobs.values() if not j.active]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del _jobs[job_id]
+    job.future = _job_pool.submit(run_job, job)
+    return job
+
+def list_jobs():
+    with _jobs_lock:
+        return [job.view() for job in _jobs.values()]
+
+def job_counts():
+    """Jobs per state for /api/health and the pocketai_jobs gauge"""
+    counts = {'queued': 0, 'running': 0}
+    with _jobs_lock:
+        for job in _jobs.values():
+            counts[job.state] = counts.get(job.state, 0) + 1
+    return counts
+
+def job_accepted(job):
+    """202 body for a queued job"""
+    return dict(job.view(), status_url=f'/api/jobs/{job.id}')
+
+def job_result(job):
+    """Response for a finished (waited-for) job, in the shape of the old blocking routes"""
+    response = {'success': job.state == 'done', 'message': job.message, 'job_id': job.id}
+    if job.kind in ('install', 'tune'):
+        response['result'] = job.result
+    return response
+
+def find_job(path):
+    """Job for /api/jobs/<job_id> (or the older /api/models/install/<job_id>), or None"""
+    parts = path.rstrip('/').split('/')
+    if len(parts) != (4 if path.startswith('/api/jobs/') else 5):
+        return None
+    with _jobs_lock:
+        return _jobs.get(parts[-1])
+
+def verify_options(data):
+    """Options of a verify-all job (ValueError for an unknown mode)"""
+    mode = data.get('mode') or 'full'
+    if mode not in model_verify.MODES:
+        raise ValueError(f"Unknown verify mode: {mode}")
+    return {'mode': mode, 'recheck': bool(data.get('recheck'))}
+
+def job_request(path, data):
+    """Job for a POST to /api/jobs or one of the model management routes"""
+    kind = data.get('type', '') if path == '/api/jobs' else path.rsplit('/', 1)[-1]
+    if kind == 'verify':
+        return start_job(kind, options=verify_options(data))
+    if kind == 'tune':
+        return start_job(kind, data.get('model', ''), {'quick': bool(data.get('quick'))})
+    if kind == 'install' and data.get('force'):
+        return start_job(kind, data.get('model', ''), {'force': True})
+    return start_job(kind, data.get('model', ''))
+
+def wants_event_stream(target, headers):
+    """True if a GET asks for SSE (Accept header or ?stream=1)"""
+    query = parse_qs(urlparse(target).query)
+    return ('text/event-stream' in (headers.get('Accept') or '') or
+            query.get('stream', [''])[0] in ('1', 'true'))
+
+# =============================================================================
+# Inference scheduler
+# =============================================================================
+# Limits concurrent generations to INFERENCE_SLOTS and queues the rest (up to
+# INFERENCE_QUEUE). Streaming requests are served before blocking ones, and
+# both before batch items, with aging: each priority step counts as arriving
+# INFERENCE_AGING seconds later, so a waiting request is never passed by one
+# that arrived more than that after it.
+INFERENCE_SLOTS = max(1, int(os.environ.get('INFERENCE_SLOTS', 1)))
+INFERENCE_QUEUE = int(os.environ.get('INFERENCE_QUEUE', 8))
+INFERENCE_QUEUE_TIMEOUT = int(os.environ.get('INFERENCE_QUEUE_TIMEOUT', 300))
+INFERENCE_AGING = max(0.0, float(os.environ.get('INFERENCE_AGING', 10)))
+
+PRIORITY_STREAM = 0
+PRIORITY_BLOCKING = 1
+PRIORITY_BATCH = 2      # one ticket per batch item, so chat requests go first between items
+
+_scheduler = {
+    'active': 0,
+    'queue': [],            # heap of waiting tickets
+    'seq': 0,
+    'admitted': 0,
+    'rejected': 0,
+    'timed_out': 0,
+    'wait_total': 0.0,
+    'avg_service': 30.0     # moving average of slot hold time (seconds)
+}
+_scheduler_lock = threading.Lock()
+
+class InferenceTicket:
+    """A request waiting for, or holding, an inference slot"""
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.time()
+        self.rank = self.enqueued_at + priority * INFERENCE_AGING  # queue order, lowest first
+        self.started_at = None
+        self.released = False
+        self.granted = threading.Event()
+        self.callbacks = []
+
+    def __lt__(self, other):
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+    def wait_time(self):
+        return (self.started_at or time.time()) - self.enqueued_at
+
+def _scheduler_grant_locked(ticket):
+    ticket.started_at = time.time()
+    _scheduler['active'] += 1
+    _scheduler['admitted'] += 1
+    _scheduler['wait_total'] += ticket.wait_time()
+    _queue_wait_seconds.observe(ticket.wait_time())
+    ticket.granted.set()
+    for callback in ticket.callbacks:
+        callback()
+
+def scheduler_submit(priority):
+    """Ask for an inference slot; None when the queue is full"""
+    with _scheduler_lock:
+        _scheduler['seq'] += 1
+        ticket = InferenceTicket(priority, _scheduler['seq'])
+        if _scheduler['active'] < INFERENCE_SLOTS and not _scheduler['queue']:
+            _scheduler_grant_locked(ticket)
+        elif len(_scheduler['queue']) < INFERENCE_QUEUE:
+            heapq.heappush(_scheduler['queue'], ticket)
+        else:
+            _scheduler['rejected'] += 1
+            return None
+    return ticket
+
+def scheduler_release(ticket):
+    """Give back a slot (or leave the queue) and admit the next waiter"""
+    with _scheduler_lock:
+        if ticket.released:
+            return
+        ticket.released = True
+        if not ticket.granted.is_set():
+            _scheduler['queue'].remove(ticket)
+            heapq.heapify(_scheduler['queue'])
+            return
+        _scheduler['active'] -= 1
+        service = time.time() - ticket.started_at
+        _scheduler['avg_service'] = 0.8 * _scheduler['avg_service'] + 0.2 * service
+        while _scheduler['queue'] and _scheduler['active'] < INFERENCE_SLOTS:
+            _scheduler_grant_locked(heapq.heappop(_scheduler['queue']))
+
+def scheduler_wait(ticket, timeout=None, generation=None):
+    """Block until the ticket holds a slot; False on timeout or when the generation is cancelled"""
+    if generation is None:
+        return ticket.granted.wait(timeout)
+    wake = threading.Event()
+    with _scheduler_lock:
+        ticket.callbacks.append(wake.set)
+    generation.on_cancel(wake.set)
+    try:
+        if not ticket.granted.is_set():
+            wake.wait(timeout)
+        return ticket.granted.is_set() and not generation.cancelled
+    finally:
+        generation.remove_callback(wake.set)
+        with _scheduler_lock:
+            ticket.callbacks.remove(wake.set)
+
+async def scheduler_wait_async(ticket, timeout=None, generation=None):
+    """Event-loop version of scheduler_wait"""
+    if ticket.granted.is_set():
+        return True
+    loop = asyncio.get_running_loop()
+    granted = loop.create_future()
+
+    def notify(result=True):
+        loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(result))
+
+    def cancelled():
+        notify(False)
+
+    with _scheduler_lock:
+        if ticket.granted.is_set():
+            return True
+        ticket.callbacks.append(notify)
+    if generation is not None:
+        generation.on_cancel(cancelled)
+    try:
+        return await asyncio.wait_for(asyncio.shield(granted), timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        if generation is not None:
+            generation.remove_callback(cancelled)
+
+def scheduler_timeout(ticket):
+    """Drop a ticket that waited too long"""
+    with _scheduler_lock:
+        _scheduler['timed_out'] += 1
+    scheduler_release(ticket)
+
+def scheduler_position(ticket):
+    """1-based queue position (0 once admitted)"""
+    with _scheduler_lock:
+        if ticket.granted.is_set():
+            return 0
+        return 1 + sum(1 for t in _scheduler['queue'] if t < ticket)
+
+def scheduler_retry_after():
+    """Seconds a rejected client should wait before retrying"""
+    with _scheduler_lock:
+        backlog = len(_scheduler['queue']) + 1
+        return max(1, math.ceil(_scheduler['avg_service'] * backlog / INFERENCE_SLOTS))
+
+def scheduler_stats():
+    """Snapshot for /api/health"""
+    with _scheduler_lock:
+        admitted = _scheduler['admitted']
+        return {
+            'slots': INFERENCE_SLOTS,
+            'active': _scheduler['active'],
+            'queued': len(_scheduler['queue']),
+            'queue_limit': INFERENCE_QUEUE,
+            'admitted': admitted,
+            'rejected': _scheduler['rejected'],
+            'timed_out': _scheduler['timed_out'],
+            'avg_wait': round(_scheduler['wait_total'] / admitted, 3) if admitted else 0.0,
+            'avg_service': round(_scheduler['avg_service'], 3)
+        }
+
+def queue_event(ticket):
+    """SSE pre-event describing a ticket's place in the queue"""
+    return sse_frame({'queue': {'position': scheduler_position(ticket), 'wait': round(ticket.wait_time(), 2)}})
+
+# =============================================================================
+# HTTP/1.1 connections
+# =============================================================================
+# Both server modes keep HTTP/1.1 connections open between requests: an idle
+# connection is closed after KEEPALIVE_TIMEOUT seconds and every connection
+# after KEEPALIVE_MAX requests. Complete responses carry Content-Length;
+# streams use chunked transfer encoding (HTTP/1.0 clients get close-delimited
+# bodies instead). Blocking chat sends its headers once a slot is granted and
+# a blank chunk every JSON_HEARTBEAT seconds until the JSON is ready.
+KEEPALIVE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', 5))
+KEEPALIVE_MAX = max(1, int(os.environ.get('KEEPALIVE_MAX', 100)))
+JSON_HEARTBEAT = float(os.environ.get('JSON_HEARTBEAT', 15))
+
+def chunk_frame(data):
+    """Encode one chunk of a Transfer-Encoding: chunked body"""
+    return b'%x\r\n%s\r\n' % (len(data), data)
+
+def keep_alive_header(served):
+    """Keep-Alive header value after `served` requests on a connection"""
+    return f'timeout={KEEPALIVE_TIMEOUT:g}, max={KEEPALIVE_MAX - served}'
+
+# =============================================================================
+# Static files
+# =============================================================================
+# The dashboard (SERVE_WEB) is served from memory with gzip/brotli variants,
+# reloaded when a file changes; ETag / Last-Modified revalidation answers
+# repeat visits with an empty 304.
+_static = StaticFiles(os.path.join(POCKETAI_ROOT, 'web'))
+
+def static_response(asset, headers):
+    """(status, headers, body) for a static asset; body None means send the file"""
+    encoding, body = asset.select(headers.get('Accept-Encoding'))
+    out = {
+        'Content-Type': asset.content_type,
+        'ETag': asset.etag_for(encoding),
+        'Last-Modified': email.utils.formatdate(asset.last_modified, usegmt=True),
+        'Cache-Control': 'no-cache',
+    }
+    if asset.compressed:
+        out['Vary'] = 'Accept-Encoding'
+    if_none_match = headers.get('If-None-Match')
+    if asset.matches(if_none_match):
+        return 304, out, b''
+    since = headers.get('If-Modified-Since')
+    if since and not if_none_match:
+        try:
+            if int(asset.last_modified) <= email.utils.parsedate_to_datetime(since).timestamp():
+                return 304, out, b''
+        except (TypeError, ValueError):
+            pass
+    if encoding:
+        out['Content-Encoding'] = encoding
+    out['Content-Length'] = str(len(body) if body is not None else asset.size)
+    return 200, out, body
+
+class APIHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    # Suppress default logging
+    def log_message(self, format, *args):
+        pass
+
+    # Socket-level timeout for all requests
+    timeout = 30
+
+    def setup(self):
+        super().setup()
+        self.served = 0       # requests answered on this connection
+        self.chunked = False  # current response body is chunked
+
+    def parse_request(self):
+        """Parse request line and headers (starts the latency clock)"""
+        self.request_start = time.monotonic()
+        self.connection.settimeout(self.timeout)
+        self.served += 1
+        self.chunked = False
+        self.connection_header = False
+        if not super().parse_request():
+            return False
+        if 'Transfer-Encoding' in self.headers:
+            # do_POST reads Content-Length bodies only; don't parse the rest as a request
+            self.send_error(411, explain='Chunked request bodies are not supported')
+            return False
+        if self.served >= KEEPALIVE_MAX:
+            self.close_connection = True
+        return True
+
+    def handle_one_request(self):
+        """Handle a request and record its latency"""
+        self.command = None
+        if self.served:
+            # Waiting for the next request on a kept-alive connection
+            self.connection.settimeout(KEEPALIVE_TIMEOUT)
+        super().handle_one_request()
+        if self.chunked:
+            # Body left unterminated (error mid-stream): the connection can't be reused
+            self.close_connection = True
+        if self.command:
+            _request_seconds.observe(time.monotonic() - self.request_start, method=self.command,
+                                     route=metric_route(urlparse(self.path).path))
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection':
+            self.connection_header = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        """Tell the client whether the connection stays open"""
+        if not self.connection_header:
+            if self.close_connection:
+                self.send_header('Connection', 'close')
+            else:
+                self.send_header('Keep-Alive', keep_alive_header(self.served))
+        self.connection_header = False
+        super().end_headers()
+
+    def disconnected(self, what, e):
+        """A write failed: count it and stop using the connection"""
+        log_debug(f"Client disconnected during {what}: {e}")
+        _client_disconnects.inc()
+        self.close_connection = True
+
+    def send_json(self, data, status=200, headers=None):
+        try:
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
+            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.disconnected('JSON response', e)
+        except Exception as e:
+            log_error(f"send_json error: {e}")
+            self.close_connection = True
+
+    def start_stream(self, content_type, headers=None):
+        """200 with a body of unknown length: chunked for HTTP/1.1, else ended by closing"""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.request_version == 'HTTP/1.1' and not self.close_connection:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.chunked = True
+        else:
+            self.close_connection = True
+        self.end_headers()
+
+    def write_stream(self, data):
+        """Write part of a start_stream body"""
+        if data:
+            self.wfile.write(chunk_frame(data) if self.chunked else data)
+
+    def end_stream(self):
+        """Terminate a chunked body so the connection can be reused"""
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+            self.chunked = False
+
+    def send_text(self, text, content_type='text/plain; charset=utf-8', status=200):
+        try:
+            body = text.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.disconnected('text response', e)
+
+    def send_error_json(self, message, status=500):
+        """Send error response as JSON (server errors also close the connection)"""
+        log_error(f"HTTP {status}: {message}")
+        if status >= 500:
+            self.close_connection = True
+        self.send_json({'error': message, 'status': status}, status)
+
+    def send_busy(self):
+        """429 with Retry-After when the inference queue is full"""
+        retry_after = scheduler_retry_after()
+        log_warn(f"Inference queue full, rejecting (retry after {retry_after}s)")
+        self.send_json({'error': 'Server busy, try again later', 'status': 429, 'retry_after': retry_after},
+                       429, headers={'Retry-After': str(retry_after)})
+
+    def send_refused(self, decision):
+        """503 with Retry-After for a request the resource governor refused"""
+        status, body, headers = governor_refusal(decision)
+        self.send_json(body, status, headers=headers)
+
+    def send_sse_stream(self, generator, full_response=True, flush_ms=SSE_FLUSH_MS, ticket=None, on_complete=None,
+                        req_id=None, generation=None, deadline=None):
+        """Send Server-Sent Events stream with robust error handling
+
+        req_id goes out as X-Request-ID (the ID to cancel with); a cancelled
+        generation ends the stream with "cancelled" in the final event.
+        Chunks arriving within flush_ms of the last write (up to
+        SSE_FLUSH_BYTES) go out as one event; deadline is the FlushDeadline
+        the source was given, so held text isn't stuck behind a slow read.
+        """
+        req_id = req_id or get_request_id()
+        log_info(f"[REQ-{req_id}] SSE stream started")
+        parts = []
+        events = 0
+
+        try:
+            self.start_stream('text/event-stream', {'X-Request-ID': str(req_id)})
+
+            if ticket is not None and not ticket.granted.is_set():
+                # Report queue position until a slot frees up
+                log_info(f"[REQ-{req_id}] Queued at position {scheduler_position(ticket)}")
+                while not scheduler_wait(ticket, 1, generation):
+                    if generation is not None and generation.cancelled:
+                        self.write_stream(sse_frame({'done': True, 'cancelled': True}))
+                        self.end_stream()
+                        return
+                    if ticket.wait_time() > INFERENCE_QUEUE_TIMEOUT:
+                        scheduler_timeout(ticket)
+                        self.write_stream(sse_frame({'error': 'Timed out waiting in queue'}))
+                        self.end_stream()
+                        return
+                    self.write_stream(queue_event(ticket))
+                self.write_stream(queue_event(ticket))
+
+            window = flush_ms / 1000
+            pending = []
+            pending_len = 0
+            last_flush = 0
+            for chunk in itertools.chain(generator, [None]):  # None: end of stream
+                if chunk:
+                    pending.append(chunk)
+                    pending_len += len(chunk)
+                if not pending:
+                    continue
+                now = time.monotonic()
+                if chunk is not None and pending_len < SSE_FLUSH_BYTES and now - last_flush < window:
+                    if deadline is not None:
+                        deadline.at = last_flush + window
+                    continue
+                text = ''.join(pending)
+                pending = []
+                pending_len = 0
+                last_flush = now
+                if deadline is not None:
+                    deadline.at = None
+                parts.append(text)
+                events += 1
+                try:
+                    self.write_stream(sse_frame({'token': text}))
+                except (BrokenPipeError, ConnectionResetError):
+                    log_warn(f"[REQ-{req_id}] Client disconnected during stream")
+                    _client_disconnects.inc()
+                    self.close_connection = True
+                    return
+
+            # Send completion event
+            full_text = ''.join(parts)
+            if on_complete is not None:
+                on_complete(full_text)
+            final = {'done': True}
+            if generation is not None and generation.cancelled:
+                final['cancelled'] = True
+            if full_response:
+                final['full_response'] = full_text
+            self.write_stream(sse_frame(final))
+            self.end_stream()
+            log_info(f"[REQ-{req_id}] SSE complete: {sum(map(len, parts))} chars in {events} events")
+
+        except (BrokenPipeError, ConnectionResetError) as e:
+            log_warn(f"[REQ-{req_id}] Client disconnected: {e}")
+            _client_disconnects.inc()
+            self.close_connection = True
+        except Exception as e:
+            log_error(f"[REQ-{req_id}] SSE error: {e}\n{traceback.format_exc()}")
+            try:
+                self.write_stream(sse_frame({'error': str(e)}))
+                self.end_stream()
+            except:
+                self.close_connection = True
+        finally:
+            # Stops the source generator (and its process) if we bailed out early
+            generator.close()
+            if ticket is not None:
+                scheduler_release(ticket)
+
+    def send_job_events(self, job):
+        """SSE: replay a job's events, then follow it until it ends"""
+        try:
+            self.start_stream('text/event-stream')
+            seen = 0
+            while True:
+                events = job.wait(seen, timeout=15)
+                if not events:
+                    self.write_stream(b': keep-alive\n\n')
+                    continue
+                self.write_stream(b''.join(sse_frame(event) for event in events))
+                seen += len(events)
+                if events[-1].get('done'):
+                    break
+            self.end_stream()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.disconnected('job events', e)
+
+    def send_json_when_ready(self, compute, headers=None):
+        """send_json(compute()) for slow handlers
+
+        HTTP/1.1 clients get the headers at once and a chunked body: a blank
+        chunk every JSON_HEARTBEAT seconds keeps idle timeouts in clients and
+        proxies from firing during a long generation (leading whitespace is
+        valid JSON). HTTP/1.0 clients wait for a plain send_json.
+        """
+        if self.request_version != 'HTTP/1.1' or self.close_connection:
+            self.send_json(compute(), headers=headers)
+            return
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(JSON_HEARTBEAT):
+                with lock:
+                    try:
+                        self.write_stream(b' ')
+                    except OSError:
+                        return
+
+        try:
+            self.start_stream('application/json', headers)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.disconnected('JSON response', e)
+            compute()
+            return
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        try:
+            data = compute()
+        except Exception as e:
+            # Too late for an error status: report it in the body and close
+            log_error(f"HTTP 500: {e}\n{traceback.format_exc()}")
+            data = {'error': str(e), 'status': 500}
+            self.close_connection = True
+        finally:
+            stop.set()
+            beat.join()
+        try:
+            with lock:
+                self.write_stream(json.dumps(data).encode())
+                self.end_stream()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.disconnected('JSON response', e)
+
+    def begin_generation(self, req_id, kind):
+        """Register the request's generation; it is cancelled if the client disconnects"""
+        generation = _generations.start(req_id, kind)
+        connection = getattr(self, 'connection', None)  # none under handle_buffered
+        if connection is not None:
+            _disconnects.watch(connection, generation)
+        return generation
+
+    def end_generation(self, generation):
+        connection = getattr(self, 'connection', None)
+        if connection is not None:
+            _disconnects.unwatch(connection)
+        _generations.end(generation)
+
+    def do_OPTIONS(self):
+        self.send_json({})
+
+    def do_GET(self):
+        req_id = get_request_id()
+        path = urlparse(self.path).path
+
+        try:
+            if path == '/api/health':
+                self.send_json({
+                    'healthy': True,
+                    'active_streams': _active_streams,
+                    'uptime': time.time() - _server_start_time,
+                    'engine': engine_status(),
+                    'scheduler': scheduler_stats(),
+                    'cache': _response_cache.snapshot(),
+                    'sessions': _sessions.snapshot(),
+                    'static': _static.snapshot(),
+                    'models': _model_index.snapshot(),
+                    'jobs': job_counts(),
+                    'shell_workers': _shell_workers.snapshot(),
+                    'generations': _generations.snapshot(),
+                    'governor': governor_health()
+                })
+
+            elif path == '/api/governor':
+                self.send_json(dict(_governor.snapshot(), enabled=GOVERNOR))
+
+            elif path == '/api/tune':
+                self.send_json(tune_view())
+
+            elif path == '/api/metrics':
+                self.send_text(_metrics.render(), METRICS_CONTENT_TYPE)
+
+            elif path == '/api/reset':
+                # Cancel every running generation: only the process groups they own are ended
+                cancelled = _generations.cancel_all('reset')
+                log_warn(f"[REQ-{req_id}] Reset requested - cancelled {cancelled} generations")
+                _status_cache['last_update'] = 0
+                self.send_json({'reset': True, 'cancelled': cancelled,
+                                'message': f'Cancelled {cancelled} running generations'})
+
+            elif path == '/api/status':
+                model_name, version = get_cached_status()
+                self.send_json({'status': 'ok', 'version': version, 'model': model_name})
+
+            elif path == '/api/models':
+                # Instant - uses hardcoded catalog
+                models = [
+                    {'name': name, 'description': info['desc'], 'size': info['size'], 'ram': info['ram']}
+                    for name, info in MODEL_CATALOG.items()
+                ]
+                self.send_json({'models': models})
+
+            elif path == '/api/models/installed':
+                # Fast - uses Python file operations with caching
+                models = get_installed_models_fast()
+                self.send_json({'models': models})
+
+            elif path == '/api/config':
+                # In-memory config, re-read only when the file changes
+                self.send_json(dict(config_values()))
+
+            elif path == '/api/sessions':
+                self.send_json({'sessions': _sessions.list()})
+
+            elif path.startswith('/api/sessions/'):
+                route = parse_session_path(path)
+                session = _sessions.get(route[0]) if route and not route[1] else None
+                if session is None:
+                    self.send_error_json('Session not found', 404)
+                else:
+                    self.send_json(session_view(session))
+
+            elif path == '/api/jobs':
+                self.send_json({'jobs': list_jobs(), 'workers': JOB_WORKERS})
+
+            elif path.startswith('/api/jobs/') or path.startswith('/api/models/install/'):
+                job = find_job(path)
+                if job is None:
+                    self.send_error_json('Job not found', 404)
+                elif wants_event_stream(self.path, self.headers):
+                    self.send_job_events(job)
+                else:
+                    self.send_json(job.view())
+
+            elif path == '/api/models/verify':
+                # GET: Verify all models (waits for the job)
+                log_info(f"[REQ-{req_id}] Verifying all models (GET)")
+                job = start_job('verify', options=verify_options({}))
+                job.join()
+                self.send_json(job_result(job))
+
+            else:
+                self.send_json({'error': 'Not found'}, 404)
+
+        except Exception as e:
+            log_error(f"[REQ-{req_id}] GET {path} error: {e}\n{traceback.format_exc()}")
+            self.send_error_json(str(e), 500)
+
+    def do_POST(self):
+        req_id = get_request_id()
+        path = urlparse(self.path).path
+
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length).decode() if content_length > 0 else '{}'
+
+            try:
+                data = json.loads(body)
+            except json.JSONDecodeError as e:
+                log_warn(f"[REQ-{req_id}] Invalid JSON: {e}")
+                data = {}
+
+            if path in ('/api/jobs', '/api/models/install', '/api/models/remove', '/api/tune') or (
+                    path == '/api/models/verify' and not data.get('model')):
+                # Background job: 202 now, poll or tail /api/jobs/<job_id>
+                try:
+                    job = job_request(path, data)
+                except ValueError as e:
+                    self.send_error_json(str(e), 400)
+                    return
+                log_info(f"[REQ-{req_id}] Job {job.id}: {job.kind} {job.model or 'all'} ({job.state})")
+                if data.get('background', True) is False:
+                    job.join()
+                    self.send_json(job_result(job))
+                else:
+                    self.send_json(job_accepted(job), 202)
+
+            elif path == '/api/models/use':
+                model = data.get('model', '')
+                log_info(f"[REQ-{req_id}] Activating model: {model}")
+                # Fast activation using Python (no shell) - instant!
+                ok, msg = activate_model_fast(model)
+                log_info(f"[REQ-{req_id}] Activation result: {ok} - {msg}")
+                self.send_json({'success': ok, 'message': msg})
+
+            elif path == '/api/models/verify':
+                model = data.get('model', '')
+                log_info(f"[REQ-{req_id}] Verifying model: {model}")
+                # Verify specific model: header + tensor bounds in Python (milliseconds)
+                self.send_json(verify_model_fast(model, data.get('mode', 'quick'), bool(data.get('recheck'))))
+
+            elif path == '/api/chat/batch':
+                self.handle_batch(req_id, batch_data(self.path, self.headers.get('Content-Type') or '', body, data))
+
+            elif path == '/api/chat':
+                message = data.get('message', '')
+                model, error = request_model(data)
+                if error:
+                    self.send_error_json(error, 404)
+                    return
+                max_tokens, error = request_max_tokens(data)
+                if error:
+                    self.send_error_json(error, 400)
+                    return
+                log_info(f"[REQ-{req_id}] Chat request (blocking): {len(message)} chars")
+                cache_id = response_cache_key(message, max_tokens, model=model) if data.get('cache', True) is not False else None
+                cached = cached_response(cache_id)
+                if cached is not None:
+                    log_info(f"[REQ-{req_id}] Chat served from cache: {len(cached)} chars")
+                    self.send_json({'response': cached, 'cached': True})
+                    return
+                refusal = governor_admit(model, 'chat')
+                if refusal is not None:
+                    self.send_refused(refusal)
+                    return
+                ticket = scheduler_submit(PRIORITY_BLOCKING)
+                if ticket is None:
+                    self.send_busy()
+                    return
+                generation = self.begin_generation(req_id, 'chat')
+                try:
+                    if not scheduler_wait(ticket, 120, generation):
+                        if generation.cancelled:
+                            scheduler_release(ticket)
+                            self.send_json({'response': '', 'cancelled': True})
+                        else:
+                            scheduler_timeout(ticket)
+                            self.send_busy()
+                        return
+
+                    def chat():
+                        try:
+                            engine = engine_wait_ready(model)
+                            out = engine_infer(engine, message, max_tokens, generation=generation) if engine else None
+                            ok = out is not None
+                            if out is None and not generation.cancelled:
+                                cmd, env = infer_command(message, max_tokens, model)
+                                out, ok = run_cmd(cmd, timeout=120, env=env, generation=generation)
+                        finally:
+                            scheduler_release(ticket)
+                        if generation.cancelled:
+                            log_info(f"[REQ-{req_id}] Chat cancelled ({generation.reason})")
+                            return {'response': out or '', 'cancelled': True}
+                        if ok:
+                            cache_response(cache_id, out)
+                        log_info(f"[REQ-{req_id}] Chat complete: {len(out)} chars")
+                        return {'response': out}
+
+                    self.send_json_when_ready(chat, headers={'X-Request-ID': str(req_id)})
+                finally:
+                    self.end_generation(generation)
+
+            elif path == '/api/chat/stream':
+                message = data.get('message', '')
+                model, error = request_model(data)
+                if error:
+                    self.send_error_json(error, 404)
+                    return
+                flush_ms, error = request_flush_ms(data)
+                if error:
+                    self.send_error_json(error, 400)
+                    return
+                max_tokens, error = request_max_tokens(data)
+                if error:
+                    self.send_error_json(error, 400)
+                    return
+                log_info(f"[REQ-{req_id}] Chat request (streaming): {len(message)} chars")
+                sse_options = {
+                    'full_response': data.get('full_response', True) is not False,
+                    'flush_ms': flush_ms
+                }
+                cache_id = response_cache_key(message, max_tokens, stream=True, model=model) \
+                    if data.get('cache', True) is not False else None
+                cached = cached_response(cache_id)
+                if cached is not None:
+                    log_info(f"[REQ-{req_id}] Stream served from cache: {len(cached)} chars")
+                    self.send_sse_stream(replay_response(cached), **sse_options)
+                    return
+                refusal = governor_admit(model, 'stream')
+                if refusal is not None:
+                    self.send_refused(refusal)
+                    return
+                ticket = scheduler_submit(PRIORITY_STREAM)
+                if ticket is None:
+                    self.send_busy()
+                    return
+                status = {}
+                generation = self.begin_generation(req_id, 'stream')
+                sse_options['ticket'] = ticket
+                sse_options['on_complete'] = lambda text: status.get('complete') and cache_response(cache_id, text)
+                try:
+                    deadline = FlushDeadline()
+                    source = chat_stream(message, max_tokens, model, status, generation, deadline)
+                    self.send_sse_stream(filtered_stream(source, os.path.basename(model), status),
+                                         req_id=req_id, generation=generation, deadline=deadline, **sse_options)
+                finally:
+                    self.end_generation(generation)
+
+            elif path.startswith('/api/chat/cancel/'):
+                request_id = path[len('/api/chat/cancel/'):]
+                generation = _generations.get(request_id)
+                if generation is None:
+                    self.send_error_json('Request not found', 404)
+                elif not generation.cancel('cancelled'):
+                    self.send_error_json('Request already cancelled', 409)
+                else:
+                    log_info(f"[REQ-{req_id}] Cancelled request {request_id} ({generation.kind})")
+                    self.send_json({'success': True, 'request_id': request_id})
+
+            elif path == '/api/sessions':
+                model, error = request_model(data)
+                if error:
+                    self.send_error_json(error, 404)
+                    return
+                session = _sessions.create(os.path.basename(model), model if data.get('model') else None)
+                log_info(f"[REQ-{req_id}] Session created: {session['id']}")
+                self.send_json({'session_id': session['id'], 'model': session['model']}, 201)
+
+            elif path.startswith('/api/sessions/'):
+                self.handle_session_turn(req_id, path, data)
+
+            elif path == '/api/config':
+                # {"key": k, "value": v} or a batch: {"values": {k: v, ...}}
+                updates = data.get('values')
+                if not isinstance(updates, dict):
+                    updates = {data.get('key', ''): data.get('value', '')}
+                updates = {str(k): str(v) for k, v in updates.items()}
+                log_info(f"[REQ-{req_id}] Config set: {', '.join(f'{k}={v}' for k, v in updates.items())}")
+                try:
+                    # Atomic write; listeners drop dependent caches
+                    config_update(updates)
+                    self.send_json({'success': True})
+                except Exception as e:
+                    log_error(f"Config set failed: {e}")
+                    self.send_json({'success': False, 'error': str(e)})
+
+            else:
+                self.send_json({'error': 'Not found'}, 404)
+
+        except Exception as e:
+            log_error(f"[REQ-{req_id}] POST {path} error: {e}\n{traceback.format_exc()}")
+            self.send_error_json(str(e), 500)
+
+    def do_DELETE(self):
+        req_id = get_request_id()
+        path = urlparse(self.path).path
+
+        try:
+            if path.startswith('/api/jobs/') or path.startswith('/api/models/install/'):
+                job = find_job(path)
+                if job is None:
+                    self.send_error_json('Job not found', 404)
+                elif not job.active:
+                    self.send_error_json(f'Job already {job.state}', 409)
+                else:
+                    log_info(f"[REQ-{req_id}] Cancelling job {job.id} ({job.kind} {job.model or 'all'})")
+                    job.cancel()
+                    self.send_json({'success': True, 'job_id': job.id})
+                return
+
+            route = parse_session_path(path) if path.startswith('/api/sessions/') else None
+            if route is None or route[1]:
+                self.send_json({'error': 'Not found'}, 404)
+            elif not _sessions.acquire(route[0]):
+                self.send_error_json('Session is busy', 409)
+            else:
+                try:
+                    deleted = _sessions.delete(route[0])
+                finally:
+                    _sessions.release(route[0])
+                log_info(f"[REQ-{req_id}] Session deleted: {route[0]} ({deleted})")
+                if deleted:
+                    self.send_json({'success': True})
+                else:
+                    self.send_error_json('Session not found', 404)
+
+        except Exception as e:
+            log_error(f"[REQ-{req_id}] DELETE {path} error: {e}\n{traceback.format_exc()}")
+            self.send_error_json(str(e), 500)
+
+    def handle_batch(self, req_id, data):
+        """POST /api/chat/batch: NDJSON results as the items finish"""
+        run, error = batch_prepare(data)
+        if run is None:
+            self.send_error_json(error[1], error[0])
+            return
+        refusal = governor_admit(run['model_path'], 'batch')
+        if refusal is not None:
+            self.send_refused(refusal)
+            return
+        log_info(f"[REQ-{req_id}] Batch {run['id']}: {len(run['items'])} items "
+                 f"({len(run['finished'])} already done) on {os.path.basename(run['model_path'])}")
+        generation = self.begin_generation(req_id, 'batch')
+        lines = batch_stream(run, generation)
+        try:
+            self.start_stream('application/x-ndjson', {'X-Request-ID': str(req_id), 'X-Batch-ID': run['id']})
+            for line in lines:
+                self.write_stream(line)
+            self.end_stream()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            generation.cancel('disconnected')
+            self.disconnected('batch results', e)
+        finally:
+            lines.close()
+            self.end_generation(generation)
+
+    def handle_session_turn(self, req_id, path, data):
+        """POST /api/sessions/<id>/messages (blocking) and /stream (SSE)"""
+        session, action = session_request(path, data)
+        if session is None:
+            self.send_error_json(action[1], action[0])
+            return
+        stream = action == 'stream'
+        ticket = None
+        generation = None
+        try:
+            message = data['message']
+            log_info(f"[REQ-{req_id}] Session {session['id']} turn ({action}): {len(message)} chars")
+            refusal = governor_admit(session_request_model(data) or session_model(session), 'session')
+            if refusal is not None:
+                self.send_refused(refusal)
+                return
+            ticket = scheduler_submit(PRIORITY_STREAM if stream else PRIORITY_BLOCKING)
+            if ticket is None:
+                self.send_busy()
+                return
+            turn = session_turn(session, message, request_max_tokens(data)[0], stream, session_request_model(data))
+            status = {}
+            generation = self.begin_generation(req_id, 'session')
+            if stream:
+                sse_ticket, ticket = ticket, None  # send_sse_stream releases it
+                deadline = FlushDeadline()
+                self.send_sse_stream(
+                    session_stream(session, turn, status, generation, deadline),
+                    full_response=data.get('full_response', True) is not False,
+                    flush_ms=request_flush_ms(data)[0],
+                    ticket=sse_ticket,
+                    on_complete=lambda text: session_commit(session, turn, text, status),
+                    req_id=req_id,
+                    generation=generation,
+                    deadline=deadline
+                )
+                return
+            if not scheduler_wait(ticket, 120, generation):
+                if generation.cancelled:
+                    self.send_json({'session_id': session['id'], 'response': '', 'cancelled': True})
+                else:
+                    scheduler_timeout(ticket)
+                    self.send_busy()
+                return
+
+            def reply():
+                text = ''.join(session_stream(session, turn, status, generation))
+                response = session_commit(session, turn, text, status)
+                log_info(f"[REQ-{req_id}] Session turn complete: {len(response)} chars")
+                result = {'session_id': session['id'], 'response': response, 'turns': len(session['turns']),
+                          'context': turn['context']}
+                if generation.cancelled:
+                    result['cancelled'] = True
+                return result
+
+            self.send_json_when_ready(reply, headers={'X-Request-ID': str(req_id)})
+        finally:
+            if ticket is not None:
+                scheduler_release(ticket)
+            if generation is not None:
+                self.end_generation(generation)
+            _sessions.release(session['id'])
+
+class CombinedHandler(APIHandler):
+    """Serve both API and static web files"""
+    def do_GET(self):
+        path = urlparse(self.path).path
+
+        # API routes
+        if path.startswith('/api/'):
+            return super().do_GET()
+        self.send_static(path)
+
+    def do_HEAD(self):
+        path = urlparse(self.path).path
+        if path.startswith('/api/') or _static.get(path) is None:
+            # No body: on a kept-alive connection it would be read as the next response
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_static(path, head_only=True)
+
+    def send_static(self, path, head_only=False):
+        """Static file from memory (or sendfile for large files), 304 when unchanged"""
+        asset = _static.get(path)
+        if asset is None:
+            self.send_json({'error': 'Not found'}, 404)
+            return
+        status, headers, body = static_response(asset, self.headers)
+        try:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if status == 304 or head_only:
+                return
+            if body is not None:
+                self.wfile.write(body)
+            elif hasattr(self, 'connection'):
+                with open(asset.path, 'rb') as f:
+                    self.connection.sendfile(f)  # os.sendfile where supported
+            else:
+                with open(asset.path, 'rb') as f:
+                    shutil.copyfileobj(f, self.wfile)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self.disconnected('static file', e)
+
+class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     """Handle each request in a new thread for better concurrency"""
     daemon_threads = True
     allow_reuse_address = True
     request_queue_size = 20  # Limit pending connections
     block_on_close = False   # Don't block when closing
 
+# =============================================================================
+# Asyncio server mode
+# =============================================================================
+# With ASYNC_SERVER=1 connections are served by one event loop instead of a
+# thread each. Inference and management commands run as asyncio subprocesses;
+# the remaining routes (file/config work) run the regular handler methods in
+# a small bounded thread pool.
+ASYNC_SERVER = os.environ.get('ASYNC_SERVER', '').lower() in ('1', 'true', 'yes', 'on')
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('ASYNC_MAX_CONNECTIONS', 512))
+ASYNC_WORKERS = int(os.environ.get('ASYNC_WORKERS', 4))
+
+_async = {
+    'executor': None,
+    'connections': None,  # Semaphore bounding open connections
+}
+
+def http_response_bytes(status, body=b'', content_type='application/json', extra_headers=None):
+    """Serialize a response in the same shape send_json produces
+
+    Content-Length is set from the body unless extra_headers has one; a body
+    of None means the caller frames a body of unknown length itself.
+    """
+    headers = dict(extra_headers or {})
+    if body is not None and status not in (204, 304):
+        headers.setdefault('Content-Length', str(len(body)))
+    lines = [
+        f'HTTP/1.1 {status} {http.HTTPStatus(status).phrase}',
+        'Server: PocketAI',
+        f'Date: {email.utils.formatdate(usegmt=True)}',
+        f'Content-Type: {content_type}',
+        'Access-Control-Allow-Origin: *',
+        'Access-Control-Allow-Methods: GET, POST, DELETE, OPTIONS',
+        'Access-Control-Allow-Headers: Content-Type',
+    ]
+    for name, value in headers.items():
+        lines.append(f'{name}: {value}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+class ResponseWriter:
+    """StreamWriter wrapper that frames one response at a time on a persistent connection
+
+    respond() writes a complete response; start() begins a stream, which is
+    chunked while the connection stays open and close-delimited otherwise,
+    and write()/end() frame its body.
+    """
+    def __init__(self, writer, reader=None):
+        self.writer = writer
+        self.reader = reader
+        self.transport = writer.transport
+        self.client_address = writer.get_extra_info('peername')
+        self.served = 0
+        self.keep_alive = False
+        self.started = False
+        self.chunked = False
+
+    def next_request(self, version, headers):
+        """Reset for a new request and decide whether the connection outlives it"""
+        self.served += 1
+        self.started = self.chunked = False
+        self.keep_alive = (version == 'HTTP/1.1' and self.served < KEEPALIVE_MAX
+                           and 'close' not in (headers.get('Connection') or '').lower())
+
+    def headers(self, extra=None):
+        headers = dict(extra or {})
+        if self.keep_alive:
+            headers['Keep-Alive'] = keep_alive_header(self.served)
+        else:
+            headers['Connection'] = 'close'
+        return headers
+
+    def respond(self, status, body=b'', content_type='application/json', extra_headers=None):
+        self.started = True
+        self.writer.write(http_response_bytes(status, body, content_type, self.headers(extra_headers)))
+
+    def respond_json(self, data, status=200, extra_headers=None):
+        self.respond(status, json.dumps(data).encode(), extra_headers=extra_headers)
+
+    def start(self, content_type, extra_headers=None):
+        headers = dict(extra_headers or {})
+        headers['Cache-Control'] = 'no-cache'
+        if self.keep_alive:
+            headers['Transfer-Encoding'] = 'chunked'
+            self.chunked = True
+        self.started = True
+        self.writer.write(http_response_bytes(200, None, content_type, self.headers(headers)))
+
+    def write(self, data):
+        if data:
+            self.writer.write(chunk_frame(data) if self.chunked else data)
+
+    def end(self):
+        if self.chunked:
+            self.writer.write(b'0\r\n\r\n')
+            self.chunked = False
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def client_gone(self):
+        """True once the client closed its side (no unread request data pending)"""
+        return (self.reader is not None and self.reader.at_eof()) or self.transport.is_closing()
+
+def handle_buffered(handler_class, method, path, version, headers, body, client_address, keep_alive=False,
+                    served=1):
+    """Run a BaseHTTPRequestHandler do_* method against in-memory streams
+
+    Returns the response bytes and whether the handler wants the connection closed.
+    """
+    handler = handler_class.__new__(handler_class)
+    handler.client_address = client_address
+    handler.server = None
+    handler.command = method
+    handler.path = path
+    handler.request_version = version
+    handler.requestline = f'{method} {path} {version}'
+    handler.headers = headers
+    handler.rfile = io.BytesIO(body)
+    handler.wfile = io.BytesIO()
+    handler.close_connection = not keep_alive
+    handler.served = served
+    handler.chunked = False
+    handler.connection_header = False
+    do_method = getattr(handler, f'do_{method}', None)
+    if do_method is None:
+        handler.send_error(501, f'Unsupported method ({method})')
+    else:
+        do_method()
+    return handler.wfile.getvalue(), handler.close_connection or handler.chunked
+
+async def async_shell_wait(process, timeout=None, generation=None):
+    """Wait for a ShellCommand from the event loop; returns its exit status
+
+    Returns None at once when the generation is cancelled (the reaper
+    takes over the command).
+    """
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    fd = process.fileno()
+
+    def check():
+        if not done.done() and process.poll() is not None:
+            done.set_result(process.returncode)
+
+    def cancelled():
+        loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+    check()
+    if done.done():
+        return done.result()
+    loop.add_reader(fd, check)
+    if generation is not None:
+        generation.on_cancel(cancelled)
+    try:
+        return await asyncio.wait_for(done, timeout)
+    finally:
+        loop.remove_reader(fd)
+        if generation is not None:
+            generation.remove_callback(cancelled)
+
+async def async_run_cmd(cmd, timeout=30, env=None, generation=None):
+    """Async run_cmd: engine.sh command on a shell worker, or via asyncio subprocess pipes"""
+    loop = asyncio.get_running_loop()
+    process = None
+    try:
+        spawn_start = time.monotonic()
+        # In the executor: a new worker has to source engine.sh before it answers
+        process = await loop.run_in_executor(_async['executor'], _shell_workers.popen, cmd, env)
+        if process is not None:
+            _spawn_seconds.observe(time.monotonic() - spawn_start, kind='command')
+            if generation is not None:
+                generation.attach(process)
+            try:
+                await async_shell_wait(process, timeout, generation)
+            finally:
+                if process.returncode is None:  # timed out or cancelled
+                    process.discard()
+                    end_process(process, generation)
+            if process.returncode is None:
+                return '', False
+            stdout, _ = process.communicate()
+            return stdout.strip(), process.returncode == 0
+        process = await asyncio.create_subprocess_exec(
+            BASH, '-c', f'source {POCKETAI_ROOT}/core/engine.sh && {cmd}',
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            env=dict(os.environ, **env) if env else None,
+            preexec_fn=os.setsid
+        )
+        _spawn_seconds.observe(time.monotonic() - spawn_start, kind='command')
+        if generation is not None:
+            generation.attach(process)
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+        finally:
+            if generation is not None:
+                generation.detach(process)
+        return stdout.decode('utf-8', errors='replace').strip(), process.returncode == 0
+    except asyncio.TimeoutError:
+        log_error(f"Command timed out after {timeout}s: {cmd[:50]}...")
+        _timeouts.inc(kind='command')
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (OSError, ProcessLookupError):
+            pass
+        return f"Command timed out after {timeout}s", False
+    except Exception as e:
+        log_error(f"async_run_cmd failed: {e}")
+        if process is not None and process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except (OSError, ProcessLookupError):
+                pass
+        return str(e), False
+
+async def async_run_cmd_stream(cmd, timeout=300, status=None, env=None, generation=None):
+    """Async run_cmd_stream: read the PTY from the event loop, no polling"""
+    global _active_streams
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    master_fd = None
+    slave_fd = None
+    process = None
+    start_time = time.time()
+    utf8_buffer = b''
+    byte_count = 0
+    reads = 0
+    first_data_time = last_data_time = None
+
+    def on_readable():
+        try:
+            data = os.read(master_fd, 4096)
+        except OSError:
+            data = b''  # EIO once the child side is closed
+        if not data:
+            loop.remove_reader(master_fd)
+        chunks.put_nowait(data)
+
+    def cancelled():
+        loop.call_soon_threadsafe(chunks.put_nowait, b'')
+
+    try:
+        with _lock:
+            _active_streams += 1
+        log_info(f"Stream started (active: {_active_streams})")
+
+        master_fd, slave_fd = pty.openpty()
+        spawn_start = time.monotonic()
+        process = await loop.run_in_executor(_async['executor'], functools.partial(
+            _shell_workers.popen, cmd, env, stdout=os.ttyname(slave_fd), merge_stderr=True))
+        if process is None:
+            process = await asyncio.create_subprocess_exec(
+                BASH, '-c', f'source {POCKETAI_ROOT}/core/engine.sh && {cmd}',
+                stdout=slave_fd, stderr=slave_fd,
+                env=dict(os.environ, **env) if env else None,
+                preexec_fn=os.setsid
+            )
+        _spawn_seconds.observe(time.monotonic() - spawn_start, kind='stream')
+        if generation is not None:
+            generation.attach(process)
+            generation.on_cancel(cancelled)
+        os.close(slave_fd)
+        slave_fd = None
+        loop.add_reader(master_fd, on_readable)
+
+        timed_out = False
+        while True:
+            remaining = timeout - (time.time() - start_time)
+            if remaining <= 0:
+                log_warn(f"Stream timeout after {timeout}s")
+                _timeouts.inc(kind='overall')
+                timed_out = True
+                break
+            try:
+                data = await asyncio.wait_for(chunks.get(), min(60, remaining))
+            except asyncio.TimeoutError:
+                if remaining > 60:
+                    log_warn("Stream idle timeout (no data for 60s)")
+                    _timeouts.inc(kind='idle')
+                else:
+                    log_warn(f"Stream timeout after {timeout}s")
+                    _timeouts.inc(kind='overall')
+                timed_out = True
+                break
+            if not data:
+                break
+            last_data_time = time.time()
+            if first_data_time is None:
+                first_data_time = last_data_time
+                _first_byte_seconds.observe(first_data_time - start_time, backend='spawn')
+            byte_count += len(data)
+            reads += 1
+            text, utf8_buffer = decode_utf8_safe(data, utf8_buffer)
+            if text:
+                yield text
+
+        if utf8_buffer:
+            yield utf8_buffer.decode('utf-8', errors='replace')
+        if generation is not None and generation.cancelled:
+            log_info(f"Stream cancelled ({generation.reason})")
+        elif status is not None and not timed_out:
+            try:
+                if isinstance(process, ShellCommand):
+                    status['complete'] = await async_shell_wait(process, 2) == 0
+                else:
+                    status['complete'] = await asyncio.wait_for(process.wait(), 2) == 0
+            except asyncio.TimeoutError:
+                pass
+        if first_data_time is not None:
+            observe_stream_rate('spawn', reads, first_data_time, last_data_time)
+        log_info(f"Stream complete: {byte_count} bytes in {time.time() - start_time:.1f}s")
+
+    finally:
+        with _lock:
+            _active_streams -= 1
+        if master_fd is not None:
+            loop.remove_reader(master_fd)
+            os.close(master_fd)
+        if slave_fd is not None:
+            os.close(slave_fd)
+        if generation is not None:
+            generation.remove_callback(cancelled)
+        if process is not None:
+            end_process(process, generation)
+
+async def aiter_list(items):
+    """Async generator over a list (cached replies)"""
+    for item in items:
+        yield item
+
+async def aiter_thread(generator):
+    """Consume a blocking generator from a helper thread"""
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def pump():
+        try:
+            for item in generator:
+                loop.call_soon_threadsafe(items.put_nowait, item)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            log_error(f"Stream source error: {e}")
+        finally:
+            generator.close()
+            loop.call_soon_threadsafe(items.put_nowait, done)
+
+    threading.Thread(target=pump, daemon=True).start()
+    try:
+        while True:
+            item = await items.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+
+async def async_engine_source(model_path, engine_source, command, status=None, generation=None):
+    """Async token stream from the resident engine for model_path, or from an engine.sh command
+
+    engine_source(engine) gives the engine's blocking generator; command()
+    gives (cmd, env) for the spawn path. Lazy like chat_stream: the engine
+    is looked up once iteration starts, after the stream got its slot.
+    """
+    loop = asyncio.get_running_loop()
+    engine = RESIDENT_ENGINE and await loop.run_in_executor(_async['executor'], engine_wait_ready, model_path)
+    if engine:
+        source = aiter_thread(engine_source(engine))
+    else:
+        cmd, env = command()
+        source = async_run_cmd_stream(cmd, status=status, env=env, generation=generation)
+    try:
+        async for chunk in source:
+            yield chunk
+    finally:
+        await source.aclose()
+
+async def async_filtered_stream(chunks, model_name=None, status=None):
+    """Async filtered_stream"""
+    flt = stream_filter.for_model(model_name or os.path.basename(get_active_model_fast()))
+    try:
+        async for chunk in chunks:
+            text = flt.feed(chunk)
+            if text:
+                yield text
+            if flt.stopped:
+                if status is not None:
+                    status['complete'] = True
+                break
+        text = flt.flush()
+        if text:
+            yield text
+    finally:
+        await chunks.aclose()
+
+async def async_coalesce(agen, flush_ms=SSE_FLUSH_MS, flush_bytes=SSE_FLUSH_BYTES):
+    """Re-yield an async generator's output batched like send_sse_stream does"""
+    chunks = asyncio.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for chunk in agen:
+                await chunks.put(chunk)
+        finally:
+            await chunks.put(done)
+
+    task = asyncio.ensure_future(pump())
+    window = flush_ms / 1000
+    pending = []
+    pending_len = 0
+    last_flush = 0
+    deadline = None
+    try:
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                chunk = await asyncio.wait_for(chunks.get(), timeout)
+            except asyncio.TimeoutError:
+                chunk = None
+            if chunk is done:
+                break
+            if chunk:
+                pending.append(chunk)
+                pending_len += len(chunk)
+            now = time.monotonic()
+            if pending and (chunk is None or window <= 0 or pending_len >= flush_bytes or now - last_flush >= window):
+                yield ''.join(pending)
+                pending = []
+                pending_len = 0
+                last_flush = now
+                deadline = None
+            elif pending:
+                deadline = last_flush + window
+        if pending:
+            yield ''.join(pending)
+    finally:
+        # Cancelling the pump closes the source generator and kills its process
+        task.cancel()
+
+async def async_send_sse(writer, source, req_id, full_response=True, flush_ms=SSE_FLUSH_MS, ticket=None,
+                         on_complete=None, generation=None):
+    """Async send_sse_stream"""
+    log_info(f"[REQ-{req_id}] SSE stream started")
+    parts = []
+    events = 0
+    batches = async_coalesce(source, flush_ms)
+    try:
+        writer.start('text/event-stream', {'X-Request-ID': str(req_id)})
+        if ticket is not None and not ticket.granted.is_set():
+            log_info(f"[REQ-{req_id}] Queued at position {scheduler_position(ticket)}")
+            while not await scheduler_wait_async(ticket, 1, generation):
+                if generation is not None and generation.cancelled:
+                    writer.write(sse_frame({'done': True, 'cancelled': True}))
+                    writer.end()
+                    await writer.drain()
+                    return
+                if ticket.wait_time() > INFERENCE_QUEUE_TIMEOUT:
+                    scheduler_timeout(ticket)
+                    writer.write(sse_frame({'error': 'Timed out waiting in queue'}))
+                    writer.end()
+                    await writer.drain()
+                    return
+                writer.write(queue_event(ticket))
+                await writer.drain()
+            writer.write(queue_event(ticket))
+        async for text in batches:
+            parts.append(text)
+            events += 1
+            writer.write(sse_frame({'token': text}))
+            await writer.drain()
+        full_text = ''.join(parts)
+        if on_complete is not None:
+            on_complete(full_text)
+        final = {'done': True}
+        if generation is not None and generation.cancelled:
+            final['cancelled'] = True
+        if full_response:
+            final['full_response'] = full_text
+        writer.write(sse_frame(final))
+        writer.end()
+        await writer.drain()
+        log_info(f"[REQ-{req_id}] SSE complete: {sum(map(len, parts))} chars in {events} events")
+    except (BrokenPipeError, ConnectionResetError):
+        log_warn(f"[REQ-{req_id}] Client disconnected during stream")
+        _client_disconnects.inc()
+        writer.keep_alive = False
+    finally:
+        await batches.aclose()
+        if ticket is not None:
+            scheduler_release(ticket)
+
+async def async_watch_disconnect(writer, generation):
+    """Cancel the generation once the client closes its connection, tokens or not"""
+    while not generation.cancelled:
+        if writer.client_gone():
+            generation.cancel('disconnected')
+            return
+        await asyncio.sleep(DISCONNECT_CHECK)
+
+def async_begin_generation(writer, req_id, kind):
+    """Register a generation and watch its client; returns (generation, watcher task)"""
+    generation = _generations.start(req_id, kind)
+    return generation, asyncio.ensure_future(async_watch_disconnect(writer, generation))
+
+def async_end_generation(generation, watcher):
+    watcher.cancel()
+    _generations.end(generation)
+
+def error_response(writer, status, message):
+    """Write a JSON error in send_error_json's shape"""
+    log_error(f"HTTP {status}: {message}")
+    if status >= 500:
+        writer.keep_alive = False
+    writer.respond_json({'error': message, 'status': status}, status)
+
+def job_waker(job):
+    """asyncio.Event set from the job's thread whenever it has a new event"""
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+    wake = lambda: loop.call_soon_threadsafe(event.set)
+    job.listeners.append(wake)
+    return event, wake
+
+async def async_join(job):
+    """Wait for a job to finish without holding an executor thread"""
+    event, wake = job_waker(job)
+    try:
+        while job.active:
+            await event.wait()
+            event.clear()
+    finally:
+        job.listeners.remove(wake)
+
+async def async_job_events(writer, job):
+    """Async send_job_events"""
+    if job is None:
+        error_response(writer, 404, 'Job not found')
+        await writer.drain()
+        return
+    event, wake = job_waker(job)
+    try:
+        writer.start('text/event-stream')
+        seen = 0
+        while True:
+            event.clear()
+            events = job.events[seen:]
+            if not events:
+                try:
+                    await asyncio.wait_for(event.wait(), 15)
+                except asyncio.TimeoutError:
+                    writer.write(b': keep-alive\n\n')
+                    await writer.drain()
+                continue
+            writer.write(b''.join(sse_frame(item) for item in events))
+            await writer.drain()
+            seen += len(events)
+            if events[-1].get('done'):
+                break
+        writer.end()
+        await writer.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        _client_disconnects.inc()
+        writer.keep_alive = False
+    finally:
+        job.listeners.remove(wake)
+
+async def async_send_static(writer, path, headers, head_only=False):
+    """Async send_static: in-memory body, or loop.sendfile for large files"""
+    asset = _static.get(path)
+    if asset is None:
+        if head_only:
+            writer.respond(404, extra_headers={'Content-Length': '0'})
+        else:
+            writer.respond_json({'error': 'Not found'}, 404)
+        await writer.drain()
+        return
+    status, extra, body = static_response(asset, headers)
+    content_type = extra.pop('Content-Type')
+    writer.respond(status, content_type=content_type, extra_headers=extra)
+    if status == 304 or head_only:
+        await writer.drain()
+        return
+    if body is not None:
+        writer.write(body)
+        await writer.drain()
+        return
+    await writer.drain()
+    with open(asset.path, 'rb') as f:
+        await asyncio.get_running_loop().sendfile(writer.transport, f)
+
+async def async_session_turn(writer, path, data):
+    """Async handle_session_turn"""
+    loop = asyncio.get_running_loop()
+    session, action = session_request(path, data)
+    if session is None:
+        error_response(writer, *action)
+        await writer.drain()
+        return
+    stream = action == 'stream'
+    ticket = None
+    generation = watcher = None
+    try:
+        req_id = get_request_id()
+        message = data['message']
+        log_info(f"[REQ-{req_id}] Session {session['id']} turn ({action}): {len(message)} chars")
+        if await async_governor_refused(writer, session_request_model(data) or session_model(session), 'session'):
+            return
+        ticket = scheduler_submit(PRIORITY_STREAM if stream else PRIORITY_BLOCKING)
+        if ticket is None:
+            async_busy_response(writer)
+            await writer.drain()
+            return
+        turn = await loop.run_in_executor(_async['executor'], session_turn, session, message,
+                                          request_max_tokens(data)[0], stream, session_request_model(data))
+        status = {}
+        generation, watcher = async_begin_generation(writer, req_id, 'session')
+        if not stream and not await scheduler_wait_async(ticket, 120, generation):
+            if generation.cancelled:
+                writer.respond_json({'session_id': session['id'], 'response': '', 'cancelled': True})
+            else:
+                scheduler_timeout(ticket)
+                async_busy_response(writer)
+            await writer.drain()
+            return
+        source = async_engine_source(
+            turn['model_path'],
+            lambda engine: engine_stream(engine, '', status=status, payload=session_payload(turn),
+                                         generation=generation),
+            lambda: session_command(session, turn), status, generation)
+        source = async_filtered_stream(source, turn['model_name'], status)
+        if stream:
+            sse_ticket, ticket = ticket, None  # async_send_sse releases it
+            await async_send_sse(writer, source, req_id,
+                                 full_response=data.get('full_response', True) is not False,
+                                 flush_ms=request_flush_ms(data)[0],
+                                 ticket=sse_ticket,
+                                 on_complete=lambda text: session_commit(session, turn, text, status),
+                                 generation=generation)
+            return
+
+        async def reply():
+            response = session_commit(session, turn, ''.join([text async for text in source]), status)
+            log_info(f"[REQ-{req_id}] Session turn complete: {len(response)} chars")
+            result = {'session_id': session['id'], 'response': response, 'turns': len(session['turns']),
+                      'context': turn['context']}
+            if generation.cancelled:
+                result['cancelled'] = True
+            return result
+
+        await async_send_json_when_ready(writer, reply(), {'X-Request-ID': str(req_id)})
+    finally:
+        if ticket is not None:
+            scheduler_release(ticket)
+        if generation is not None:
+            async_end_generation(generation, watcher)
+        _sessions.release(session['id'])
+
+async def async_chat_batch(writer, data):
+    """Async handle_batch"""
+    req_id = get_request_id()
+    run, error = await asyncio.get_running_loop().run_in_executor(_async['executor'], batch_prepare, data)
+    if run is None:
+        error_response(writer, *error)
+        await writer.drain()
+        return
+    if await async_governor_refused(writer, run['model_path'], 'batch'):
+        return
+    log_info(f"[REQ-{req_id}] Batch {run['id']}: {len(run['items'])} items "
+             f"({len(run['finished'])} already done) on {os.path.basename(run['model_path'])}")
+    generation, watcher = async_begin_generation(writer, req_id, 'batch')
+    lines = aiter_thread(batch_stream(run, generation))
+    try:
+        writer.start('application/x-ndjson', {'X-Request-ID': str(req_id), 'X-Batch-ID': run['id']})
+        async for line in lines:
+            writer.write(line)
+            await writer.drain()
+        writer.end()
+        await writer.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        generation.cancel('disconnected')
+        _client_disconnects.inc()
+        writer.keep_alive = False
+    finally:
+        await lines.aclose()
+        async_end_generation(generation, watcher)
+
+async def async_send_json_when_ready(writer, awaitable, headers=None):
+    """Async send_json_when_ready"""
+    if not writer.keep_alive:
+        writer.respond_json(await awaitable, extra_headers=headers)
+        await writer.drain()
+        return
+    task = asyncio.ensure_future(awaitable)
+    writer.start('application/json', headers)
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=JSON_HEARTBEAT)
+            if not task.done():
+                writer.write(b' ')
+                await writer.drain()
+    except ConnectionError:
+        # Finish the generation anyway so its slot is released in order
+        await asyncio.wait({task})
+        raise
+    try:
+        data = task.result()
+    except Exception as e:
+        # Too late for an error status: report it in the body and close
+        log_error(f"HTTP 500: {e}\n{traceback.format_exc()}")
+        data = {'error': str(e), 'status': 500}
+        writer.keep_alive = False
+    writer.write(json.dumps(data).encode())
+    writer.end()
+    await writer.drain()
+
+def async_busy_response(writer):
+    """Write a 429 with Retry-After"""
+    retry_after = scheduler_retry_after()
+    log_warn(f"Inference queue full, rejecting (retry after {retry_after}s)")
+    body = {'error': 'Server busy, try again later', 'status': 429, 'retry_after': retry_after}
+    writer.respond_json(body, 429, extra_headers={'Retry-After': str(retry_after)})
+
+async def async_governor_refused(writer, model, kind):
+    """Write a 503 and return True if the resource governor refuses the request"""
+    refusal = await asyncio.get_running_loop().run_in_executor(_async['executor'], governor_admit, model, kind)
+    if refusal is None:
+        return False
+    status, body, headers = governor_refusal(refusal)
+    writer.respond_json(body, status, extra_headers=headers)
+    await writer.drain()
+    return True
+
+async def async_chat(writer, data):
+    """Async blocking /api/chat"""
+    loop = asyncio.get_running_loop()
+    executor = _async['executor']
+    message = data.get('message', '')
+    model, error = request_model(data)
+    if error:
+        error_response(writer, 404, error)
+        await writer.drain()
+        return
+    max_tokens, error = request_max_tokens(data)
+    if error:
+        error_response(writer, 400, error)
+        await writer.drain()
+        return
+    req_id = get_request_id()
+    log_info(f"[REQ-{req_id}] Chat request (blocking): {len(message)} chars")
+    cache_id = response_cache_key(message, max_tokens, model=model) if data.get('cache', True) is not False else None
+    cached = cached_response(cache_id)
+    if cached is not None:
+        log_info(f"[REQ-{req_id}] Chat served from cache: {len(cached)} chars")
+        writer.respond_json({'response': cached, 'cached': True})
+        await writer.drain()
+        return
+    if await async_governor_refused(writer, model, 'chat'):
+        return
+    ticket = scheduler_submit(PRIORITY_BLOCKING)
+    if ticket is None:
+        async_busy_response(writer)
+        await writer.drain()
+        return
+    generation, watcher = async_begin_generation(writer, req_id, 'chat')
+    try:
+        if not await scheduler_wait_async(ticket, 120, generation):
+            if generation.cancelled:
+                scheduler_release(ticket)
+                writer.respond_json({'response': '', 'cancelled': True})
+            else:
+                scheduler_timeout(ticket)
+                async_busy_response(writer)
+            await writer.drain()
+            return
+
+        async def chat():
+            out = None
+            ok = False
+            try:
+                engine = RESIDENT_ENGINE and await loop.run_in_executor(executor, engine_wait_ready, model)
+                if engine:
+                    out = await loop.run_in_executor(executor, functools.partial(
+                        engine_infer, engine, message, max_tokens, generation=generation))
+                    ok = out is not None
+                if out is None and not generation.cancelled:
+                    cmd, env = infer_command(message, max_tokens, model)
+                    out, ok = await async_run_cmd(cmd, timeout=120, env=env, generation=generation)
+            finally:
+                scheduler_release(ticket)
+            if generation.cancelled:
+                log_info(f"[REQ-{req_id}] Chat cancelled ({generation.reason})")
+                return {'response': out or '', 'cancelled': True}
+            if ok:
+                cache_response(cache_id, out)
+            log_info(f"[REQ-{req_id}] Chat complete: {len(out)} chars")
+            return {'response': out}
+
+        await async_send_json_when_ready(writer, chat(), {'X-Request-ID': str(req_id)})
+    finally:
+        async_end_generation(generation, watcher)
+
+async def async_route(method, path, data):
+    """Async implementations of subprocess-backed routes; None if not handled here"""
+    loop = asyncio.get_running_loop()
+    executor = _async['executor']
+
+    if method == 'GET' and path == '/api/models/verify':
+        job = start_job('verify', options=verify_options({}))
+        await async_join(job)
+        return job_result(job)
+
+    if method != 'POST':
+        return None
+
+    if path in ('/api/jobs', '/api/models/install', '/api/models/remove', '/api/tune') or (
+            path == '/api/models/verify' and not data.get('model')):
+        try:
+            job = job_request(path, data)
+        except ValueError as e:
+            return 400, {'error': str(e), 'status': 400}
+        log_info(f"Job {job.id}: {job.kind} {job.model or 'all'} ({job.state})")
+        if data.get('background', True) is not False:
+            return 202, job_accepted(job)
+        await async_join(job)
+        return job_result(job)
+
+    if path == '/api/models/verify':
+        model = data.get('model', '')
+        log_info(f"Verifying model: {model}")
+        return await loop.run_in_executor(executor, verify_model_fast, model, data.get('mode', 'quick'),
+                                          bool(data.get('recheck')))
+
+    return None
+
+async def async_handle_connection(handler_class, reader, writer):
+    """Serve HTTP requests on an asyncio connection until it closes, idles out or hits KEEPALIVE_MAX"""
+    conn = ResponseWriter(writer, reader)
+    async with _async['connections']:
+        try:
+            while True:
+                # The first request gets the full timeout, later ones the keep-alive idle timeout
+                idle = KEEPALIVE_TIMEOUT if conn.served else APIHandler.timeout
+                request_line = await asyncio.wait_for(reader.readline(), idle)
+                if not request_line:
+                    return
+                start = time.monotonic()
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    header_lines = []
+                    while True:
+                        line = await asyncio.wait_for(reader.readline(), APIHandler.timeout)
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        header_lines.append(line)
+                        if len(header_lines) > 100:
+                            raise ValueError('too many headers')
+                    headers = email.parser.BytesParser(_class=http.client.HTTPMessage).parsebytes(
+                        b''.join(header_lines))
+                    content_length = int(headers.get('Content-Length', 0))
+                except ValueError as e:
+                    conn.keep_alive = False
+                    error_response(conn, 400, f'Bad request: {e}')
+                    await conn.drain()
+                    return
+                if 'Transfer-Encoding' in headers:
+                    # Request bodies must carry Content-Length (as in threaded mode)
+                    conn.keep_alive = False
+                    error_response(conn, 411, 'Chunked request bodies are not supported')
+                    await conn.drain()
+                    return
+                if content_length > 0 and (headers.get('Expect') or '').lower() == '100-continue':
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                body = await reader.readexactly(content_length) if content_length > 0 else b''
+                conn.next_request(version, headers)
+                try:
+                    await async_handle_request(handler_class, conn, method, target, version, headers, body)
+                finally:
+                    _request_seconds.observe(time.monotonic() - start, method=method,
+                                             route=metric_route(urlparse(target).path))
+                if not conn.keep_alive or conn.chunked:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+            log_debug(f"Connection dropped: {e!r}")
+        finally:
+            writer.close()
+
+async def async_handle_request(handler_class, writer, method, target, version, headers, body):
+    """Serve one request; an unexpected error answers 500 (if nothing was sent yet) and closes"""
+    loop = asyncio.get_running_loop()
+    path = urlparse(target).path
+    try:
+        if method == 'POST' and path.startswith('/api/'):
+            try:
+                data = json.loads(body.decode() or '{}')
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                data = {}
+            if not isinstance(data, dict):
+                data = {}
+
+            if path == '/api/chat/stream':
+                req_id = get_request_id()
+                message = data.get('message', '')
+                model, error = request_model(data)
+                if error:
+                    error_response(writer, 404, error)
+                    await writer.drain()
+                    return
+                flush_ms, error = request_flush_ms(data)
+                if error:
+                    error_response(writer, 400, error)
+                    await writer.drain()
+                    return
+                max_tokens, error = request_max_tokens(data)
+                if error:
+                    error_response(writer, 400, error)
+                    await writer.drain()
+                    return
+                log_info(f"[REQ-{req_id}] Chat request (streaming): {len(message)} chars")
+                sse_options = {
+                    'full_response': data.get('full_response', True) is not False,
+                    'flush_ms': flush_ms
+                }
+                cache_id = response_cache_key(message, max_tokens, stream=True, model=model) \
+                    if data.get('cache', True) is not False else None
+                cached = cached_response(cache_id)
+                if cached is not None:
+                    log_info(f"[REQ-{req_id}] Stream served from cache: {len(cached)} chars")
+                    await async_send_sse(writer, aiter_list([cached]), req_id, **sse_options)
+                    return
+                if await async_governor_refused(writer, model, 'stream'):
+                    return
+                ticket = scheduler_submit(PRIORITY_STREAM)
+                if ticket is None:
+                    async_busy_response(writer)
+                    await writer.drain()
+                    return
+                status = {}
+                generation, watcher = async_begin_generation(writer, req_id, 'stream')
+                try:
+                    source = async_engine_source(
+                        model,
+                        lambda engine: engine_stream(engine, message, max_tokens, status=status,
+                                                     generation=generation),
+                        lambda: infer_command(message, max_tokens, model, stream=True), status, generation)
+                    source = async_filtered_stream(source, os.path.basename(model), status)
+                    await async_send_sse(writer, source, req_id, ticket=ticket,
+                                         on_complete=lambda text: status.get('complete') and cache_response(cache_id, text),
+                                         generation=generation, **sse_options)
+                finally:
+                    async_end_generation(generation, watcher)
+                return
+
+            if path == '/api/chat':
+                await async_chat(writer, data)
+                return
+
+            if path == '/api/chat/batch':
+                await async_chat_batch(writer, batch_data(target, headers.get('Content-Type') or '',
+                                                          body.decode('utf-8', 'replace'), data))
+                return
+
+            if path.startswith('/api/sessions/'):
+                await async_session_turn(writer, path, data)
+                return
+
+        if (method == 'GET' and (path.startswith('/api/jobs/') or path.startswith('/api/models/install/'))
+                and wants_event_stream(target, headers)):
+            await async_job_events(writer, find_job(path))
+            return
+
+        if (method in ('GET', 'HEAD') and not path.startswith('/api/')
+                and issubclass(handler_class, CombinedHandler)):
+            await async_send_static(writer, path, headers, head_only=method == 'HEAD')
+            return
+
+        result = await async_route(method, path, data if method == 'POST' else {})
+        if isinstance(result, tuple):
+            writer.respond_json(result[1], result[0])
+        elif result is not None:
+            writer.respond_json(result)
+        else:
+            response, close = await loop.run_in_executor(
+                _async['executor'], handle_buffered, handler_class, method, target, version, headers, body,
+                writer.client_address, writer.keep_alive, writer.served
+            )
+            writer.started = True
+            writer.write(response)
+            if close:
+                writer.keep_alive = False
+        await writer.drain()
+    except ConnectionError:
+        raise
+    except Exception as e:
+        log_error(f"Async handler error: {e}\n{traceback.format_exc()}")
+        writer.keep_alive = False
+        if not writer.started:
+            error_response(writer, 500, str(e))
+            await writer.drain()
+
+async def async_serve(handler_class):
+    """Run the API on an asyncio event loop"""
+    _async['executor'] = concurrent.futures.ThreadPoolExecutor(
+        max_workers=ASYNC_WORKERS, thread_name_prefix='pocketai-io'
+    )
+    _async['connections'] = asyncio.Semaphore(ASYNC_MAX_CONNECTIONS)
+    server = await asyncio.start_server(
+        lambda r, w: async_handle_connection(handler_class, r, w),
+        '', PORT, reuse_address=True, backlog=ASYNC_MAX_CONNECTIONS
+    )
+    log_info(f"Server ready - listening on port {PORT} (asyncio, max {ASYNC_MAX_CONNECTIONS} connections)")
+    async with server:
+        await server.serve_forever()
+
 def shutdown_handler(signum, frame):
     """Graceful shutdown on SIGINT/SIGTERM"""
     log_info(f"Received signal {signum}, shutting down...")
+    _generations.cancel_all('shutdown')
+    engine_stop()
+    _shell_workers.close()
     sys.exit(0)
 
 if __name__ == '__main__':
@@ -716,12 +4262,31 @@ if __name__ == '__main__':
     log_info("=" * 50)
     log_info(f"PocketAI API Server v2.0")
     log_info(f"Port: {PORT} | Mode: {mode}")
+    if RESIDENT_ENGINE:
+        log_info(f"Resident engine: enabled (up to {WARM_POOL_SIZE} warm models, ports {ENGINE_PORT}+)")
+    if ASYNC_SERVER:
+        log_info(f"Asyncio server: enabled ({ASYNC_WORKERS} I/O workers)")
+    if SHELL_WORKERS:
+        log_info(f"Shell workers: {SHELL_WORKERS} (recycled every {SHELL_WORKER_MAX_COMMANDS} commands)")
+    if GOVERNOR:
+        log_info(f"Resource governor: sampling every {GOVERNOR_INTERVAL:g}s ({GOVERNOR_RESERVE_MB:g}MB reserve)")
     log_info("=" * 50)
 
+    _shell_workers.prestart()
+    if GOVERNOR:
+        _governor.start(GOVERNOR_INTERVAL)
+
+    if RESIDENT_ENGINE:
+        # Load the model now so the first chat doesn't pay for it
+        threading.Thread(target=engine_supervisor, daemon=True).start()
+
     try:
-        with ThreadedTCPServer(('', PORT), Handler) as httpd:
-            log_info(f"Server ready - listening on port {PORT}")
-            httpd.serve_forever()
+        if ASYNC_SERVER:
+            asyncio.run(async_serve(Handler))
+        else:
+            with ThreadedTCPServer(('', PORT), Handler) as httpd:
+                log_info(f"Server ready - listening on port {PORT}")
+                httpd.serve_forever()
     except OSError as e:
         log_error(f"Failed to start server: {e}")
         sys.exit(1)
@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+PocketAI autotuner - fastest threads, batch and context size per model and device
+
+threads=4 and ctx_size=2048 fit no phone in particular: on a big.LITTLE CPU
+a thread on a little core holds every token back, and prompt speed depends
+on the batch size. pai tune starts the model in a llamafile server once per
+setting, runs a short fixed prompt and reads llamafile's own timings
+(prompt evaluation and generation tokens/s). The search goes one setting at
+a time, starting from the configured ones:
+
+  1. threads: 1, 2, 4, every core, and the cores of each cluster of equally
+     fast CPUs (fastest first); the best generation speed wins
+  2. batch size (-b) with those threads; the best prompt speed wins
+  3. context size: the largest that loads and generates within
+     CTX_TOLERANCE of the fastest context tried
+
+A setting only replaces the current one when it is MIN_GAIN faster, so
+noise doesn't move it. The result is saved per model and device in
+data/tune_profiles.json; a device is identified by its CPU layout and RAM,
+so profiles copied to another phone are not picked up there. infer,
+infer_stream, server_start and the API's engines use the profile instead
+of the threads/ctx_size settings (tune=off in the config turns that off).
+
+sweep() takes the measurement as a function, so the search can run
+against synthetic timings (bench/bench.py tune uses fake_llamafile.py).
+
+Usage:
+  autotune.py run <model.gguf> --root DIR [--port N] [--threads N] [--ctx N] [--quick]
+  autotune.py get <model.gguf>     # "threads ctx_size batch_size", exit 1 without a profile
+  autotune.py show [--json]
+  autotune.py reset [model]
+"""
+import argparse
+import glob
+import hashlib
+import http.client
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import batch
+import gguf
+import prompt_templates
+from warm_pool import MB, read_meminfo
+
+THREADS = (1, 2, 4)                  # tried on top of the cluster sizes and the core count
+BATCH_SIZES = (64, 128, 256, 512, 1024)
+CTX_SIZES = (1024, 2048, 4096, 8192)
+QUICK_BATCH_SIZES = (128, 512)
+MIN_GAIN = 0.03       # a setting must be this much faster to replace the current one
+CTX_TOLERANCE = 0.1   # generation speed a larger context may cost
+GEN_TOKENS = 32       # tokens generated per measurement
+WARMUP_TOKENS = 4     # first request after loading, not measured (page faults, allocations)
+LOAD_TIMEOUT = 180
+
+# Fixed prompt, long enough for a prompt-evaluation rate (~150 tokens)
+PROMPT = (
+    'Summarize the following text in one sentence.\n\n'
+    'The old lighthouse stood at the end of a narrow spit of land, where the river met the sea. '
+    'For more than a century its keepers climbed the spiral stairs every evening to light the lamp, '
+    'trim the wick and wind the clockwork that turned the lens. Ships coming up the coast used its '
+    'beam to find the mouth of the river, and fishermen timed their return by it. When the light was '
+    'automated, the last keeper stayed on in the cottage at its foot, painting the rocks and the '
+    'weather, and visitors who walked out along the spit would find him at his easel, happy to talk '
+    'about storms, shipwrecks and the birds that nested in the cliffs.'
+)
+
+CONTAINER_NAME = 'pocketai'
+CONTAINER_BIN = '/opt/pocketai/bin/llamafile'
+CONTAINER_MODELS = '/opt/pocketai/models'
+
+
+class TuneError(Exception):
+    pass
+
+
+# =============================================================================
+# Device
+# =============================================================================
+def cpu_clusters(sys_root='/sys'):
+    """Core counts per distinct maximum frequency, fastest first; [] without cpufreq"""
+    freqs = []
+    for path in glob.glob(os.path.join(sys_root, 'devices/system/cpu/cpu[0-9]*/cpufreq/cpuinfo_max_freq')):
+        try:
+            with open(path) as f:
+                freqs.append(int(f.read().strip()))
+        except (OSError, ValueError):
+            continue
+    counts = Counter(freqs)
+    return [counts[freq] for freq in sorted(counts, reverse=True)]
+
+
+def read_cpuinfo(proc_root='/proc'):
+    """(hardware name, sorted CPU part numbers) from cpuinfo"""
+    hardware, parts = '', set()
+    try:
+        with open(os.path.join(proc_root, 'cpuinfo')) as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                name, value = name.strip(), value.strip()
+                if name in ('Hardware', 'model name') and not hardware:
+                    hardware = value
+                elif name == 'CPU part':
+                    parts.add(value)
+    except OSError:
+        pass
+    return hardware, sorted(parts)
+
+
+def device_info(proc_root='/proc', sys_root='/sys'):
+    """CPU layout and RAM of this device, with an id derived from them"""
+    clusters = cpu_clusters(sys_root)
+    cpus = sum(clusters) or os.cpu_count() or 1
+    hardware, parts = read_cpuinfo(proc_root)
+    mem_total = read_meminfo(os.path.join(proc_root, 'meminfo')).get('MemTotal', 0)
+    info = {
+        'arch': platform.machine(),
+        'hardware': hardware,
+        'cpu_parts': parts,
+        'cpus': cpus,
+        'clusters': clusters or [cpus],
+        'mem_gb': round(mem_total / (1024 * MB)),
+    }
+    info['id'] = hashlib.sha256(json.dumps(info, sort_keys=True).encode()).hexdigest()[:12]
+    return info
+
+
+# =============================================================================
+# Search
+# =============================================================================
+def thread_candidates(device, configured=None, quick=False):
+    """Thread counts worth trying on a device, smallest first"""
+    cpus = device['cpus']
+    counts = {cpus}
+    if configured:
+        counts.add(int(configured))
+    if not quick:
+        counts.update(THREADS)
+    total = 0
+    for size in device['clusters']:
+        total += size
+        counts.add(total)
+    return sorted(t for t in counts if 1 <= t <= cpus)
+
+
+def ctx_candidates(model_path, configured):
+    """Context sizes up to what the model was trained for, smallest first"""
+    sizes = set(CTX_SIZES) | {int(configured)}
+    limit = trained_context(model_path)
+    if limit:
+        sizes = {c for c in sizes if c <= limit} or {min(int(configured), limit)}
+    return sorted(sizes)
+
+
+def trained_context(model_path):
+    """<arch>.context_length from the GGUF metadata; None if unknown"""
+    try:
+        metadata = gguf.read_gguf(model_path)['metadata']
+    except (gguf.GGUFError, OSError):
+        return None
+    value = metadata.get(f"{metadata.get('general.architecture', '')}.context_length")
+    return value if isinstance(value, int) and value > 0 else None
+
+
+def better(rates, best, field):
+    return rates is not None and (best is None or rates[field] > best[field] * (1 + MIN_GAIN))
+
+
+def sweep(measure, threads, batch_sizes, ctx_sizes, base, log=None):
+    """Best settings, measured with measure(threads, batch_size, ctx_size) -> {'prompt_tps', 'gen_tps'}
+
+    base is the (threads, batch_size, ctx_size) in use now; a batch_size of
+    None leaves llamafile's default. measure raises TuneError for settings
+    that don't run. Returns the profile: settings, their rates, the base's
+    rates and every trial.
+    """
+    log = log or (lambda line: None)
+    results = {}
+    trials = []
+
+    def trial(t, b, c):
+        if (t, b, c) not in results:
+            try:
+                rates = measure(t, b, c)
+            except TuneError as e:
+                rates = None
+                log(f"{describe(t, b, c)}  failed: {e}")
+            else:
+                log(f"{describe(t, b, c)}  prompt {rates['prompt_tps']:7.1f} t/s  "
+                    f"generation {rates['gen_tps']:6.1f} t/s")
+            results[(t, b, c)] = rates
+            trials.append(dict(threads=t, batch_size=b, ctx_size=c, **(rates or {'failed': True})))
+        return results[(t, b, c)]
+
+    best_t, best_b, best_c = base
+    best = baseline = trial(*base)
+    for t in threads:
+        rates = trial(t, best_b, best_c)
+        if better(rates, best, 'gen_tps'):
+            best_t, best = t, rates
+    if best is None:
+        raise TuneError('the model did not run with any thread count')
+
+    for b in batch_sizes:
+        rates = trial(best_t, b, best_c)
+        if better(rates, best, 'prompt_tps'):
+            best_b, best = b, rates
+
+    # Context: larger is more useful, as long as it loads and stays fast
+    ctx_rates = {best_c: best}
+    for c in ctx_sizes:
+        rates = trial(best_t, best_b, c)
+        if rates is None and c > best_c:
+            break  # larger ones won't load either
+        if rates is not None:
+            ctx_rates[c] = rates
+    fastest = max(rates['gen_tps'] for rates in ctx_rates.values())
+    best_c = max(c for c, rates in ctx_rates.items() if rates['gen_tps'] >= fastest * (1 - CTX_TOLERANCE))
+    best = ctx_rates[best_c]
+
+    return {
+        'threads': best_t,
+        'batch_size': best_b,
+        'ctx_size': best_c,
+        'prompt_tps': best['prompt_tps'],
+        'gen_tps': best['gen_tps'],
+        'baseline': dict(threads=base[0], batch_size=base[1], ctx_size=base[2], **(baseline or {'failed': True})),
+        'trials': trials,
+    }
+
+
+def describe(threads, batch_size, ctx_size):
+    return f"threads={threads:<3} batch={batch_size or 'default':<7} ctx={ctx_size:<5}"
+
+
+# =============================================================================
+# Measuring with llamafile --server
+# =============================================================================
+class ServerBench:
+    """sweep() measurement: one llamafile --server per setting, timed on PROMPT"""
+
+    def __init__(self, model_path, root, port, repeats=2, load_timeout=LOAD_TIMEOUT):
+        self.model_path = model_path
+        self.model_name = os.path.basename(model_path)
+        self.root = root
+        self.port = port
+        self.repeats = repeats
+        self.load_timeout = load_timeout
+
+    def command(self, threads, batch_size, ctx_size):
+        """Same launch as server_start, bound to localhost"""
+        cmd = [
+            'proot-distro', 'login', CONTAINER_NAME,
+            '--bind', f'{self.root}/data:/opt/pocketai/data',
+            '--bind', f'{self.root}/models:/opt/pocketai/models',
+            '--', CONTAINER_BIN,
+            '-m', f'{CONTAINER_MODELS}/{self.model_name}',
+            '-t', str(threads),
+            '-c', str(ctx_size),
+        ]
+        if batch_size:
+            cmd += ['-b', str(batch_size)]
+        return cmd + ['--server', '--host', '127.0.0.1', '--port', str(self.port)]
+
+    def request(self, n_predict):
+        """Rates of one completion, from llamafile's timings (wall clock without them)"""
+        payload = prompt_templates.completion_payload(
+            prompt_templates.format_prompt(self.model_name, PROMPT), self.model_name, n_predict)
+        payload['cache_prompt'] = False  # evaluate the prompt every time
+        start = time.monotonic()
+        body = batch.complete(self.port, payload, timeout=self.load_timeout)
+        elapsed = time.monotonic() - start
+        timings = body.get('timings') or {}
+        if timings.get('predicted_per_second'):
+            return {'prompt_tps': round(float(timings.get('prompt_per_second') or 0), 2),
+                    'gen_tps': round(float(timings['predicted_per_second']), 2)}
+        tokens = body.get('tokens_predicted') or n_predict
+        return {'prompt_tps': 0.0, 'gen_tps': round(tokens / elapsed, 2) if elapsed > 0 else 0.0}
+
+    def measure(self, threads, batch_size, ctx_size):
+        process = subprocess.Popen(
+            self.command(threads, batch_size, ctx_size),
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True  # own process group, so the whole proot tree is stopped
+        )
+        try:
+            if not batch.wait_healthy(self.port, self.load_timeout, process):
+                if process.poll() is not None:
+                    raise TuneError(f"engine exited while loading (code {process.returncode})")
+                raise TuneError(f"engine not ready after {self.load_timeout:.0f}s")
+            self.request(WARMUP_TOKENS)
+            runs = [self.request(GEN_TOKENS) for _ in range(self.repeats)]
+        except (OSError, ValueError, http.client.HTTPException, batch.BatchError) as e:
+            raise TuneError(str(e)) from e
+        finally:
+            stop_process(process)
+        return {'prompt_tps': max(r['prompt_tps'] for r in runs), 'gen_tps': max(r['gen_tps'] for r in runs)}
+
+
+def stop_process(process):
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait(timeout=2)
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+
+
+# =============================================================================
+# Profiles
+# =============================================================================
+class ProfileStore:
+    """Tuned settings per device and model in a JSON file, re-read when it changes; thread-safe"""
+
+    def __init__(self, path, device=None):
+        self.path = path
+        self._device = device
+        self.data = {}
+        self.stamp = None
+        self.lock = threading.Lock()
+
+    @property
+    def device(self):
+        if self._device is None:
+            self._device = device_info()
+        return self._device
+
+    def _load_locked(self):
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            self.data, self.stamp = {}, None
+            return
+        if stamp == self.stamp:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.data = data if isinstance(data, dict) else {}
+        self.stamp = stamp
+
+    def _save_locked(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp, self.path)
+        self.stamp = None
+
+    def profiles(self):
+        """{model name: profile} for this device"""
+        with self.lock:
+            self._load_locked()
+            return dict(self.data.get(self.device['id'], {}).get('models', {}))
+
+    def lookup(self, model_path):
+        """Profile of a model file on this device; None if untuned or the file changed since"""
+        profile = self.profiles().get(os.path.basename(model_path or ''))
+        if profile is None:
+            return None
+        try:
+            if os.path.getsize(model_path) != profile.get('model_size'):
+                return None
+        except OSError:
+            return None
+        return profile
+
+    def save(self, model_path, profile):
+        profile = dict(profile, model_size=os.path.getsize(model_path), tuned=round(time.time()))
+        with self.lock:
+            self._load_locked()
+            entry = self.data.setdefault(self.device['id'], {'models': {}})
+            entry['device'] = {k: v for k, v in self.device.items() if k != 'id'}
+            entry.setdefault('models', {})[os.path.basename(model_path)] = profile
+            self._save_locked()
+        return profile
+
+    def remove(self, model_name=None):
+        """Forget one model's profile on this device (all of them without a name); returns how many"""
+        with self.lock:
+            self._load_locked()
+            models = self.data.get(self.device['id'], {}).get('models', {})
+            names = [model_name] if model_name else list(models)
+            removed = [name for name in names if models.pop(name, None) is not None]
+            if removed:
+                self._save_locked()
+            return len(removed)
+
+
+def settings(profile):
+    """(threads, ctx_size, batch_size) of a profile as engine argument strings ('' for the default batch)"""
+    return str(profile['threads']), str(profile['ctx_size']), str(profile.get('batch_size') or '')
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+def gain(profile):
+    """Generation speedup over the base settings in percent; None if the base didn't run"""
+    base = profile.get('baseline') or {}
+    if not base.get('gen_tps'):
+        return None
+    return round((profile['gen_tps'] / base['gen_tps'] - 1) * 100)
+
+
+def summary_line(name, profile):
+    line = (f"{name}: threads={profile['threads']} batch={profile.get('batch_size') or 'default'} "
+            f"ctx={profile['ctx_size']} (prompt {profile['prompt_tps']} t/s, generation {profile['gen_tps']} t/s")
+    speedup = gain(profile)
+    if speedup is not None:
+        base = profile['baseline']
+        line += f", {speedup:+d}% over threads={base['threads']} ctx={base['ctx_size']}"
+    return line + ')'
+
+
+def cmd_run(args, store):
+    if not os.path.isfile(args.model):
+        print(f"Error: model not found: {args.model}", file=sys.stderr)
+        return 1
+    device = store.device
+    name = os.path.basename(args.model)
+    threads = thread_candidates(device, args.threads, args.quick)
+    batch_sizes = QUICK_BATCH_SIZES if args.quick else BATCH_SIZES
+    base_ctx = ctx_candidates(args.model, args.ctx)
+    base_ctx = args.ctx if args.ctx in base_ctx else base_ctx[-1]
+    ctx_sizes = [] if args.quick else ctx_candidates(args.model, args.ctx)
+    print(f"Tuning {name} on {device['hardware'] or device['arch']} "
+          f"({device['cpus']} cores: {'+'.join(map(str, device['clusters']))}, {device['mem_gb']}GB)")
+    print(f"Trying threads {', '.join(map(str, threads))}; batch {', '.join(map(str, batch_sizes))}"
+          + (f"; ctx {', '.join(map(str, ctx_sizes))}" if ctx_sizes else ''))
+    sys.stdout.flush()
+
+    bench = ServerBench(args.model, args.root, args.port, 1 if args.quick else 2, args.load_timeout)
+
+    def log(line):
+        print(f"  {line}", flush=True)
+
+    try:
+        profile = sweep(bench.measure, threads, batch_sizes, ctx_sizes, (args.threads, None, base_ctx), log)
+    except TuneError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("Interrupted; profile not saved", file=sys.stderr)
+        return 130
+    profile['quick'] = args.quick
+    store.save(args.model, profile)
+    print(f"Saved {summary_line(name, profile)}")
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='autotune.py', description='Tune threads/batch/ctx per model and device')
+    parser.add_argument('--profiles', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'tune_profiles.json'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='benchmark a model and save its profile')
+    run.add_argument('model')
+    run.add_argument('--root', required=True, help='POCKETAI_ROOT (bound into the container)')
+    run.add_argument('--port', type=int, default=8084)
+    run.add_argument('--threads', type=int, default=4, help='configured threads (the starting point)')
+    run.add_argument('--ctx', type=int, default=2048, help='configured ctx_size (the starting point)')
+    run.add_argument('--quick', action='store_true', help='fewer settings, one run each, keep ctx_size')
+    run.add_argument('--load-timeout', type=float, default=LOAD_TIMEOUT)
+    get = sub.add_parser('get', help='print the tuned settings of a model')
+    get.add_argument('model')
+    show = sub.add_parser('show', help='list the profiles of this device')
+    show.add_argument('--json', action='store_true')
+    reset = sub.add_parser('reset', help='forget profiles of this device')
+    reset.add_argument('model', nargs='?', default='')
+    args = parser.parse_args(argv[1:])
+
+    store = ProfileStore(args.profiles)
+    if args.command == 'run':
+        return cmd_run(args, store)
+    if args.command == 'get':
+        profile = store.lookup(args.model)
+        if profile is None:
+            return 1
+        print(' '.join(settings(profile)))
+        return 0
+    if args.command == 'show':
+        profiles = store.profiles()
+        if args.json:
+            print(json.dumps({'device': store.device, 'profiles': profiles}, indent=2))
+        elif not profiles:
+            print("No tuned models on this device (run: pai tune)")
+        else:
+            for name, profile in sorted(profiles.items()):
+                print(summary_line(name, profile))
+        return 0
+    removed = store.remove(os.path.basename(args.model) if args.model else None)
+    print(f"Removed {removed} profile{'s' if removed != 1 else ''}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+PocketAI batch inference - many prompts through one loaded model
+
+Input is JSONL, one item per line (or a list of the same objects):
+
+  {"id": "r1", "message": "Classify: ...", "max_tokens": 8, "stop": ["\\n"]}
+
+Only message is required. id defaults to the item's position, stop
+sequences are added to the model's own. Every item goes as JSON to a
+llamafile --server /completion endpoint, so the model is loaded once for
+the whole batch and messages need no shell quoting.
+
+Results are NDJSON, in submission order or as they complete:
+
+  {"id": "r1", "index": 0, "response": "...", "tokens": 3, "seconds": 0.41}
+  {"id": "r2", "index": 1, "error": "..."}
+
+Answered items are appended to a checkpoint file as they finish. Running
+the batch again with the same checkpoint skips them, so an interrupted
+batch resumes where it stopped; failed items are tried again.
+
+Usage (pai batch; the checkpoint is the output file):
+  batch.py run <input.jsonl> --port N --model NAME [-o out.ndjson] [--max-tokens N]
+               [--order submitted|completed] [--concurrency N] [--load-timeout S]
+"""
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import sys
+import time
+
+import prompt_templates
+import stream_filter
+
+ORDERS = ('submitted', 'completed')
+
+
+class BatchError(Exception):
+    """Invalid batch input or checkpoint"""
+
+
+# =============================================================================
+# Items
+# =============================================================================
+def check_item(raw, index, where):
+    """Validated item dict for a raw JSON value (a plain string is a message)"""
+    if isinstance(raw, str):
+        raw = {'message': raw}
+    if not isinstance(raw, dict):
+        raise BatchError(f"{where}: expected an object")
+    message = raw.get('message')
+    if not isinstance(message, str) or not message.strip():
+        raise BatchError(f"{where}: message is required")
+    max_tokens = raw.get('max_tokens')
+    if max_tokens in ('', None):
+        max_tokens = None
+    else:
+        try:
+            max_tokens = int(max_tokens)
+        except (TypeError, ValueError):
+            raise BatchError(f"{where}: max_tokens must be a number") from None
+        if max_tokens <= 0:
+            raise BatchError(f"{where}: max_tokens must be positive")
+    stop = raw.get('stop') or []
+    if isinstance(stop, str):
+        stop = [stop]
+    if not isinstance(stop, list) or not all(isinstance(s, str) and s for s in stop):
+        raise BatchError(f"{where}: stop must be a string or a list of strings")
+    item_id = raw.get('id', index)
+    if not isinstance(item_id, (str, int)) or isinstance(item_id, bool):
+        raise BatchError(f"{where}: id must be a string or a number")
+    return {'index': index, 'id': item_id, 'message': message, 'max_tokens': max_tokens, 'stop': stop}
+
+
+def _unique(items):
+    seen = set()
+    for item in items:
+        key = str(item['id'])
+        if key in seen:
+            raise BatchError(f"Duplicate id: {item['id']}")
+        seen.add(key)
+    return items
+
+
+def parse_lines(lines):
+    """Items from JSONL lines (str or bytes); blank lines are skipped"""
+    items = []
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            raw = json.loads(line)
+        except ValueError as e:
+            raise BatchError(f"line {number}: invalid JSON ({e})") from None
+        items.append(check_item(raw, len(items), f"line {number}"))
+    return _unique(items)
+
+
+def parse_list(values):
+    """Items from a decoded JSON list"""
+    if not isinstance(values, list):
+        raise BatchError("items must be a list")
+    return _unique([check_item(raw, index, f"item {index}") for index, raw in enumerate(values)])
+
+
+def digest(items):
+    """Short hash identifying a batch's items (a checkpoint only resumes the same batch)"""
+    data = json.dumps([(str(i['id']), i['message'], i['max_tokens'], i['stop']) for i in items])
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+def item_payload(item, model_name, n_predict=None):
+    """llamafile /completion body for an item (its stop sequences after the model's)"""
+    payload = prompt_templates.completion_payload(
+        prompt_templates.format_prompt(model_name, item['message']), model_name, n_predict)
+    payload['stop'] += [s for s in item['stop'] if s not in payload['stop']]
+    return payload
+
+
+# =============================================================================
+# Checkpoint
+# =============================================================================
+class Checkpoint:
+    """Answered items of a batch, one JSON line each, appended as they finish
+
+    With a digest, the file starts with a {"digest": ..} line and load()
+    refuses a file written for other items; without one (pai batch output
+    files) only the ids are matched.
+    """
+
+    def __init__(self, path, digest=None):
+        self.path = path
+        self.digest = digest
+        self.file = None
+
+    def load(self):
+        """Results already in the file, by str(id)"""
+        results = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by the interruption
+                    if not isinstance(result, dict):
+                        continue
+                    if 'digest' in result:
+                        if self.digest and result['digest'] != self.digest:
+                            raise BatchError("Checkpoint belongs to a different batch")
+                        continue
+                    if 'id' in result and 'response' in result and not result.get('error'):
+                        results[str(result['id'])] = result
+        except FileNotFoundError:
+            pass
+        return results
+
+    def add(self, result):
+        if self.file is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    partial = f.read(1) != b'\n'  # cut off mid-line by the interruption
+                new = False
+            except OSError:
+                partial = False
+                new = True
+            self.file = open(self.path, 'a', encoding='utf-8')
+            if partial:
+                self.file.write('\n')
+            if new and self.digest:
+                self.file.write(json.dumps({'digest': self.digest}) + '\n')
+        self.file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# =============================================================================
+# Running
+# =============================================================================
+class Stats:
+    """Counts and throughput of a batch run"""
+
+    def __init__(self, total, skipped=0):
+        self.total = total
+        self.skipped = skipped
+        self.ok = 0
+        self.errors = 0
+        self.tokens = 0
+        self.started = time.time()
+
+    def add(self, result):
+        if result.get('error'):
+            self.errors += 1
+        else:
+            self.ok += 1
+            self.tokens += result.get('tokens') or 0
+
+    def summary(self):
+        seconds = time.time() - self.started
+        return {
+            'done': True,
+            'items': self.total,
+            'ok': self.ok,
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'remaining': self.total - self.skipped - self.ok - self.errors,
+            'tokens': self.tokens,
+            'seconds': round(seconds, 3),
+            'items_per_s': round(self.ok / seconds, 3) if seconds > 0 else 0.0,
+            'tokens_per_s': round(self.tokens / seconds, 2) if seconds > 0 else 0.0
+        }
+
+
+def run(items, complete, concurrency=1, order='submitted'):
+    """Yield a result per item; complete(item) returns its result fields or raises
+
+    Up to `concurrency` items run at once. Closing the generator cancels
+    the items that have not started.
+    """
+    def work(item):
+        start = time.time()
+        result = {'id': item['id'], 'index': item['index']}
+        try:
+            result.update(complete(item))
+        except Exception as e:
+            result['error'] = str(e) or type(e).__name__
+        result['seconds'] = round(time.time() - start, 3)
+        return result
+
+    if concurrency <= 1:
+        for item in items:
+            yield work(item)
+        return
+
+    window = concurrency * 2  # items submitted ahead, so memory stays flat for big batches
+    pool = concurrent.futures.ThreadPoolExecutor(concurrency, thread_name_prefix='pocketai-batch')
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(work, item))
+            while len(pending) >= window:
+                yield from _collect(pending, order)
+        while pending:
+            yield from _collect(pending, order)
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def _collect(pending, order):
+    """Results ready to go out: the oldest item's, or every finished one"""
+    if order == 'submitted':
+        yield pending.popleft().result()
+        return
+    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield future.result()
+
+
+def complete(port, payload, timeout=300, on_connect=None):
+    """POST a /completion request; returns the decoded response
+
+    on_connect(sock) is called once connected (for cancellation).
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.connect()
+        if on_connect is not None:
+            on_connect(conn.sock)
+        conn.request('POST', '/completion', body=json.dumps(payload),
+                     headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.status != 200:
+            raise BatchError(f"engine returned HTTP {resp.status}")
+        return json.loads(body)
+    finally:
+        conn.close()
+
+
+def result_fields(body, model_name):
+    """Result fields for a /completion response"""
+    fields = {'response': stream_filter.clean_text(body.get('content', ''), model_name)}
+    if body.get('tokens_predicted') is not None:
+        fields['tokens'] = body['tokens_predicted']
+    if body.get('stopped_limit'):
+        fields['truncated'] = True
+    return fields
+
+
+def wait_healthy(port, timeout, process=None):
+    """True once llamafile on port answers /health with 200 (False early if process exits)"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+        try:
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return True
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        time.sleep(0.5)
+    return False
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run a JSONL batch through a llamafile server')
+    sub = parser.add_subparsers(dest='command', required=True)
+    batch = sub.add_parser('run', help='run the items of a JSONL file')
+    batch.add_argument('input', help='JSONL file, - for stdin')
+    batch.add_argument('--port', type=int, required=True, help='llamafile --server port')
+    batch.add_argument('--model', required=True, help='model file name (picks the prompt template)')
+    batch.add_argument('-o', '--output', default='', help='NDJSON results, also the checkpoint (default: stdout)')
+    batch.add_argument('--max-tokens', type=int, default=0, help='limit for items without max_tokens')
+    batch.add_argument('--order', choices=ORDERS, default='submitted')
+    batch.add_argument('--concurrency', type=int, default=1)
+    batch.add_argument('--load-timeout', type=float, default=180)
+    args = parser.parse_args(argv[1:])
+
+    try:
+        if args.input == '-':
+            items = parse_lines(sys.stdin)
+        else:
+            with open(args.input, encoding='utf-8') as f:
+                items = parse_lines(f)
+    except (OSError, UnicodeDecodeError, BatchError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    checkpoint = Checkpoint(args.output) if args.output else None
+    finished = checkpoint.load() if checkpoint else {}
+    todo = [item for item in items if str(item['id']) not in finished]
+    stats = Stats(len(items), len(items) - len(todo))
+    if stats.skipped:
+        print(f"Resuming: {stats.skipped} of {len(items)} items already done", file=sys.stderr)
+    if todo and not wait_healthy(args.port, args.load_timeout):
+        print(f"Error: engine not ready after {args.load_timeout:.0f}s", file=sys.stderr)
+        return 1
+
+    def answer(item):
+        payload = item_payload(item, args.model, item['max_tokens'] or args.max_tokens or None)
+        return result_fields(complete(args.port, payload), args.model)
+
+    out = sys.stdout
+    try:
+        for result in run(todo, answer, args.concurrency, args.order):
+            stats.add(result)
+            if checkpoint is not None and not result.get('error'):
+                checkpoint.add(result)
+            elif checkpoint is None:
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+            if result.get('error'):
+                print(f"Item {result['id']}: {result['error']}", file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Interrupted; run again to resume" if checkpoint else "Interrupted", file=sys.stderr)
+        return 130
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    print(json.dumps(stats.summary()), file=sys.stderr)
+    return 0 if not stats.errors else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+PocketAI cancellation - which request owns which processes, and ending them
+
+Every generation the API server runs is registered under its request ID
+(the X-Request-ID response header). Processes it starts are attached to it,
+each in its own process group, so cancelling the request (an explicit
+cancel, a client that went away, /api/reset) ends exactly that request's
+process tree and leaves other users' generations alone. Other ways to stop
+a generation, like closing the connection to a resident engine, are
+registered as callbacks.
+
+Ending a process never blocks the caller: the Reaper sends SIGTERM to the
+group at once, and its thread sends SIGKILL if anything in the group is
+still alive after the grace period, collecting exit statuses as they come.
+
+DisconnectMonitor watches the client sockets of running generations from a
+single thread, so a client that closed the connection is noticed while the
+model is still loading or thinking, not at the next failed write.
+"""
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+
+def exit_status(process):
+    """Exit status of a Popen, ShellCommand or asyncio Process; None while it runs"""
+    poll = getattr(process, 'poll', None)
+    return poll() if poll is not None else process.returncode
+
+
+def group_alive(pgid):
+    """True while any process is left in the group"""
+    try:
+        os.killpg(pgid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class Reaper:
+    """Ends process groups in the background: SIGTERM now, SIGKILL after `grace` seconds"""
+
+    GIVE_UP = 10  # seconds after SIGKILL before an unreaped process is dropped
+
+    def __init__(self, grace=2.0, interval=0.05):
+        self.grace = grace
+        self.interval = interval
+        self.pending = []  # [process, deadline, killed]
+        self.cond = threading.Condition()
+        self.thread = None
+        self.terminated = 0
+        self.killed = 0    # groups that needed SIGKILL
+
+    def terminate(self, process):
+        """Start ending the process's group; returns at once"""
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        with self.cond:
+            self.terminated += 1
+            self.pending.append([process, time.monotonic() + self.grace, False])
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='pocketai-reaper', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                pending = list(self.pending)
+            finished = []
+            for entry in pending:
+                process, deadline, killed = entry
+                exited = exit_status(process) is not None
+                now = time.monotonic()
+                if not killed and now >= deadline and group_alive(process.pid):
+                    # Also catches children still running after the leader exited
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                    entry[1] = now + self.GIVE_UP
+                    entry[2] = True
+                    with self.cond:
+                        self.killed += 1
+                elif exited and (killed or not group_alive(process.pid)):
+                    finished.append(entry)
+                elif killed and now >= deadline:
+                    finished.append(entry)
+            with self.cond:
+                for entry in finished:
+                    self.pending.remove(entry)
+            time.sleep(self.interval)
+
+    def snapshot(self):
+        with self.cond:
+            return {'terminated': self.terminated, 'killed': self.killed, 'pending': len(self.pending)}
+
+
+class Generation:
+    """One request's generation: the processes it started and other ways to stop it"""
+
+    def __init__(self, registry, request_id, kind):
+        self.registry = registry
+        self.id = request_id
+        self.kind = kind
+        self.started = time.time()
+        self.reason = None  # why it was cancelled
+        self.processes = []
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def attach(self, process):
+        """Own a started process group; it is ended at once if the request is already cancelled"""
+        with self.lock:
+            if self.reason is None:
+                self.processes.append(process)
+                return
+        self.registry.reaper.terminate(process)
+
+    def detach(self, process):
+        """Stop owning a process; False if a cancel already took it over"""
+        with self.lock:
+            if process in self.processes:
+                self.processes.remove(process)
+                return True
+            return False
+
+    def on_cancel(self, callback):
+        """Call callback() on cancel (right away if already cancelled)"""
+        with self.lock:
+            if self.reason is None:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+    def cancel(self, reason='cancelled'):
+        """End the generation's processes and run its callbacks; False if already cancelled"""
+        with self.lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            processes, self.processes = self.processes, []
+            callbacks, self.callbacks = self.callbacks, []
+        self.registry.count(reason)
+        for process in processes:
+            self.registry.reaper.terminate(process)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+        return True
+
+    def view(self):
+        with self.lock:
+            return {
+                'request_id': self.id,
+                'kind': self.kind,
+                'running': round(time.time() - self.started, 1),
+                'processes': len(self.processes),
+                'cancelled': self.reason,
+            }
+
+
+class GenerationRegistry:
+    """Running generations by request ID; thread-safe"""
+
+    def __init__(self, reaper):
+        self.reaper = reaper
+        self.generations = {}
+        self.cancelled = {}  # reason -> count
+        self.lock = threading.Lock()
+
+    def start(self, request_id, kind):
+        generation = Generation(self, str(request_id), kind)
+        with self.lock:
+            self.generations[generation.id] = generation
+        return generation
+
+    def end(self, generation):
+        with self.lock:
+            if self.generations.get(generation.id) is generation:
+                del self.generations[generation.id]
+
+    def get(self, request_id):
+        with self.lock:
+            return self.generations.get(str(request_id))
+
+    def count(self, reason):
+        with self.lock:
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+
+    def cancel_all(self, reason):
+        """Cancel every running generation; returns how many were cancelled"""
+        with self.lock:
+            generations = list(self.generations.values())
+        return sum(1 for generation in generations if generation.cancel(reason))
+
+    def list(self):
+        with self.lock:
+            generations = list(self.generations.values())
+        return [generation.view() for generation in generations]
+
+    def __len__(self):
+        return len(self.generations)
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {'active': len(self.generations), 'cancelled': dict(self.cancelled)}
+        snapshot.update(self.reaper.snapshot())
+        return snapshot
+
+
+class DisconnectMonitor:
+    """Cancels the generation of a client that closed its connection (threaded server)
+
+    Sockets are polled for readability; a readable socket whose peek
+    returns no data has been closed by the client. A socket with unread
+    data (a pipelined request) is no longer watched.
+    """
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.watched = {}  # socket -> Generation
+        self.cond = threading.Condition()
+        self.thread = None
+        self.detected = 0
+
+    def watch(self, sock, generation):
+        with self.cond:
+            self.watched[sock] = generation
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='pocketai-disconnects', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def unwatch(self, sock):
+        with self.cond:
+            self.watched.pop(sock, None)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.watched:
+                    self.cond.wait()
+                socks = [sock for sock in self.watched if sock.fileno() >= 0]
+            try:
+                readable, _, _ = select.select(socks, [], [], self.interval)
+            except (OSError, ValueError):
+                # A socket was closed while we waited; the next round skips it
+                time.sleep(self.interval)
+                continue
+            for sock in readable:
+                try:
+                    gone = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    gone = True
+                with self.cond:
+                    generation = self.watched.pop(sock, None)
+                    if gone and generation is not None:
+                        self.detected += 1
+                if gone and generation is not None:
+                    generation.cancel('disconnected')
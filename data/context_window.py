@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+PocketAI context window - chat history sized in tokens instead of turns
+
+The history in front of a new message is built from build_history_entry
+output, oldest turn first, and may use what is left of ctx_size after the
+new message and the answer's token limit (or the history_tokens setting,
+if lower). Tokens are counted with the model's own vocabulary from the GGUF
+metadata (greedy longest match over tokenizer.ggml.tokens, close to what
+the real tokenizer produces); files without one fall back to an estimate
+of 3 bytes per token.
+
+The window moves in steps: turns drop out only when the history no longer
+fits, and then enough of them that a third of the budget is free again.
+The prompt prefix therefore stays the same for several turns, which keeps
+llamafile's prompt cache (and the resident engine's KV cache) valid. The
+prefix starts with a pinned system block, when the template has one: the
+system_prompt setting and a short recap of the dropped turns.
+
+Usage (for pai chat; turns are kept in a JSON state file):
+  context_window.py history <model.gguf> <state.json> <message> [--ctx N] [--reserve N]
+                    [--budget N] [--system TEXT] [--no-summary]
+  context_window.py append <state.json> <user message> <response>
+  context_window.py count <model.gguf> <text>
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+
+import gguf
+import prompt_templates
+
+DEFAULT_RESERVE = 512  # tokens kept for the answer when the request sets no limit
+HEADROOM = 0.33        # share of the budget freed when turns have to drop out
+RECAP_SHARE = 0.1      # most of the budget the recap of dropped turns may use
+RECAP_CHARS = 80       # per dropped message
+RECAP_INTRO = 'Earlier in this conversation the user asked: '
+MAX_PIECE = 32         # longest vocabulary piece tried, in characters
+
+_CHUNK = re.compile(r'\s*\S+|\s+')
+
+
+def _byte_chars():
+    """GPT-2 byte-level BPE alphabet: byte -> printable character"""
+    printable = list(range(ord('!'), ord('~') + 1)) + list(range(0xA1, 0xAD)) + list(range(0xAE, 0x100))
+    chars = {b: chr(b) for b in printable}
+    extra = 0
+    for b in range(256):
+        if b not in chars:
+            chars[b] = chr(256 + extra)
+            extra += 1
+    return [chars[b] for b in range(256)]
+
+
+_BYTE_CHARS = _byte_chars()
+
+
+class ApproxCounter:
+    """Estimate for models without a readable vocabulary"""
+
+    name = 'approx'
+
+    def count(self, text):
+        return (len(text.encode('utf-8')) + 2) // 3
+
+
+APPROX = ApproxCounter()
+
+
+class Tokenizer:
+    """Token counts from a GGUF vocabulary
+
+    Text is split at whitespace the way both BPE flavours pre-tokenize,
+    each chunk is mapped to the vocabulary's alphabet (byte-level for gpt2
+    models, U+2581 for spaces in SentencePiece ones) and covered with the
+    longest pieces the vocabulary has. Counts per chunk are memoized.
+    """
+
+    def __init__(self, name, tokens, kind):
+        self.name = name
+        self.vocab = set(tokens)
+        self.byte_level = kind == 'gpt2'
+        self.max_piece = min(MAX_PIECE, max((len(t) for t in tokens), default=1))
+        self.memo = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """Tokenizer for a model file; None if it has no usable vocabulary"""
+        try:
+            info = gguf.read_gguf(path, keep_arrays=('tokenizer.ggml.tokens',))
+        except (gguf.GGUFError, OSError):
+            return None
+        tokens = info['metadata'].get('tokenizer.ggml.tokens')
+        if not isinstance(tokens, list) or not tokens:
+            return None
+        kind = info['metadata'].get('tokenizer.ggml.model', '')
+        return cls(f'gguf:{os.path.basename(path)}', tokens, kind)
+
+    def normalize(self, chunk):
+        if self.byte_level:
+            return ''.join(_BYTE_CHARS[b] for b in chunk.encode('utf-8'))
+        return chunk.replace(' ', '▁')
+
+    def count_chunk(self, chunk):
+        text = self.normalize(chunk)
+        vocab = self.vocab
+        n = i = 0
+        end = len(text)
+        while i < end:
+            for j in range(min(end, i + self.max_piece), i, -1):
+                if text[i:j] in vocab:
+                    break
+            else:
+                # No piece: SentencePiece falls back to one token per byte
+                n += 1 if self.byte_level else len(text[i].encode('utf-8'))
+                i += 1
+                continue
+            n += 1
+            i = j
+        return n
+
+    def count(self, text):
+        if not self.byte_level:
+            text = ' ' + text  # SentencePiece's dummy prefix
+        total = 0
+        for chunk in _CHUNK.findall(text):
+            n = self.memo.get(chunk)
+            if n is None:
+                n = self.count_chunk(chunk)
+                with self.lock:
+                    if len(self.memo) >= 50000:
+                        self.memo.clear()
+                    self.memo[chunk] = n
+            total += n
+        return total
+
+
+_counters = {}  # model path -> ((size, mtime_ns, inode), counter)
+_counters_lock = threading.Lock()
+
+
+def counter_for(model_path):
+    """Token counter for a model file: its GGUF vocabulary, or the estimate"""
+    try:
+        st = os.stat(model_path)
+    except (OSError, TypeError):
+        return APPROX
+    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+    with _counters_lock:
+        cached = _counters.get(model_path)
+    if cached and cached[0] == key:
+        return cached[1]
+    counter = Tokenizer.load(model_path) or APPROX
+    with _counters_lock:
+        # Vocabularies are large; keep the two most recent models
+        if len(_counters) >= 2:
+            _counters.pop(next(iter(_counters)))
+        _counters[model_path] = (key, counter)
+    return counter
+
+
+def history_budget(ctx_size, n_predict, used, limit=0):
+    """Tokens the history may use: what the context has left after the prompt and the answer"""
+    try:
+        reserve = int(n_predict) if n_predict else DEFAULT_RESERVE
+    except ValueError:
+        reserve = DEFAULT_RESERVE
+    budget = int(ctx_size) - reserve - used
+    if limit and int(limit) > 0:
+        budget = min(budget, int(limit))
+    return max(0, budget)
+
+
+def window_start(counts, start, budget):
+    """Index of the first turn to keep, moving start only when the turns after it don't fit"""
+    start = min(start, len(counts))
+    total = sum(counts[start:])
+    if total <= budget:
+        return start
+    target = budget * (1 - HEADROOM)
+    while start < len(counts) and total > target:
+        total -= counts[start]
+        start += 1
+    return start
+
+
+def turn_tokens(model_name, turn, counter):
+    """Tokens of a turn's history entry (cached in the turn for this counter)"""
+    if turn.get('tokenizer') != counter.name or 'tokens' not in turn:
+        entry = prompt_templates.build_history_entry(model_name, turn['user'], turn['assistant'])
+        turn['tokens'] = counter.count(entry)
+        turn['tokenizer'] = counter.name
+    return turn['tokens']
+
+
+def recap(turns, counter, limit):
+    """What the dropped turns asked, within limit tokens (the oldest questions go first)"""
+    topics = []
+    for turn in reversed(turns):
+        line = turn['user'].strip().split('\n', 1)[0]
+        if len(line) > RECAP_CHARS:
+            line = line[:RECAP_CHARS - 3].rstrip() + '...'
+        if counter.count(RECAP_INTRO + '; '.join([line] + topics)) > limit:
+            break
+        topics.insert(0, line)
+    if not topics:
+        return ''
+    return RECAP_INTRO + '; '.join(topics)
+
+
+def pinned_prefix(model_name, system='', summary=''):
+    """bos and the system block for the template, or '' without system text or support"""
+    t = prompt_templates.get_template(model_name)
+    text = '\n\n'.join(part for part in (system, summary) if part)
+    if not text or not t.get('system'):
+        return ''
+    open_tag, close_tag = t['system']
+    return t['bos'] + open_tag + text + close_tag
+
+
+def fit(model_path, turns, start, message, ctx_size, n_predict='', limit=0, system='', summarize=True):
+    """History for the next prompt within the token budget
+
+    turns are {'user', 'assistant'} dicts (token counts get cached in them);
+    start is the first turn kept last time. Returns (history, start, info):
+    history is what build_prompt takes, start is to be passed back next time.
+    """
+    model_name = os.path.basename(model_path or '')
+    counter = counter_for(model_path)
+    t = prompt_templates.get_template(model_name)
+    info = {'tokenizer': counter.name, 'budget': 0, 'tokens': 0, 'turns': 0, 'dropped': len(turns),
+            'summary': False}
+    if not t['history']:
+        return '', len(turns), info
+
+    used = counter.count(prompt_templates.build_prompt(model_name, message))
+    budget = history_budget(ctx_size, n_predict, used, limit)
+    counts = [turn_tokens(model_name, turn, counter) for turn in turns]
+    start = min(start, len(turns))
+    while True:
+        summary = recap(turns[:start], counter, budget * RECAP_SHARE) if summarize and start else ''
+        prefix = pinned_prefix(model_name, system, summary)
+        prefix_tokens = counter.count(prefix) if prefix else 0
+        new_start = window_start(counts, start, budget - prefix_tokens)
+        if new_start == start:
+            break
+        start = new_start
+
+    entries = [prompt_templates.build_history_entry(model_name, turn['user'], turn['assistant']).rstrip('\n') + '\n'
+               for turn in turns[start:]]
+    info.update({
+        'budget': budget,
+        'tokens': prefix_tokens + sum(counts[start:]),
+        'turns': len(turns) - start,
+        'dropped': start,
+        'summary': bool(summary and prefix),
+    })
+    return prefix + ''.join(entries), start, info
+
+
+# =============================================================================
+# pai chat state file
+# =============================================================================
+def load_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state.setdefault('start', 0)
+    state.setdefault('turns', [])
+    return state
+
+
+def save_state(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='context_window.py', description='Token-budgeted chat history')
+    sub = parser.add_subparsers(dest='command', required=True)
+    history = sub.add_parser('history', help='print the history prefix for the next message')
+    history.add_argument('model')
+    history.add_argument('state')
+    history.add_argument('message')
+    history.add_argument('--ctx', type=int, default=2048)
+    history.add_argument('--reserve', default='')
+    history.add_argument('--budget', type=int, default=0)
+    history.add_argument('--system', default='')
+    history.add_argument('--no-summary', action='store_true')
+    append = sub.add_parser('append', help='record a finished turn')
+    append.add_argument('state')
+    append.add_argument('user')
+    append.add_argument('response')
+    count = sub.add_parser('count', help='print the token count of a text')
+    count.add_argument('model')
+    count.add_argument('text')
+    args = parser.parse_args(argv[1:])
+
+    if args.command == 'count':
+        counter = counter_for(args.model)
+        print(counter.count(args.text), counter.name)
+        return 0
+    state = load_state(args.state)
+    if args.command == 'append':
+        state['turns'].append({'user': args.user, 'assistant': args.response})
+        save_state(args.state, state)
+        return 0
+    text, state['start'], _ = fit(args.model, state['turns'], state['start'], args.message, args.ctx,
+                                     args.reserve, args.budget, args.system, not args.no_summary)
+    save_state(args.state, state)  # keeps the token counts for the next turn
+    sys.stdout.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
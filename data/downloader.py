@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+PocketAI downloader - parallel ranged model downloads with resume
+
+A file is fetched as fixed-size chunks over N concurrent HTTP range
+requests into a preallocated <dest>.part. Finished chunks are recorded in
+<dest>.part.json, so an interrupted download (crash, reboot, lost network)
+resumes where it stopped. SHA-256 is computed while downloading: chunks
+are hashed in file order as soon as the prefix up to them is complete,
+while they are still in the page cache.
+
+Usage:
+  downloader.py <url> <dest> [--connections N] [--limit-rate RATE]
+                [--sha256 HEX] [--json]
+
+RATE is bytes per second with an optional K/M/G suffix (0 = unlimited).
+"""
+import fcntl
+import hashlib
+import http.client
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+USER_AGENT = 'PocketAI-downloader'
+CHUNK_SIZE = 8 * 1024 * 1024
+READ_BLOCK = 64 * 1024
+RETRIES = 4
+PROGRESS_INTERVAL = 0.5
+
+
+class DownloadError(Exception):
+    """Download failed for good (after retries) or was cancelled"""
+
+
+def parse_rate(value):
+    """'2M' -> 2097152 bytes/s; '' or '0' -> 0 (unlimited)"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*', str(value or '0'), re.IGNORECASE)
+    if not match:
+        raise ValueError(f'Invalid rate: {value!r}')
+    scale = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2).upper()]
+    return int(float(match.group(1)) * scale)
+
+
+class RateLimiter:
+    """Token bucket shared by all connections of a download"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # Allow at most a quarter second of burst
+            self.tokens = min(self.rate / 4, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class _RedirectRecorder(urllib.request.HTTPRedirectHandler):
+    """Keeps the Hugging Face X-Linked-Etag (the LFS sha256) seen on redirects"""
+
+    def __init__(self):
+        self.linked_etag = None
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        etag = headers.get('X-Linked-Etag')
+        if etag:
+            self.linked_etag = etag
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def _sha256_etag(value):
+    value = (value or '').strip().strip('"')
+    if value.startswith('W/'):
+        return None
+    return value.lower() if re.fullmatch(r'[0-9a-fA-F]{64}', value) else None
+
+
+class Downloader:
+    """One resumable download of url to dest
+
+    progress(event) is called at most every PROGRESS_INTERVAL seconds with
+    a dict: phase, downloaded, total, percent, rate (bytes/s), eta (s).
+    verify(path) may check the finished .part before it is moved into
+    place and returns (ok, message).
+    """
+
+    def __init__(self, url, dest, connections=4, rate_limit=0, sha256=None,
+                 progress=None, verify=None, chunk_size=CHUNK_SIZE, timeout=30):
+        self.url = url
+        self.dest = dest
+        self.part = dest + '.part'
+        self.state_path = dest + '.part.json'
+        self.lock_path = dest + '.part.lock'
+        self.connections = max(1, int(connections))
+        self.limiter = RateLimiter(rate_limit)
+        self.expected = sha256.lower() if sha256 else None
+        self.progress = progress
+        self.verify = verify
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+        self.redirects = _RedirectRecorder()
+        self.opener = urllib.request.build_opener(self.redirects)
+
+        self.total = 0
+        self.ranges = False
+        self.etag = None
+        self.done = set()
+        self.downloaded = 0
+        self.resumed = 0
+        self.lock = threading.Lock()
+        self.hash_lock = threading.Lock()
+        self.hasher = hashlib.sha256()
+        self.hashed = 0     # Chunks [0, hashed) are in self.hasher
+        self.fd = None
+        self.started = 0
+        self.last_report = 0
+
+    def _open(self, headers=None):
+        request = urllib.request.Request(self.url, headers=dict({'User-Agent': USER_AGENT}, **(headers or {})))
+        return self.opener.open(request, timeout=self.timeout)
+
+    def probe(self):
+        """Learn size, range support and any published checksum"""
+        with self._open({'Range': 'bytes=0-0'}) as resp:
+            content_range = resp.headers.get('Content-Range', '')
+            match = re.match(r'bytes \d+-\d+/(\d+)', content_range)
+            if resp.status == 206 and match:
+                self.total = int(match.group(1))
+                self.ranges = True
+            else:
+                self.total = int(resp.headers.get('Content-Length') or 0)
+            self.etag = resp.headers.get('ETag')
+            if not self.expected:
+                self.expected = (_sha256_etag(resp.headers.get('X-Linked-Etag')) or
+                                 _sha256_etag(self.redirects.linked_etag))
+
+    @property
+    def chunks(self):
+        return max(1, -(-self.total // self.chunk_size))
+
+    def _chunk_bounds(self, index):
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, self.total) - 1
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            part_size = os.path.getsize(self.part)
+        except (OSError, ValueError):
+            return False
+        if (state.get('url') != self.url or state.get('size') != self.total or
+                state.get('chunk_size') != self.chunk_size or state.get('etag') != self.etag or
+                part_size != self.total):
+            return False
+        self.done = {i for i in state.get('done', []) if 0 <= i < self.chunks}
+        return True
+
+    def _save_state(self):
+        state = {
+            'url': self.url, 'size': self.total, 'chunk_size': self.chunk_size,
+            'etag': self.etag, 'sha256': self.expected, 'done': sorted(self.done),
+        }
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+    def _remove_partial(self):
+        for path in (self.part, self.state_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _report(self, phase, force=False):
+        if not self.progress:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_report < PROGRESS_INTERVAL:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        rate = (self.downloaded - self.resumed) / elapsed
+        remaining = max(self.total - self.downloaded, 0)
+        self.progress({
+            'phase': phase,
+            'downloaded': self.downloaded,
+            'total': self.total,
+            'percent': round(100 * self.downloaded / self.total, 1) if self.total else None,
+            'rate': int(rate),
+            'eta': int(remaining / rate) if rate > 0 and self.total else None,
+        })
+
+    def _add_progress(self, amount):
+        with self.lock:
+            self.downloaded += amount
+            self._report('download')
+
+    def _advance_hash(self):
+        """Hash every chunk of the complete prefix not hashed yet"""
+        with self.hash_lock:
+            while self.hashed < self.chunks and self.hashed in self.done:
+                start, end = self._chunk_bounds(self.hashed)
+                pos = start
+                while pos <= end:
+                    data = os.pread(self.fd, min(1024 * 1024, end + 1 - pos), pos)
+                    if not data:
+                        raise DownloadError('partial file shrank while hashing')
+                    self.hasher.update(data)
+                    pos += len(data)
+                self.hashed += 1
+
+    def _fetch_chunk(self, index):
+        start, end = self._chunk_bounds(index)
+        for attempt in range(RETRIES):
+            pos = start
+            try:
+                with self._open({'Range': f'bytes={start}-{end}'}) as resp:
+                    if resp.status != 206:
+                        raise DownloadError(f'server ignored range request (HTTP {resp.status})')
+                    while pos <= end:
+                        if self.cancelled.is_set():
+                            raise DownloadError('cancelled')
+                        data = resp.read(min(READ_BLOCK, end + 1 - pos))
+                        if not data:
+                            raise ConnectionError('connection closed early')
+                        self.limiter.consume(len(data))
+                        os.pwrite(self.fd, data, pos)
+                        pos += len(data)
+                        self._add_progress(len(data))
+                break
+            except (OSError, urllib.error.URLError, http.client.HTTPException) as e:
+                self._add_progress(start - pos)
+                if attempt == RETRIES - 1 or self.cancelled.is_set():
+                    raise DownloadError(f'chunk {index} failed: {e}') from e
+                time.sleep(min(2 ** attempt, 10))
+            except DownloadError:
+                self._add_progress(start - pos)
+                raise
+        with self.lock:
+            self.done.add(index)
+            self._save_state()
+        self._advance_hash()
+
+    def _worker(self, pending, errors):
+        while not errors and not self.cancelled.is_set():
+            with self.lock:
+                if not pending:
+                    return
+                index = pending.pop()
+            try:
+                self._fetch_chunk(index)
+            except Exception as e:
+                errors.append(e)
+                self.cancelled.set()
+
+    def _download_ranged(self):
+        if not self._load_state():
+            self._remove_partial()
+            self.done = set()
+        self.fd = os.open(self.part, os.O_RDWR | os.O_CREAT, 0o644)
+        if not self.done:
+            try:
+                os.posix_fallocate(self.fd, 0, self.total)
+            except (AttributeError, OSError):
+                os.ftruncate(self.fd, self.total)
+            self._save_state()
+        self.downloaded = self.resumed = sum(
+            self._chunk_bounds(i)[1] - self._chunk_bounds(i)[0] + 1 for i in self.done)
+        self._advance_hash()
+
+        # Popped from the end: lowest offsets first, so hashing keeps up
+        pending = sorted((i for i in range(self.chunks) if i not in self.done), reverse=True)
+        errors = []
+        workers = [threading.Thread(target=self._worker, args=(pending, errors), daemon=True)
+                   for _ in range(min(self.connections, len(pending)))]
+        for t in workers:
+            t.start()
+        try:
+            for t in workers:
+                t.join()
+        except KeyboardInterrupt:
+            # Let in-flight chunks stop before the file is closed
+            self.cancel()
+            for t in workers:
+                t.join()
+            raise
+        if errors:
+            raise errors[0] if isinstance(errors[0], DownloadError) else DownloadError(str(errors[0]))
+        if self.cancelled.is_set():
+            raise DownloadError('cancelled')
+
+    def _download_stream(self):
+        """Single connection for servers without range support (no resume)"""
+        self._remove_partial()
+        self.fd = os.open(self.part, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        with self._open() as resp:
+            while True:
+                if self.cancelled.is_set():
+                    raise DownloadError('cancelled')
+                data = resp.read(READ_BLOCK)
+                if not data:
+                    break
+                self.limiter.consume(len(data))
+                os.write(self.fd, data)
+                self.hasher.update(data)
+                self._add_progress(len(data))
+        if self.total and self.downloaded != self.total:
+            raise DownloadError(f'incomplete download: {self.downloaded} of {self.total} bytes')
+        self.total = self.downloaded
+
+    def cancel(self):
+        """Stop soon; finished chunks stay recorded for a later resume"""
+        self.cancelled.set()
+
+    def run(self):
+        """Download, check and move into place; returns a result dict"""
+        # One writer per file across processes (API server and `pai install`)
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                # The previous holder unlinks the file when done; a lock on
+                # that old inode does not count
+                if os.fstat(lock_file.fileno()).st_ino != os.stat(self.lock_path).st_ino:
+                    raise BlockingIOError
+            except (BlockingIOError, FileNotFoundError):
+                raise DownloadError(f'{os.path.basename(self.dest)} is already being downloaded')
+            try:
+                return self._run()
+            finally:
+                try:
+                    os.unlink(self.lock_path)
+                except FileNotFoundError:
+                    pass
+
+    def _run(self):
+        self.started = time.monotonic()
+        try:
+            self.probe()
+            if self.ranges and self.total > 0:
+                self._download_ranged()
+            else:
+                self._download_stream()
+            os.fsync(self.fd)
+        except (OSError, urllib.error.URLError, http.client.HTTPException) as e:
+            raise DownloadError(str(e)) from e
+        finally:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        self._report('verify', force=True)
+
+        sha256 = self.hasher.hexdigest()
+        if self.expected and sha256 != self.expected:
+            self._remove_partial()
+            raise DownloadError(f'checksum mismatch: expected {self.expected}, got {sha256}')
+        if self.verify:
+            ok, message = self.verify(self.part)
+            if not ok:
+                self._remove_partial()
+                raise DownloadError(f'verification failed: {message}')
+        os.replace(self.part, self.dest)
+        self._remove_partial()
+        self._report('done', force=True)
+        return {
+            'path': self.dest,
+            'size': self.total,
+            'sha256': sha256,
+            'checksum_verified': bool(self.expected),
+            'resumed_bytes': self.resumed,
+            'seconds': round(time.monotonic() - self.started, 3),
+        }
+
+
+def _format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f'{n:.1f}{unit}' if unit != 'B' else f'{n}B'
+        n /= 1024
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Parallel ranged download with resume')
+    parser.add_argument('url')
+    parser.add_argument('dest')
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--limit-rate', default='0')
+    parser.add_argument('--sha256')
+    parser.add_argument('--json', action='store_true', help='progress as JSON lines on stdout')
+    args = parser.parse_args(argv[1:])
+
+    def progress(event):
+        if args.json:
+            print(json.dumps(event), flush=True)
+            return
+        percent = f"{event['percent']:5.1f}%" if event['percent'] is not None else '  ?  '
+        eta = f" ETA {event['eta']}s" if event['eta'] is not None else ''
+        sys.stderr.write(f"\r  {percent} {_format_bytes(event['downloaded'])}/{_format_bytes(event['total'])}"
+                         f" {_format_bytes(event['rate'])}/s{eta}   ")
+        sys.stderr.flush()
+
+    try:
+        downloader = Downloader(args.url, args.dest, args.connections, parse_rate(args.limit_rate),
+                                args.sha256, progress)
+        result = downloader.run()
+    except KeyboardInterrupt:
+        sys.stderr.write('\nInterrupted; run again to resume\n')
+        return 130
+    except (DownloadError, ValueError) as e:
+        sys.stderr.write(f'\nDownload failed: {e}\n')
+        return 1
+    if args.json:
+        print(json.dumps(dict(result, phase='result')), flush=True)
+    else:
+        sys.stderr.write('\n')
+        checked = ' (checksum verified)' if result['checksum_verified'] else ''
+        print(f"sha256 {result['sha256']}{checked}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+PocketAI GGUF reader - header, metadata and tensor bounds via mmap
+
+Only the header, the key/value metadata and the tensor info table are read,
+so inspecting a multi-GB model costs a few page faults instead of a model
+load. A file is intact when every tensor's data lies inside the file; a
+partial download fails that check even when the header survived. The deep
+check additionally hashes the tensor data, streamed in chunks.
+
+Usage:
+  gguf.py info <file.gguf>                       # metadata summary as JSON
+  gguf.py verify <file.gguf> [quick|full|deep]   # exit 0 if the file is intact
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+MAGIC = b'GGUF'
+DEFAULT_ALIGNMENT = 32
+HASH_CHUNK = 4 * 1024 * 1024
+
+# Metadata value types
+UINT8, INT8, UINT16, INT16, UINT32, INT32, FLOAT32, BOOL, STRING, ARRAY, UINT64, INT64, FLOAT64 = range(13)
+
+_SCALARS = {
+    UINT8: struct.Struct('<B'), INT8: struct.Struct('<b'),
+    UINT16: struct.Struct('<H'), INT16: struct.Struct('<h'),
+    UINT32: struct.Struct('<I'), INT32: struct.Struct('<i'),
+    FLOAT32: struct.Struct('<f'), BOOL: struct.Struct('<?'),
+    UINT64: struct.Struct('<Q'), INT64: struct.Struct('<q'),
+    FLOAT64: struct.Struct('<d'),
+}
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+
+# ggml tensor type -> (name, elements per block, bytes per block)
+TENSOR_TYPES = {
+    0: ('F32', 1, 4), 1: ('F16', 1, 2), 2: ('Q4_0', 32, 18), 3: ('Q4_1', 32, 20),
+    6: ('Q5_0', 32, 22), 7: ('Q5_1', 32, 24), 8: ('Q8_0', 32, 34), 9: ('Q8_1', 32, 36),
+    10: ('Q2_K', 256, 84), 11: ('Q3_K', 256, 110), 12: ('Q4_K', 256, 144),
+    13: ('Q5_K', 256, 176), 14: ('Q6_K', 256, 210), 15: ('Q8_K', 256, 292),
+    16: ('IQ2_XXS', 256, 66), 17: ('IQ2_XS', 256, 74), 18: ('IQ3_XXS', 256, 98),
+    19: ('IQ1_S', 256, 50), 20: ('IQ4_NL', 32, 18), 21: ('IQ3_S', 256, 110),
+    22: ('IQ2_S', 256, 82), 23: ('IQ4_XS', 256, 136), 24: ('I8', 1, 1),
+    25: ('I16', 1, 2), 26: ('I32', 1, 4), 27: ('I64', 1, 8), 28: ('F64', 1, 8),
+    29: ('IQ1_M', 256, 56), 30: ('BF16', 1, 2), 31: ('Q4_0_4_4', 32, 18),
+    32: ('Q4_0_4_8', 32, 18), 33: ('Q4_0_8_8', 32, 18), 34: ('TQ1_0', 256, 54),
+    35: ('TQ2_0', 256, 66), 39: ('MXFP4', 32, 17),
+}
+
+# general.file_type -> quantization name (llama_ftype)
+FILE_TYPES = {
+    0: 'F32', 1: 'F16', 2: 'Q4_0', 3: 'Q4_1', 7: 'Q8_0', 8: 'Q5_0', 9: 'Q5_1',
+    10: 'Q2_K', 11: 'Q3_K_S', 12: 'Q3_K_M', 13: 'Q3_K_L', 14: 'Q4_K_S', 15: 'Q4_K_M',
+    16: 'Q5_K_S', 17: 'Q5_K_M', 18: 'Q6_K', 19: 'IQ2_XXS', 20: 'IQ2_XS', 21: 'Q2_K_S',
+    22: 'IQ3_XS', 23: 'IQ3_XXS', 24: 'IQ1_S', 25: 'IQ4_NL', 26: 'IQ3_S', 27: 'IQ3_M',
+    28: 'IQ2_S', 29: 'IQ2_M', 30: 'IQ4_XS', 31: 'IQ1_M', 32: 'BF16', 36: 'TQ1_0',
+    37: 'TQ2_0', 38: 'MXFP4_MOE',
+}
+
+
+class GGUFError(ValueError):
+    """File is not a readable GGUF model (bad magic, truncated, corrupted)"""
+
+
+class _Reader:
+    """Bounds-checked little-endian cursor over a buffer"""
+
+    def __init__(self, buf, version):
+        self.buf = buf
+        self.pos = 0
+        self.version = version
+
+    def unpack(self, fmt):
+        end = self.pos + fmt.size
+        if end > len(self.buf):
+            raise GGUFError(f'truncated: header ends past {len(self.buf)} bytes')
+        value = fmt.unpack_from(self.buf, self.pos)[0]
+        self.pos = end
+        return value
+
+    def count(self):
+        # Version 1 used 32-bit counts and lengths
+        return self.unpack(_U32 if self.version == 1 else _U64)
+
+    def skip(self, size):
+        if self.pos + size > len(self.buf):
+            raise GGUFError(f'truncated: header ends past {len(self.buf)} bytes')
+        self.pos += size
+
+    def skip_strings(self, count):
+        # Hot loop for vocabularies: only the length prefixes are read
+        size_fmt = _U32 if self.version == 1 else _U64
+        unpack, width, buf, pos = size_fmt.unpack_from, size_fmt.size, self.buf, self.pos
+        limit = len(buf) - width
+        for _ in range(count):
+            if pos > limit:
+                raise GGUFError(f'truncated: header ends past {len(buf)} bytes')
+            pos += width + unpack(buf, pos)[0]
+        self.pos = pos
+        if pos > len(buf):
+            raise GGUFError(f'truncated: header ends past {len(buf)} bytes')
+
+    def string(self):
+        length = self.count()
+        start = self.pos
+        self.skip(length)
+        return bytes(self.buf[start:self.pos]).decode('utf-8', errors='replace')
+
+    def value(self, vtype, keep_array=False):
+        if vtype in _SCALARS:
+            return self.unpack(_SCALARS[vtype])
+        if vtype == STRING:
+            return self.string()
+        if vtype == ARRAY:
+            item_type = self.unpack(_U32)
+            length = self.count()
+            if keep_array:
+                return [self.value(item_type) for _ in range(length)]
+            # Summarize instead of materializing (token lists have ~150k entries)
+            if item_type in _SCALARS:
+                self.skip(_SCALARS[item_type].size * length)
+            elif item_type == STRING:
+                self.skip_strings(length)
+            else:
+                for _ in range(length):
+                    self.value(item_type)
+            return {'type': 'array', 'length': length}
+        raise GGUFError(f'corrupted: unknown metadata value type {vtype}')
+
+
+def _format_params(count):
+    if count >= 1e9:
+        return f'{count / 1e9:.1f}B'
+    if count >= 1e6:
+        return f'{count / 1e6:.0f}M'
+    return f'{count / 1e3:.0f}K'
+
+
+def _parse(buf, file_size, tensors=True, keep_arrays=()):
+    if len(buf) < 8 or bytes(buf[:4]) != MAGIC:
+        raise GGUFError('not a GGUF file (bad magic)')
+    version = _U32.unpack_from(buf, 4)[0]
+    if version not in (1, 2, 3):
+        raise GGUFError(f'unsupported GGUF version {version}')
+    r = _Reader(buf, version)
+    r.pos = 8
+    tensor_count = r.count()
+    kv_count = r.count()
+    # Every entry needs at least a few bytes; absurd counts mean garbage
+    if tensor_count > file_size or kv_count > file_size:
+        raise GGUFError('corrupted: impossible tensor or metadata count')
+
+    info = {'version': version, 'tensor_count': tensor_count, 'kv_count': kv_count,
+            'file_size': file_size}
+    if not tensors:
+        return info
+
+    metadata = {}
+    for _ in range(kv_count):
+        key = r.string()
+        metadata[key] = r.value(r.unpack(_U32), key in keep_arrays)
+
+    alignment = metadata.get('general.alignment', DEFAULT_ALIGNMENT)
+    if not isinstance(alignment, int) or alignment <= 0:
+        raise GGUFError(f'corrupted: bad alignment {alignment!r}')
+
+    tensor_infos = []
+    for _ in range(tensor_count):
+        name = r.string()
+        n_dims = r.unpack(_U32)
+        if n_dims > 8:
+            raise GGUFError(f'corrupted: tensor {name!r} has {n_dims} dimensions')
+        dims = [r.count() for _ in range(n_dims)]
+        tensor_infos.append((name, dims, r.unpack(_U32), r.unpack(_U64)))
+
+    data_offset = (r.pos + alignment - 1) // alignment * alignment
+    parameters = 0
+    data_end = data_offset
+    type_bytes = {}
+    for name, dims, ttype, offset in tensor_infos:
+        elements = 1
+        for d in dims:
+            elements *= d
+        parameters += elements
+        if offset % alignment:
+            raise GGUFError(f'corrupted: tensor {name!r} offset {offset} is not {alignment}-byte aligned')
+        end = data_offset + offset
+        if ttype in TENSOR_TYPES:
+            type_name, block, block_bytes = TENSOR_TYPES[ttype]
+            nbytes = (elements + block - 1) // block * block_bytes
+            end += nbytes
+            type_bytes[type_name] = type_bytes.get(type_name, 0) + nbytes
+        if end > file_size:
+            raise GGUFError(f'truncated: tensor {name!r} ends at byte {end}, file has {file_size}')
+        data_end = max(data_end, end)
+
+    arch = metadata.get('general.architecture', '')
+    file_type = metadata.get('general.file_type')
+    if file_type in FILE_TYPES:
+        quantization = FILE_TYPES[file_type]
+    elif type_bytes:
+        # Older files lack general.file_type: name it after the dominant tensor type
+        quantization = max(type_bytes, key=type_bytes.get)
+    else:
+        quantization = ''
+
+    info.update({
+        'architecture': arch,
+        'name': metadata.get('general.name', ''),
+        'quantization': quantization,
+        'context_length': metadata.get(f'{arch}.context_length'),
+        'parameters': parameters,
+        'parameters_label': _format_params(parameters) if parameters else '',
+        'alignment': alignment,
+        'data_offset': data_offset,
+        'data_end': data_end,
+        'metadata': metadata,
+    })
+    return info
+
+
+def read_gguf(path, tensors=True, keep_arrays=()):
+    """Parse a GGUF file's header (and metadata + tensor table unless tensors=False)
+
+    Array values are summarized as {'type': 'array', 'length': n} unless their
+    key is listed in keep_arrays. Raises GGUFError for invalid or truncated
+    files and OSError if the file cannot be opened.
+    """
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size == 0:
+            raise GGUFError('empty file')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            # memoryview slices keep string reads from copying the whole map
+            view = memoryview(buf)
+            try:
+                return _parse(view, file_size, tensors, keep_arrays)
+            finally:
+                view.release()
+
+
+def tensor_sha256(path, info=None, chunk_size=HASH_CHUNK):
+    """sha256 hex of the tensor data region, read sequentially in chunks"""
+    if info is None:
+        info = read_gguf(path)
+    start, end = info['data_offset'], info['data_end']
+    digest = hashlib.sha256()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), start, end - start, os.POSIX_FADV_SEQUENTIAL)
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            n = f.readinto(view[:min(chunk_size, remaining)])
+            if not n:
+                raise GGUFError(f'truncated: tensor data ends at byte {end - remaining}, expected {end}')
+            digest.update(view[:n])
+            remaining -= n
+    return digest.hexdigest()
+
+
+def verify_gguf(path, mode='quick'):
+    """(ok, message) for a model file
+
+    quick checks the header, full also the tensor table and bounds, deep also
+    reads and hashes all tensor data.
+    """
+    try:
+        info = read_gguf(path, tensors=(mode != 'quick'))
+        digest = tensor_sha256(path, info) if mode == 'deep' else None
+    except (GGUFError, OSError) as e:
+        return False, str(e)
+    if mode == 'quick':
+        return True, f"GGUF v{info['version']}, {info['tensor_count']} tensors"
+    message = (f"GGUF v{info['version']} {info['architecture'] or '?'} "
+               f"{info['quantization'] or '?'}, {info['tensor_count']} tensors in bounds")
+    if digest:
+        message += f", tensor data sha256 {digest}"
+    return True, message
+
+
+_summary_cache = {}  # path -> ((size, mtime_ns, inode), summary)
+_summary_lock = threading.Lock()
+
+
+def model_summary(path):
+    """Listing-friendly metadata for a model, cached until the file changes
+
+    Never raises: unreadable files get {'valid': False, 'error': ...}.
+    """
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        return {'valid': False, 'error': str(e)}
+    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+    with _summary_lock:
+        cached = _summary_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    try:
+        info = read_gguf(path)
+        summary = {
+            'valid': True,
+            'architecture': info['architecture'],
+            'quantization': info['quantization'],
+            'context_length': info['context_length'],
+            'parameters': info['parameters'],
+            'parameters_label': info['parameters_label'],
+            'tensor_count': info['tensor_count'],
+            'gguf_version': info['version'],
+        }
+    except (GGUFError, OSError) as e:
+        summary = {'valid': False, 'error': str(e)}
+    with _summary_lock:
+        _summary_cache[path] = (key, summary)
+    return summary
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ('info', 'verify'):
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    path = argv[2]
+    if argv[1] == 'info':
+        try:
+            info = read_gguf(path)
+        except (GGUFError, OSError) as e:
+            print(f'Error: {e}', file=sys.stderr)
+            return 1
+        print(json.dumps(info, indent=2, default=str))
+        return 0
+    mode = argv[3] if len(argv) > 3 else 'quick'
+    ok, message = verify_gguf(path, mode)
+    print(message, file=sys.stdout if ok else sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+PocketAI resource governor - memory, pressure and heat checks before work starts
+
+A background thread samples the device every few seconds: MemTotal and
+MemAvailable from <proc>/meminfo, pressure stall information from
+<proc>/pressure/{memory,cpu,io} (kernels with PSI), the load average from
+<proc>/loadavg and the hottest zone under <thermal>/thermal_zone*/temp.
+Each resource gets a level from the sample:
+
+  ok        nothing to do
+  elevated  new generations run with fewer threads (cpu, thermal) or a
+            smaller context (memory)
+  critical  as elevated, only more so; on top of that models are not
+            loaded under memory pressure, and nothing starts while the
+            device is too hot
+
+A generation is admitted when its model is warm (already loaded) or its RAM
+estimate fits in MemAvailable minus a reserve, plus what evicting idle warm
+models would free. Installs are checked against MemTotal: a model the
+device can never hold is refused unless forced. Refusals, installs and
+level changes are kept as decisions for the API.
+
+Paths are constructor arguments, so tests can feed fake /proc and /sys trees.
+"""
+import glob
+import os
+import threading
+import time
+from collections import deque
+
+from warm_pool import MB, read_meminfo
+
+OK, ELEVATED, CRITICAL = 'ok', 'elevated', 'critical'
+LEVELS = (OK, ELEVATED, CRITICAL)
+PSI_RESOURCES = ('memory', 'cpu', 'io')
+MIN_CTX = 512   # smallest context the governor lowers ctx_size to
+FACTOR = {ELEVATED: 2, CRITICAL: 4}  # threads/ctx_size are divided by this
+
+# (elevated, critical) thresholds
+THRESHOLDS = {
+    'available': (0.15, 0.05),   # MemAvailable / MemTotal, at or below
+    'memory_some': (10.0, 40.0),  # % of time some tasks stalled on memory (PSI avg10)
+    'memory_full': (5.0, 20.0),   # % of time all tasks stalled on memory
+    'cpu_some': (60.0, 90.0),     # % of time some tasks waited for a CPU
+    'load': (1.5, 3.0),           # 1-minute load average per CPU
+    'temperature': (70.0, 85.0),  # hottest thermal zone, degrees C
+}
+
+
+def read_pressure(path):
+    """PSI file as {'some': {'avg10': .., 'avg60': .., 'avg300': .., 'total': ..}, 'full': {..}}; {} if missing"""
+    pressure = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                kind, _, rest = line.partition(' ')
+                values = {}
+                for field in rest.split():
+                    name, _, value = field.partition('=')
+                    try:
+                        values[name] = float(value)
+                    except ValueError:
+                        pass
+                if values:
+                    pressure[kind] = values
+    except OSError:
+        pass
+    return pressure
+
+
+def read_loadavg(path):
+    """(1, 5, 15 minute) load averages; None if unreadable"""
+    try:
+        with open(path) as f:
+            return tuple(float(value) for value in f.read().split()[:3])
+    except (OSError, ValueError):
+        return None
+
+
+def read_temperature(thermal_root):
+    """Hottest thermal zone in degrees C; None without a readable zone"""
+    hottest = None
+    for path in glob.glob(os.path.join(thermal_root, 'thermal_zone*', 'temp')):
+        try:
+            with open(path) as f:
+                value = int(f.read().strip()) / 1000  # millidegrees
+        except (OSError, ValueError):
+            continue
+        if value > 0 and (hottest is None or value > hottest):
+            hottest = value
+    return hottest
+
+
+def worst(*levels):
+    return max(levels, key=LEVELS.index)
+
+
+def mb(size):
+    return round(size / MB) if size is not None else None
+
+
+class Governor:
+    """Samples device pressure and decides what may start; thread-safe"""
+
+    def __init__(self, proc_root='/proc', thermal_root='/sys/class/thermal', reserve=256 * MB,
+                 cpus=None, thresholds=None, history=50):
+        self.proc_root = proc_root
+        self.thermal_root = thermal_root
+        self.reserve = reserve
+        self.cpus = cpus or os.cpu_count() or 1
+        self.thresholds = dict(THRESHOLDS, **(thresholds or {}))
+        self.sample = None
+        self.samples = 0
+        self.interval = None
+        self.decisions = deque(maxlen=history)  # refusals, installs and level changes, oldest first
+        self.counts = {}                        # action -> count
+        self.throttle = None                    # last lowered (threads, ctx_size)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, interval=2.0):
+        """Sample every `interval` seconds on a daemon thread"""
+        self.interval = interval
+        self.read()
+        self.thread = threading.Thread(target=self._run, name='pocketai-governor', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.read()
+            except Exception:
+                pass  # a bad sample keeps the previous one
+
+    def read(self):
+        """Take a sample now; returns it"""
+        meminfo = read_meminfo(os.path.join(self.proc_root, 'meminfo'))
+        sample = {
+            'time': time.time(),
+            'mem_total': meminfo.get('MemTotal'),
+            'mem_available': meminfo.get('MemAvailable'),
+            'pressure': {resource: read_pressure(os.path.join(self.proc_root, 'pressure', resource))
+                         for resource in PSI_RESOURCES},
+            'load': read_loadavg(os.path.join(self.proc_root, 'loadavg')),
+            'temperature': read_temperature(self.thermal_root) if self.thermal_root else None,
+        }
+        sample['levels'], sample['reasons'] = self.assess(sample)
+        sample['level'] = worst(*sample['levels'].values())
+        with self.lock:
+            previous = self.sample
+            self.sample = sample
+            self.samples += 1
+        if previous is not None and previous['level'] != sample['level']:
+            self.record('level', f"{previous['level']} -> {sample['level']}", reasons=sample['reasons'])
+        return sample
+
+    def current(self):
+        """Latest sample (read now when the sampler isn't running)"""
+        with self.lock:
+            sample = self.sample
+        if sample is None or (self.thread is None and time.time() - sample['time'] >= 1):
+            sample = self.read()
+        return sample
+
+    def assess(self, sample):
+        """Level per resource (memory, cpu, thermal) and the reasons for anything above ok"""
+        levels = {'memory': OK, 'cpu': OK, 'thermal': OK}
+        reasons = []
+
+        def check(resource, name, value, text, lower=False):
+            if value is None:
+                return
+            elevated, critical = self.thresholds[name]
+            hit = (lambda limit: value <= limit) if lower else (lambda limit: value >= limit)
+            level = CRITICAL if hit(critical) else ELEVATED if hit(elevated) else OK
+            if level != OK:
+                levels[resource] = worst(levels[resource], level)
+                reasons.append(f"{text} ({level})")
+
+        total, available = sample['mem_total'], sample['mem_available']
+        if total and available is not None:
+            share = available / total
+            check('memory', 'available', share, f"{share:.0%} of memory available", lower=True)
+        pressure = sample['pressure']
+        memory_some = pressure['memory'].get('some', {}).get('avg10')
+        memory_full = pressure['memory'].get('full', {}).get('avg10')
+        cpu_some = pressure['cpu'].get('some', {}).get('avg10')
+        check('memory', 'memory_some', memory_some, f"memory pressure {memory_some}%")
+        check('memory', 'memory_full', memory_full, f"memory stalls {memory_full}%")
+        check('cpu', 'cpu_some', cpu_some, f"CPU pressure {cpu_some}%")
+        if sample['load'] is not None:
+            load = sample['load'][0] / self.cpus
+            check('cpu', 'load', load, f"load {sample['load'][0]:.2f} on {self.cpus} CPUs")
+        temperature = sample['temperature']
+        check('thermal', 'temperature', temperature, f"{temperature}°C")
+        return levels, reasons
+
+    def record(self, action, message, **fields):
+        decision = dict(time=round(time.time(), 3), action=action, message=message, **fields)
+        with self.lock:
+            self.counts[action] = self.counts.get(action, 0) + 1
+            if action != 'admit':
+                self.decisions.append(decision)
+        return decision
+
+    def admit(self, kind, model, ram, warm=False, reclaimable=0):
+        """Decision on starting a generation: {'allowed': bool, 'reason': .., 'message': .., ...}
+
+        ram is the model's estimated need; warm models need no new memory,
+        and reclaimable is what evicting idle warm models would free.
+        """
+        sample = self.current()
+        levels = sample['levels']
+        available = sample['mem_available']
+        fields = {'kind': kind, 'model': model, 'level': sample['level'], 'ram_mb': mb(ram)}
+        if levels['thermal'] == CRITICAL:
+            return self.refuse('thermal', f"Device too hot ({sample['temperature']}°C), try again later", **fields)
+        if not warm and levels['memory'] == CRITICAL:
+            return self.refuse('pressure', f"Memory pressure too high to load {model}: "
+                                           f"{'; '.join(sample['reasons'])}", **fields)
+        if not warm and available is not None:
+            room = available + reclaimable - self.reserve
+            if ram > room:
+                return self.refuse('memory', f"Not enough memory for {model}: needs ~{mb(ram)}MB, "
+                                             f"{max(0, mb(room))}MB available", available_mb=mb(available), **fields)
+        return self.record('admit', f"{kind} on {model}", allowed=True, reason='ok', **fields)
+
+    def refuse(self, reason, message, **fields):
+        return self.record('refuse', message, allowed=False, reason=reason, **fields)
+
+    def admit_install(self, model, ram, force=False):
+        """Decision on installing a catalog model needing `ram` bytes (None if unknown)"""
+        total = self.current()['mem_total']
+        fields = {'kind': 'install', 'model': model, 'ram_mb': mb(ram), 'total_mb': mb(total)}
+        if ram and total and ram > total:
+            message = f"{model} needs ~{mb(ram)}MB of RAM, this device has {mb(total)}MB"
+            if not force:
+                return self.refuse('device', f"{message} (install with force to override)", **fields)
+            return self.record('install', f"{message} (forced)", allowed=True, reason='forced', **fields)
+        return self.record('install', f"Installing {model}", allowed=True, reason='ok', **fields)
+
+    def limits(self, threads, ctx_size):
+        """threads and ctx_size (as given, strings or ints) lowered for the current levels"""
+        levels = self.current()['levels']
+        try:
+            configured = (int(threads), int(ctx_size))
+        except (TypeError, ValueError):
+            return threads, ctx_size
+        new_threads, new_ctx = configured
+        cpu = worst(levels['cpu'], levels['thermal'])
+        if cpu != OK:
+            new_threads = max(1, new_threads // FACTOR[cpu])
+        if levels['memory'] != OK:
+            new_ctx = min(new_ctx, max(MIN_CTX, new_ctx // FACTOR[levels['memory']]))
+        if (new_threads, new_ctx) == configured:
+            return threads, ctx_size
+        with self.lock:
+            self.counts['throttle'] = self.counts.get('throttle', 0) + 1
+            self.throttle = {'time': round(time.time(), 3), 'threads': new_threads, 'ctx_size': new_ctx,
+                             'configured': {'threads': configured[0], 'ctx_size': configured[1]},
+                             'levels': dict(levels)}
+        return type(threads)(new_threads), type(ctx_size)(new_ctx)
+
+    def snapshot(self):
+        sample = self.current()
+        pressure = {resource: {kind: values.get('avg10') for kind, values in psi.items()}
+                    for resource, psi in sample['pressure'].items() if psi}
+        with self.lock:
+            return {
+                'level': sample['level'],
+                'levels': dict(sample['levels']),
+                'reasons': list(sample['reasons']),
+                'mem_total_mb': mb(sample['mem_total']),
+                'mem_available_mb': mb(sample['mem_available']),
+                'reserve_mb': mb(self.reserve),
+                'pressure_avg10': pressure,
+                'load': sample['load'],
+                'cpus': self.cpus,
+                'temperature': sample['temperature'],
+                'samples': self.samples,
+                'interval': self.interval,
+                'counts': dict(self.counts),
+                'throttle': self.throttle,
+                'decisions': list(self.decisions),
+            }
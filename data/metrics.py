@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+PocketAI metrics - counters and fixed-bucket histograms in Prometheus text format
+
+Updates take one short per-metric lock (a bisect plus a few additions), so
+they are cheap enough for the streaming hot path. Gauges are read from a
+callback when /api/metrics is scraped instead of being updated in place.
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; wide enough for a proot cold start or a long generation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {} if labelnames else {(): 0}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        return self.values.get(key, 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.name, _labels(self.labelnames, key), value
+
+
+class Gauge:
+    """Value computed at scrape time
+
+    fn returns a number, or a dict mapping label value tuples to numbers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                yield self.name, _labels(self.labelnames, key), v
+        else:
+            yield self.name, '', value
+
+
+class CounterFunc(Gauge):
+    """Counter read from existing state at scrape time"""
+    kind = 'counter'
+
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self.series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        bounds = self.buckets + (float('inf'),)
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _labels(self.labelnames, key, f'le="{_number(float(bound))}"'), cumulative)
+            yield f'{self.name}_sum', _labels(self.labelnames, key), series[-1]
+            yield f'{self.name}_count', _labels(self.labelnames, key), cumulative
+
+
+class Registry:
+    """Ordered set of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, fn, labelnames=()):
+        return self.register(Gauge(name, help, fn, labelnames))
+
+    def counter_func(self, name, help, fn, labelnames=()):
+        return self.register(CounterFunc(name, help, fn, labelnames))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self.register(Histogram(name, help, buckets, labelnames))
+
+    def render(self):
+        """Prometheus text exposition of every registered metric"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            try:
+                for name, labels, value in metric.samples():
+                    lines.append(f'{name}{labels} {_number(value)}')
+            except Exception:
+                continue  # A failing gauge callback must not break the scrape
+        return '\n'.join(lines) + '\n'
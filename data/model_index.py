@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+PocketAI model index - installed GGUF files kept in memory
+
+The models directory is scanned once and then only rescanned when it
+changes: inotify events where the kernel supports them, otherwise the
+directory's mtime (one stat per lookup). Entries keep (size, mtime, inode)
+so unchanged files reuse their parsed metadata across rescans.
+"""
+import bisect
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+
+import gguf
+
+# inotify flags (linux/inotify.h)
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_IGNORED = 0x8000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+def _inotify_watch(path):
+    """Non-blocking inotify fd watching path, or None if unavailable"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class ModelIndex:
+    """Thread-safe index of *.gguf files with exact and prefix lookup"""
+
+    def __init__(self, models_dir, use_inotify=True):
+        self.models_dir = models_dir
+        self.use_inotify = use_inotify
+        self.entries = {}   # filename -> entry dict
+        self.names = []     # sorted (lowercase name, name) for prefix lookup
+        self.scans = 0
+        self.lock = threading.Lock()
+        self._fd = None
+        self._dir_mtime = None
+        self._dirty = True
+
+    @property
+    def mode(self):
+        return 'inotify' if self._fd is not None else 'mtime'
+
+    def invalidate(self):
+        """Force a rescan on the next lookup (after install/remove)"""
+        with self.lock:
+            self._dirty = True
+
+    def _drain(self):
+        """Consume pending inotify events; True if anything changed"""
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return changed
+            except OSError:
+                data = b''
+            if not data:
+                # Watch is broken; fall back to mtime checks
+                os.close(self._fd)
+                self._fd = None
+                return True
+            changed = True
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size + length
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    os.close(self._fd)
+                    self._fd = None
+                    return True
+
+    def _changed(self):
+        if self._dirty:
+            return True
+        if self._fd is not None:
+            return self._drain()
+        try:
+            mtime = os.stat(self.models_dir).st_mtime_ns
+        except OSError:
+            mtime = None
+        return mtime != self._dir_mtime
+
+    def _scan(self):
+        if self.use_inotify and self._fd is None and os.path.isdir(self.models_dir):
+            self._fd = _inotify_watch(self.models_dir)
+        try:
+            self._dir_mtime = os.stat(self.models_dir).st_mtime_ns
+            names = [f for f in os.listdir(self.models_dir) if f.endswith('.gguf')]
+        except OSError:
+            self._dir_mtime = None
+            names = []
+
+        entries = {}
+        for name in names:
+            path = os.path.join(self.models_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_size, st.st_mtime_ns, st.st_ino)
+            old = self.entries.get(name)
+            if old and old['key'] == key:
+                entries[name] = old
+                continue
+            entries[name] = {
+                'name': name,
+                'path': path,
+                'size': st.st_size,
+                'key': key,
+                'meta': gguf.model_summary(path),
+            }
+        self.entries = entries
+        self.names = sorted((name.lower(), name) for name in entries)
+        self.scans += 1
+        self._dirty = False
+
+    def refresh(self):
+        """Apply pending filesystem changes; True if the index was rebuilt"""
+        with self.lock:
+            if not self._changed():
+                return False
+            self._scan()
+            return True
+
+    def list(self):
+        """Entries sorted by filename"""
+        self.refresh()
+        with self.lock:
+            return [self.entries[name] for _, name in self.names]
+
+    def get(self, name):
+        """Entry for an exact filename, or None"""
+        self.refresh()
+        with self.lock:
+            return self.entries.get(name)
+
+    def find(self, query):
+        """Best entry for a user-supplied model name, or None
+
+        Tries the exact filename, then with .gguf appended, then a
+        case-insensitive prefix, then a substring match (the old behaviour).
+        """
+        if not query:
+            return None
+        self.refresh()
+        q = query.lower()
+        with self.lock:
+            for name in (query, query + '.gguf'):
+                if name in self.entries:
+                    return self.entries[name]
+            i = bisect.bisect_left(self.names, (q, ''))
+            if i < len(self.names) and self.names[i][0].startswith(q):
+                return self.entries[self.names[i][1]]
+            for lower, name in self.names:
+                if q in lower:
+                    return self.entries[name]
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            return {'models': len(self.entries), 'watch': self.mode, 'scans': self.scans}
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+PocketAI model verification - parallel checks with a persistent result cache
+
+Results are stored in a small JSON file keyed by path and (size, mtime,
+inode), so a model that has not changed since it was last checked is
+reported from the cache without opening it. Files that need checking are
+spread over a process pool. Modes build on each other: quick reads the
+header, full also checks every tensor's bounds, deep also hashes the
+tensor data (streamed) and records the digest; re-running deep with
+--no-cache compares against it to catch data that changed in place.
+
+Usage:
+  model_verify.py [--mode quick|full|deep] [--jobs N] [--cache FILE]
+                  [--no-cache] [--json] <models dir | file.gguf>...
+
+Prints one tab-separated line per model (name, size, OK|CORRUPTED,
+cached|checked, detail) or a JSON list with --json. Exits 1 if any model
+is corrupted.
+"""
+import argparse
+import concurrent.futures
+import fcntl
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import gguf
+
+MODES = ('quick', 'full', 'deep')
+
+
+def file_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def human_size(size):
+    """Size in du -h style (400M, 1.9G)"""
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024 or unit == 'G':
+            return f'{size:.1f}{unit}' if unit == 'G' else f'{size:.0f}{unit}'
+        size /= 1024
+
+
+class VerifyCache:
+    """path -> {'key': [size, mtime_ns, inode], 'results': {mode: [ok, detail]}, 'sha256'}"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = set()
+        self._stamp = None
+
+    def load(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self.entries, self._stamp = {}, None
+            return
+        stamp = (st.st_size, st.st_mtime_ns, st.st_ino)
+        if stamp == self._stamp:
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        self.entries = entries if isinstance(entries, dict) else {}
+        self._stamp = stamp
+
+    def lookup(self, path, key, mode):
+        """Cached (ok, detail) that answers `mode` for this file version, or None
+
+        A pass at a stricter mode answers a looser one, and a failure at a
+        looser mode answers a stricter one.
+        """
+        entry = self.entries.get(path)
+        if not entry or entry.get('key') != key:
+            return None
+        results = entry.get('results', {})
+        level = MODES.index(mode)
+        for m in MODES[level:]:
+            if m in results and results[m][0]:
+                return tuple(results[m])
+        for m in MODES[:level + 1]:
+            if m in results and not results[m][0]:
+                return tuple(results[m])
+        return None
+
+    def previous_sha256(self, path, key):
+        entry = self.entries.get(path)
+        return entry.get('sha256') if entry and entry.get('key') == key else None
+
+    def record(self, path, key, mode, ok, detail, sha256=None):
+        entry = self.entries.get(path)
+        if not entry or entry.get('key') != key:
+            entry = self.entries[path] = {'key': key, 'results': {}}
+        entry['results'][mode] = [ok, detail]
+        entry['checked'] = time.time()
+        if sha256:
+            entry['sha256'] = sha256
+        self.dirty.add(path)
+
+    def save(self):
+        """Merge our new results into the file (under a lock) and replace it atomically"""
+        if not self.dirty:
+            return
+        mine = {path: self.entries[path] for path in self.dirty}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._stamp = None
+            self.load()
+            self.entries.update(mine)
+            # Drop entries for files that no longer exist
+            self.entries = {p: e for p, e in self.entries.items() if os.path.exists(p)}
+            tmp = f'{self.path}.tmp.{os.getpid()}'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        self.dirty.clear()
+
+
+def check_file(path, mode):
+    """Verify one file; runs in a pool worker"""
+    start = time.monotonic()
+    ok, detail = gguf.verify_gguf(path, 'full' if mode == 'deep' else mode)
+    digest = None
+    if ok and mode == 'deep':
+        try:
+            digest = gguf.tensor_sha256(path)
+            detail += f', tensor data sha256 {digest[:16]}'
+        except (gguf.GGUFError, OSError) as e:
+            ok, detail = False, str(e)
+    return {'ok': ok, 'detail': detail, 'sha256': digest, 'seconds': round(time.monotonic() - start, 3)}
+
+
+def verify_models(paths, mode='full', cache=None, jobs=None, use_cache=True, progress=None):
+    """Verify model files; returns one result dict per path, in order
+
+    Files whose cached result still applies are not opened. The rest are
+    checked in a process pool of up to `jobs` workers (inline for one file).
+    `progress` is called with each result as it is ready.
+    """
+    if mode not in MODES:
+        raise ValueError(f'Unknown verify mode: {mode}')
+    if cache is not None:
+        cache.load()
+    results = {}
+    pending = {}  # path -> key
+    for path in paths:
+        result = {'name': os.path.basename(path), 'path': path, 'mode': mode}
+        try:
+            key = file_key(path)
+        except OSError as e:
+            results[path] = dict(result, size=0, ok=False, cached=False, detail=str(e))
+            continue
+        result['size'] = key[0]
+        hit = cache.lookup(path, key, mode) if cache is not None and use_cache else None
+        if hit is not None:
+            results[path] = dict(result, ok=hit[0], detail=hit[1], cached=True)
+            if progress:
+                progress(results[path])
+        else:
+            results[path] = dict(result, cached=False)
+            pending[path] = key
+
+    def done(path, outcome):
+        result = results[path]
+        key = pending[path]
+        previous = cache.previous_sha256(path, key) if cache is not None else None
+        digest = outcome['sha256']
+        if digest and previous and previous != digest:
+            # Same size, mtime and inode but different data: keep the old digest as the reference
+            outcome['ok'] = False
+            outcome['detail'] = (f"tensor data changed since last deep check "
+                                 f"(sha256 {digest[:16]}, was {previous[:16]})")
+            result['sha256'], digest = digest, None
+        elif digest:
+            result['sha256'] = digest
+        result.update(ok=outcome['ok'], detail=outcome['detail'], seconds=outcome['seconds'])
+        if cache is not None:
+            cache.record(path, key, mode, outcome['ok'], outcome['detail'], digest)
+        if progress:
+            progress(result)
+
+    workers = min(len(pending), jobs or os.cpu_count() or 1)
+    if workers <= 1:
+        for path in pending:
+            done(path, check_file(path, mode))
+    else:
+        # Plain fork: the CLI is single-threaded and workers only need gguf
+        context = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as pool:
+            futures = {pool.submit(check_file, path, mode): path for path in pending}
+            for future in concurrent.futures.as_completed(futures):
+                done(futures[future], future.result())
+
+    if cache is not None:
+        try:
+            cache.save()
+        except OSError as e:
+            print(f'Warning: could not save verify cache: {e}', file=sys.stderr)
+    return [results[path] for path in paths]
+
+
+def model_paths(targets):
+    """*.gguf files in the given directories, plus files given directly"""
+    paths = []
+    for target in targets:
+        if os.path.isdir(target):
+            paths.extend(os.path.join(target, f) for f in sorted(os.listdir(target)) if f.endswith('.gguf'))
+        else:
+            paths.append(target)
+    return paths
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Verify GGUF models with a persistent result cache')
+    parser.add_argument('targets', nargs='+', help='models directory or .gguf files')
+    parser.add_argument('--mode', choices=MODES, default='full')
+    parser.add_argument('--jobs', type=int, default=0, help='worker processes (default: CPU count)')
+    parser.add_argument('--cache', default='', help='result cache file (default: none)')
+    parser.add_argument('--no-cache', action='store_true', help='re-check every file (results are still saved)')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    cache = VerifyCache(args.cache) if args.cache else None
+    if args.json:
+        results = verify_models(model_paths(args.targets), args.mode, cache, args.jobs, not args.no_cache)
+        print(json.dumps(results, indent=2))
+    else:
+        def show(result):
+            print('\t'.join((result['name'], human_size(result['size']), 'OK' if result['ok'] else 'CORRUPTED',
+                             'cached' if result['cached'] else 'checked', result['detail'])), flush=True)
+        results = verify_models(model_paths(args.targets), args.mode, cache, args.jobs, not args.no_cache, show)
+    return 0 if all(r['ok'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+PocketAI prompt templates - Python port of the engine.sh template functions
+
+Mirrors get_model_family, build_prompt, build_history_entry, get_model_args
+and get_stop_sequences so the API server can format prompts without forking
+bash. Functions named after their shell counterparts return exactly what the
+shell function prints (including echo's trailing newline).
+"""
+from functools import lru_cache
+
+# =============================================================================
+# Template registry
+# =============================================================================
+# Detection order matters - first match wins (same order as get_model_family)
+FAMILY_PATTERNS = (
+    ('qwen3', ('qwen3',)),
+    ('qwen', ('qwen',)),           # Qwen, Qwen2, Qwen2.5
+    ('smollm', ('smollm',)),
+    ('llama3', ('llama-3', 'llama3')),
+    ('tinyllama', ('tinyllama',)),
+    ('gemma', ('gemma',)),
+    ('phi2', ('phi-2', 'phi2')),
+    ('zephyr', ('stablelm', 'zephyr')),
+)
+DEFAULT_FAMILY = 'chatml'
+
+_CHATML = {
+    'bos': '',
+    'user_open': '<|im_start|>user\n',
+    'user_close': '<|im_end|>\n<|im_start|>assistant\n',
+    'assistant_close': '<|im_end|>\n',
+    'history': True,
+    'system': ('<|im_start|>system\n', '<|im_end|>\n'),
+    'args': '--temp 0.3 --top-k 40 --top-p 0.9 --repeat-penalty 1.1',
+    'stop': ('<|im_end|>', '<|im_start|>', 'User:', 'Human:'),
+}
+
+# A turn is user_open + message + user_close; a history entry appends the
+# response + assistant_close. Prompts start with bos only when history is empty.
+# system is the (open, close) pair around a pinned system block in the history
+# (context_window.py); None where the model has no system role.
+TEMPLATES = {
+    'qwen3': dict(_CHATML, args='--temp 0.7 --top-k 20 --top-p 0.8'),
+    'qwen': _CHATML,
+    'smollm': _CHATML,
+    'llama3': {
+        'bos': '<|begin_of_text|>',
+        'user_open': '<|start_header_id|>user<|end_header_id|>\n\n',
+        'user_close': '<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n',
+        'assistant_close': '<|eot_id|>\n',
+        'history': True,
+        'system': ('<|start_header_id|>system<|end_header_id|>\n\n', '<|eot_id|>\n'),
+        'args': '--temp 0.6 --top-k 40 --top-p 0.9 --repeat-penalty 1.1',
+        'stop': ('<|eot_id|>', '<|start_header_id|>', 'User:', 'Human:'),
+    },
+    'tinyllama': {
+        'bos': '',
+        'user_open': '<|user|>\n',
+        'user_close': '</s>\n<|assistant|>\n',
+        'assistant_close': '</s>\n',
+        'history': True,
+        'system': ('<|system|>\n', '</s>\n'),
+        'args': '--temp 0.4 --top-k 40 --top-p 0.9 --repeat-penalty 1.1',
+        'stop': ('</s>', '<|user|>', 'User:', 'Human:'),
+    },
+    'gemma': {
+        'bos': '',
+        'user_open': '<start_of_turn>user\n',
+        'user_close': '<end_of_turn>\n<start_of_turn>model\n',
+        'assistant_close': '<end_of_turn>\n',
+        'history': True,
+        'system': None,
+        'args': '--temp 0.5 --top-k 40 --top-p 0.9 --repeat-penalty 1.1',
+        'stop': ('<end_of_turn>', '<start_of_turn>', 'User:', 'Human:'),
+    },
+    'phi2': {
+        # Not instruction-tuned, no multi-turn support
+        'bos': '',
+        'user_open': 'Instruct: ',
+        'user_close': '\nOutput: ',
+        'assistant_close': '',
+        'history': False,
+        'system': None,
+        'args': '--temp 0.2 --top-k 50 --top-p 0.95 --repeat-penalty 1.2',
+        'stop': ('Instruct:', 'Output:', 'User:', 'Human:'),
+    },
+    'zephyr': {
+        'bos': '',
+        'user_open': '<|user|>\n',
+        'user_close': '<|endoftext|>\n<|assistant|>\n',
+        'assistant_close': '<|endoftext|>\n',
+        'history': True,
+        'system': ('<|system|>\n', '<|endoftext|>\n'),
+        'args': '--temp 0.5 --top-k 40 --top-p 0.9 --repeat-penalty 1.1',
+        'stop': ('<|endoftext|>', '<|user|>', 'User:', 'Human:'),
+    },
+    'chatml': _CHATML,
+}
+
+# llamafile CLI sampling flags -> /completion JSON fields
+SAMPLING_FIELDS = {
+    '--temp': ('temperature', float),
+    '--top-k': ('top_k', int),
+    '--top-p': ('top_p', float),
+    '--repeat-penalty': ('repeat_penalty', float),
+}
+
+# =============================================================================
+# Shell-compatible functions
+# =============================================================================
+@lru_cache(maxsize=256)
+def get_model_family(model_name):
+    """Detect model family from filename (memoized per filename)"""
+    name = model_name.lower()
+    for family, patterns in FAMILY_PATTERNS:
+        if any(p in name for p in patterns):
+            return family
+    return DEFAULT_FAMILY
+
+def get_template(model_name):
+    """Template dict for a model filename"""
+    return TEMPLATES[get_model_family(model_name)]
+
+def build_prompt(model_name, user_message, history=''):
+    """Same output as build_prompt in engine.sh"""
+    t = get_template(model_name)
+    turn = t['user_open'] + user_message + t['user_close']
+    if not t['history']:
+        return turn + '\n'
+    return (history or t['bos']) + turn + '\n'
+
+def build_history_entry(model_name, user_message, assistant_response):
+    """Same output as build_history_entry in engine.sh"""
+    t = get_template(model_name)
+    if not t['history']:
+        return '\n'
+    return (t['user_open'] + user_message + t['user_close'] +
+            assistant_response + t['assistant_close'] + '\n')
+
+def get_model_args(model_name):
+    """Same output as get_model_args in engine.sh"""
+    return get_template(model_name)['args'] + '\n'
+
+def get_stop_sequences(model_name):
+    """Same output as get_stop_sequences in engine.sh"""
+    return '\n'.join(get_template(model_name)['stop']) + '\n'
+
+# =============================================================================
+# Inference helpers
+# =============================================================================
+def format_prompt(model_name, user_message, history=''):
+    """Prompt as infer passes it to llamafile ($(...) drops trailing newlines)"""
+    return build_prompt(model_name, user_message, history).rstrip('\n')
+
+def stop_list(model_name):
+    """Stop sequences as a list"""
+    return list(get_template(model_name)['stop'])
+
+@lru_cache(maxsize=None)
+def _sampling_for_family(family):
+    args = TEMPLATES[family]['args'].split()
+    params = {}
+    for flag, value in zip(args[::2], args[1::2]):
+        if flag in SAMPLING_FIELDS:
+            field, cast = SAMPLING_FIELDS[flag]
+            params[field] = cast(value)
+    return params
+
+def sampling_params(model_name):
+    """get_model_args converted to llamafile /completion fields"""
+    return dict(_sampling_for_family(get_model_family(model_name)))
+
+def completion_payload(prompt, model_name, n_predict=None, stream=False):
+    """llamafile /completion request body for an already formatted prompt"""
+    payload = {
+        'prompt': prompt,
+        'n_predict': n_predict if n_predict is not None else -1,
+        'stop': stop_list(model_name),
+        'stream': stream,
+        'cache_prompt': True
+    }
+    payload.update(sampling_params(model_name))
+    return payload
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+PocketAI response cache - exact-match LRU for chat responses
+
+Entries are kept in memory under a byte budget. An optional append-only
+JSONL file makes the cache survive restarts; it is replayed on startup and
+compacted once it grows well past the live data.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def cache_key(*parts):
+    """Stable hash for a tuple of JSON-serializable key parts"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU of response text with an optional on-disk log"""
+
+    def __init__(self, max_bytes, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()  # key -> (text, size in bytes)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+        self._log_bytes = 0
+        if path:
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """Cached text for key, or None"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, text):
+        """Store text under key, evicting least recently used entries"""
+        if not self.enabled or len(text.encode()) > self.max_bytes:
+            return
+        with self.lock:
+            self._insert(key, text)
+            self.stats['stores'] += 1
+            if self.path:
+                self._append(key, text)
+
+    def clear(self):
+        """Drop every entry (memory and disk)"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.stats['invalidations'] += 1
+            if self.path:
+                self._rewrite()
+
+    def snapshot(self):
+        """Counters for /api/health"""
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                entries=len(self.entries),
+                bytes=self.size,
+                max_bytes=self.max_bytes,
+                hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else 0.0,
+                persistent=bool(self.path)
+            )
+
+    # -------------------------------------------------------------------------
+    # Internals (call with lock held)
+    # -------------------------------------------------------------------------
+    def _insert(self, key, text):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        nbytes = len(text.encode())
+        self.entries[key] = (text, nbytes)
+        self.size += nbytes
+        while self.size > self.max_bytes:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.size -= evicted_bytes
+            self.stats['evictions'] += 1
+
+    def _append(self, key, text):
+        line = json.dumps({'k': key, 'v': text}, ensure_ascii=False) + '\n'
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self._log_bytes += len(line.encode())
+            # Compact once dead entries dominate the file
+            if self._log_bytes > 2 * self.max_bytes:
+                self._rewrite()
+        except OSError:
+            pass
+
+    def _rewrite(self):
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for key, (text, _) in self.entries.items():
+                    f.write(json.dumps({'k': key, 'v': text}, ensure_ascii=False) + '\n')
+            os.replace(tmp, self.path)
+            self._log_bytes = os.path.getsize(self.path)
+        except OSError:
+            pass
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._insert(record['k'], record['v'])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Torn last line after a crash
+            self._log_bytes = os.path.getsize(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+PocketAI chat sessions - multi-turn history for the REST API
+
+Each session keeps its turns in data/sessions/<id>.json and a llamafile
+prompt cache (KV state) in data/sessions/<id>.cache, so a new turn only has
+to evaluate the tokens added since the previous one. Which turns go into
+the prompt is decided by context_window.py; the session stores where its
+window starts so the prompt prefix (and the cache) stays put between turns.
+Least recently used sessions are evicted when the directory exceeds its
+disk budget.
+"""
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+_SESSION_ID = re.compile(r'^[0-9a-f]{16}$')
+
+
+class SessionStore:
+    """Thread-safe session registry backed by data/sessions/"""
+
+    def __init__(self, root, max_bytes, max_turns=100):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.sessions = OrderedDict()  # id -> session dict, least recently used first
+        self.busy = set()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self._load()
+
+    # -------------------------------------------------------------------------
+    # Paths
+    # -------------------------------------------------------------------------
+    def meta_path(self, session_id):
+        return os.path.join(self.root, f'{session_id}.json')
+
+    def cache_path(self, session_id):
+        return os.path.join(self.root, f'{session_id}.cache')
+
+    def cache_name(self, session_id):
+        """Prompt cache path relative to the data directory (for the container)"""
+        return f'{os.path.basename(self.root)}/{session_id}.cache'
+
+    # -------------------------------------------------------------------------
+    # Session lifecycle
+    # -------------------------------------------------------------------------
+    def create(self, model_name, model_path=None):
+        """Start an empty session bound to a model
+
+        model_path pins the session to that file; without it, turns that
+        don't name a model use the active one.
+        """
+        now = time.time()
+        session = {
+            'id': secrets.token_hex(8),
+            'model': model_name,
+            'model_path': model_path,
+            'turns': [],
+            'context_start': 0,  # first turn in the prompt window
+            'created': now,
+            'last_used': now
+        }
+        with self.lock:
+            self.sessions[session['id']] = session
+            self._save(session)
+        return session
+
+    def get(self, session_id):
+        """Session by id (marks it recently used), or None"""
+        if not _SESSION_ID.match(session_id or ''):
+            return None
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session['last_used'] = time.time()
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        """Remove a session and its files"""
+        with self.lock:
+            if self.sessions.pop(session_id, None) is None:
+                return False
+            self._remove_files(session_id)
+            return True
+
+    def list(self):
+        """Summaries of all sessions, most recent first"""
+        with self.lock:
+            return [
+                {'id': s['id'], 'model': s['model'], 'turns': len(s['turns']),
+                 'created': s['created'], 'last_used': s['last_used']}
+                for s in reversed(self.sessions.values())
+            ]
+
+    def acquire(self, session_id):
+        """Mark a session as generating; False if a turn is already running"""
+        with self.lock:
+            if session_id in self.busy:
+                return False
+            self.busy.add(session_id)
+            return True
+
+    def release(self, session_id):
+        with self.lock:
+            self.busy.discard(session_id)
+
+    def snapshot(self):
+        """Counters for /api/health"""
+        with self.lock:
+            return {
+                'sessions': len(self.sessions),
+                'active': len(self.busy),
+                'evictions': self.evictions,
+                'max_bytes': self.max_bytes
+            }
+
+    # -------------------------------------------------------------------------
+    # History
+    # -------------------------------------------------------------------------
+    def bind_model(self, session, model_path, pin=False):
+        """Switch a session to another model; its KV cache and window no longer apply
+
+        pin (the request named the model) also keeps later turns on it.
+        """
+        model_name = os.path.basename(model_path)
+        with self.lock:
+            changed = pin and session.get('model_path') != model_path
+            if changed:
+                session['model_path'] = model_path
+            if session['model'] != model_name:
+                session['model'] = model_name
+                session['context_start'] = 0
+                try:
+                    os.remove(self.cache_path(session['id']))
+                except OSError:
+                    pass
+                changed = True
+            if changed:
+                self._save(session)
+
+    def set_context_start(self, session, start):
+        """Move the session's prompt window (saved with the next turn)"""
+        with self.lock:
+            session['context_start'] = start
+
+    def append_turn(self, session, user_message, response):
+        """Record a finished turn, keeping the last max_turns exchanges"""
+        with self.lock:
+            session['turns'].append({'user': user_message, 'assistant': response})
+            dropped = max(0, len(session['turns']) - self.max_turns)
+            del session['turns'][:dropped]
+            session['context_start'] = max(0, session.get('context_start', 0) - dropped)
+            session['last_used'] = time.time()
+            self._save(session)
+            self._enforce_budget()
+
+    # -------------------------------------------------------------------------
+    # Internals (call with lock held)
+    # -------------------------------------------------------------------------
+    def _save(self, session):
+        tmp = self.meta_path(session['id']) + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(session, f, ensure_ascii=False)
+            os.replace(tmp, self.meta_path(session['id']))
+        except OSError:
+            pass
+
+    def _remove_files(self, session_id):
+        for path in (self.meta_path(session_id), self.cache_path(session_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _session_bytes(self, session_id):
+        total = 0
+        for path in (self.meta_path(session_id), self.cache_path(session_id)):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _enforce_budget(self):
+        sizes = {sid: self._session_bytes(sid) for sid in self.sessions}
+        total = sum(sizes.values())
+        for sid in list(self.sessions):
+            if total <= self.max_bytes:
+                break
+            if sid in self.busy:
+                continue
+            self.sessions.pop(sid)
+            self._remove_files(sid)
+            total -= sizes[sid]
+            self.evictions += 1
+
+    def _load(self):
+        os.makedirs(self.root, exist_ok=True)
+        loaded = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.root, name), 'r', encoding='utf-8') as f:
+                    session = json.load(f)
+                if _SESSION_ID.match(session.get('id', '')):
+                    loaded.append(session)
+            except (OSError, ValueError):
+                continue
+        for session in sorted(loaded, key=lambda s: s.get('last_used', 0)):
+            self.sessions[session['id']] = session
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+PocketAI shell workers - engine.sh commands without a bash start per call
+
+A worker is a bash process that sources core/engine.sh once and then runs
+the commands sent over its stdin. Each command runs in a subshell with the
+shell options engine.sh set, in its own process group (job control is on),
+so a timeout kills the command's whole tree while the worker lives on.
+Output never goes through the worker's pipes: the caller names a file for
+it (a temp file for captured output, a PTY for streams).
+
+Protocol, one command at a time per worker:
+  request  "<id>\\n<output path>\\n<command>\\0"
+  replies  "<id> start <pid>\\n" once the subshell runs (the output is
+           open by then), "<id> exit <status>\\n" when it has ended
+
+Workers are replaced after max_commands commands, when the script changes
+on disk, or when they die. When every worker is busy, popen() returns None
+and the caller spawns bash itself as before.
+"""
+import os
+import re
+import select
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+WORKER_LOOP = r'''
+source "$1" >/dev/null 2>&1 || exit 97
+__pai_opts=${SHELLOPTS//:/ }    # options the script set (set -e...), restored for every command
+set +euo pipefail
+set -m                          # each command gets its own process group
+while IFS= read -r __pai_id && IFS= read -r __pai_out && IFS= read -r -d '' __pai_cmd; do
+    # Opened here, not in the subshell, so a PTY has a writer before "start" is sent
+    exec 5>"$__pai_out" || exec 5>/dev/null
+    (
+        set +m
+        for __pai_opt in $__pai_opts; do set -o "$__pai_opt"; done
+        eval "$__pai_cmd"
+    ) </dev/null >&5 2>/dev/null 5>&- &
+    exec 5>&-
+    printf '%s start %d\n' "$__pai_id" "$!"
+    wait "$!"
+    printf '%s exit %d\n' "$__pai_id" "$?"
+done
+'''
+
+START_TIMEOUT = 15  # covers sourcing the script when the worker is new
+_ENV_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class ShellWorkerError(Exception):
+    """A worker died or answered out of protocol"""
+
+
+def command_body(cmd, env=None, merge_stderr=False):
+    """Subshell text for a command: stderr redirection, exported env, then the command"""
+    lines = ['exec 2>&1'] if merge_stderr else []
+    for name, value in (env or {}).items():
+        if not _ENV_NAME.match(name):
+            raise ValueError(f'Invalid environment variable name: {name}')
+        lines.append(f'export {name}={shlex.quote(str(value))}')
+    lines.append(cmd)
+    body = '\n'.join(lines)
+    if '\0' in body:
+        raise ValueError('Command contains a NUL byte')
+    return body
+
+
+def script_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class ShellWorker:
+    """One bash process that has sourced the script"""
+
+    def __init__(self, bash, script):
+        self.stamp = script_stamp(script)
+        self.process = subprocess.Popen(
+            [bash, '-c', WORKER_LOOP, 'pocketai-worker', script],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            # Own process group, so terminal signals for the server don't reach it; not a new
+            # session, which would make the first PTY it opens its controlling terminal
+            preexec_fn=os.setpgrp
+        )
+        self.fd = self.process.stdout.fileno()
+        self.buffer = b''
+        self.commands = 0
+        self.seq = 0
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def send(self, body, output):
+        """Start a command writing to the output path; returns its pid (also its process group)"""
+        self.seq += 1
+        self.commands += 1
+        try:
+            self.process.stdin.write(f'{self.seq}\n{output}\n'.encode() + body.encode() + b'\0')
+            self.process.stdin.flush()
+        except OSError as e:
+            raise ShellWorkerError(f'worker stdin: {e}')
+        reply = self.reply(START_TIMEOUT)
+        if reply is None or reply[0] != 'start':
+            raise ShellWorkerError(f'no start reply: {reply}')
+        return reply[1]
+
+    def reply(self, timeout=None):
+        """Next (kind, number) reply for the current command; None on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b'\n' not in self.buffer:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return None
+            data = os.read(self.fd, 4096)
+            if not data:
+                raise ShellWorkerError('worker exited')
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        parts = line.decode(errors='replace').split()
+        if len(parts) != 3 or parts[0] != str(self.seq) or not parts[2].lstrip('-').isdigit():
+            raise ShellWorkerError(f'unexpected reply: {line[:80]!r}')
+        return parts[1], int(parts[2])
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class ShellCommand:
+    """A command running on a worker, with the parts of the Popen interface the server uses
+
+    The worker goes back to the pool once the exit status has been read, so
+    a caller that kills a command must still wait() or poll() until it has
+    ended. Both may be called from different threads.
+    """
+
+    def __init__(self, pool, worker, pid, args, output=None):
+        self.pool = pool
+        self.worker = worker
+        self.pid = pid
+        self.args = args
+        self.output = output  # temp file holding stdout, for communicate()
+        self.returncode = None
+        self.lock = threading.Lock()  # one reader of the worker's replies at a time
+
+    def fileno(self):
+        """Readable when the worker has replied (for event loops)"""
+        return self.worker.fd if self.worker is not None else -1
+
+    def poll(self):
+        # Someone else waiting means it hasn't been seen to end yet
+        if not self.lock.acquire(blocking=False):
+            return self.returncode
+        try:
+            return self._wait(0)
+        except subprocess.TimeoutExpired:
+            return None
+        finally:
+            self.lock.release()
+
+    def wait(self, timeout=None):
+        with self.lock:
+            return self._wait(timeout)
+
+    def _wait(self, timeout):
+        if self.returncode is not None:
+            return self.returncode
+        try:
+            reply = self.worker.reply(timeout)
+        except ShellWorkerError as e:
+            # The worker died under the command: take the command's group with it
+            self.kill()
+            self._finished(-1, crashed=str(e))
+            return self.returncode
+        if reply is None:
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        self._finished(reply[1])
+        return self.returncode
+
+    def _finished(self, code, crashed=None):
+        self.returncode = code
+        worker, self.worker = self.worker, None
+        self.pool.checkin(worker, crashed)
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            try:
+                os.killpg(self.pid, sig)
+            except OSError:
+                pass
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def communicate(self, timeout=None):
+        """Wait for the command; returns (stdout text, '')"""
+        self.wait(timeout)
+        text = ''
+        if self.output is not None:
+            try:
+                with open(self.output, encoding='utf-8', errors='replace') as f:
+                    text = f.read()
+            except OSError:
+                pass
+            self.discard()
+        return text, ''
+
+    def discard(self):
+        """Remove the captured-output file"""
+        if self.output is not None:
+            try:
+                os.unlink(self.output)
+            except OSError:
+                pass
+            self.output = None
+
+
+class ShellWorkerPool:
+    """Up to `size` workers for one script; thread-safe"""
+
+    def __init__(self, bash, script, size=2, max_commands=100):
+        self.bash = bash
+        self.script = script
+        self.size = max(0, size)
+        self.max_commands = max(1, max_commands)
+        self.idle = []
+        self.workers = 0      # alive workers, idle or busy
+        self.lock = threading.Lock()
+        self.started = 0
+        self.commands = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.misses = 0       # commands that found no free worker
+
+    def _spawn(self):
+        """New worker counted in self.workers by the caller; None if bash can't start"""
+        try:
+            worker = ShellWorker(self.bash, self.script)
+        except OSError:
+            with self.lock:
+                self.workers -= 1
+            return None
+        with self.lock:
+            self.started += 1
+        return worker
+
+    def prestart(self):
+        """Start workers up to the pool size in the background"""
+        def fill():
+            while True:
+                with self.lock:
+                    if self.workers >= self.size:
+                        return
+                    self.workers += 1
+                worker = self._spawn()
+                if worker is None:
+                    return
+                with self.lock:
+                    self.idle.append(worker)
+
+        if self.size:
+            threading.Thread(target=fill, daemon=True).start()
+
+    def _checkout(self):
+        stamp = script_stamp(self.script)
+        stale = []
+        worker = None
+        with self.lock:
+            while self.idle:
+                candidate = self.idle.pop()
+                if candidate.alive() and candidate.stamp == stamp:
+                    worker = candidate
+                    break
+                stale.append(candidate)
+                self.workers -= 1
+                self.recycled += 1
+            new = worker is None and self.workers < self.size
+            if new:
+                self.workers += 1
+            elif worker is None:
+                self.misses += 1
+        for old in stale:
+            old.close()
+        if new:
+            worker = self._spawn()
+        return worker
+
+    def checkin(self, worker, crashed=None):
+        """Return a worker after its command ended; retires it if used up, stale or dead"""
+        retire = (crashed is not None or not worker.alive() or worker.commands >= self.max_commands
+                  or worker.stamp != script_stamp(self.script))
+        with self.lock:
+            if not retire:
+                self.idle.append(worker)
+                return
+            self.workers -= 1
+            if crashed is not None:
+                self.crashed += 1
+            else:
+                self.recycled += 1
+        worker.close()
+        self.prestart()
+
+    def popen(self, cmd, env=None, stdout=None, merge_stderr=False):
+        """Run cmd on a worker; returns a ShellCommand, or None to spawn bash instead
+
+        Without stdout the output is captured for communicate(); otherwise
+        it goes to that path (a PTY slave for streams).
+        """
+        if not self.size:
+            return None
+        output = None
+        try:
+            if stdout is None:
+                fd, output = tempfile.mkstemp(prefix='pocketai-cmd-')
+                os.close(fd)
+            if '\n' in (stdout or output):
+                raise ValueError('Output path contains a newline')
+            body = command_body(cmd, env, merge_stderr)
+        except (OSError, ValueError):
+            if output is not None:
+                os.unlink(output)
+            return None
+        worker = self._checkout()
+        pid = None
+        if worker is not None:
+            try:
+                pid = worker.send(body, stdout or output)
+            except ShellWorkerError as e:
+                self.checkin(worker, str(e))
+        if pid is None:
+            if output is not None:
+                os.unlink(output)
+            return None
+        with self.lock:
+            self.commands += 1
+        return ShellCommand(self, worker, pid, cmd, output)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+            self.workers -= len(idle)
+        for worker in idle:
+            worker.close()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'workers': self.workers,
+                'idle': len(self.idle),
+                'started': self.started,
+                'commands': self.commands,
+                'recycled': self.recycled,
+                'crashed': self.crashed,
+                'misses': self.misses,
+            }
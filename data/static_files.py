@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+PocketAI static files - web assets cached in memory with compressed variants
+
+Small files are read once and kept in memory together with gzip (and, if
+the brotli module is installed, brotli) variants; a stat per request picks
+up edits. Large files stay on disk and are sent with sendfile. Every asset
+has an ETag per encoding so repeat visits are answered with 304.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import stat
+import threading
+from urllib.parse import unquote
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MEMORY_LIMIT = 1024 * 1024  # larger files are streamed from disk
+MIN_COMPRESS = 512          # smaller bodies are not worth compressing
+
+# Types missing from older mimetypes tables
+MIME_TYPES = {
+    '.js': 'text/javascript',
+    '.mjs': 'text/javascript',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.webmanifest': 'application/manifest+json',
+    '.wasm': 'application/wasm',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.ico': 'image/x-icon',
+}
+COMPRESSIBLE = ('text/', 'application/json', 'application/manifest+json', 'image/svg+xml', 'application/wasm')
+
+
+def content_type(path):
+    """MIME type for a file name, with a UTF-8 charset for text"""
+    ext = os.path.splitext(path)[1].lower()
+    ctype = MIME_TYPES.get(ext) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if ctype.startswith('text/') or ctype in ('application/json', 'image/svg+xml'):
+        ctype += '; charset=utf-8'
+    return ctype
+
+
+def accepted_encodings(header):
+    """Encodings a client accepts (q=0 excluded)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class Asset:
+    """One file: metadata, and for small files the body and its compressed variants"""
+
+    def __init__(self, path, stamp):
+        self.path = path
+        self.stamp = stamp  # (size, mtime_ns, inode)
+        self.size = stamp[0]
+        self.content_type = content_type(path)
+        self.last_modified = stamp[1] / 1e9
+        self.variants = {}  # encoding ('' = identity) -> bytes
+        if self.size <= MEMORY_LIMIT:
+            with open(path, 'rb') as f:
+                body = f.read()
+            self.size = len(body)
+            self.variants[''] = body
+            tag = hashlib.sha1(body).hexdigest()[:16]
+            if self.size >= MIN_COMPRESS and self.content_type.startswith(COMPRESSIBLE):
+                self._compress(body)
+        else:
+            tag = f'{stamp[1]:x}-{self.size:x}'
+        self.etag = tag
+
+    def _compress(self, body):
+        packed = gzip.compress(body, 9, mtime=0)
+        if len(packed) < len(body):
+            self.variants['gzip'] = packed
+        if brotli is not None:
+            packed = brotli.compress(body, quality=11)
+            if len(packed) < len(body):
+                self.variants['br'] = packed
+
+    def etag_for(self, encoding):
+        return f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+
+    def matches(self, if_none_match):
+        """True if an If-None-Match header names any variant of this asset"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return any(self.etag_for(encoding) in tags for encoding in ('', 'gzip', 'br'))
+
+    @property
+    def compressed(self):
+        return len(self.variants) > 1
+
+    def select(self, accept_encoding):
+        """(encoding, body or None) for a request; None body means send the file"""
+        if self.compressed:
+            accepted = accepted_encodings(accept_encoding)
+            for encoding in ('br', 'gzip'):
+                if encoding in self.variants and encoding in accepted:
+                    return encoding, self.variants[encoding]
+        return '', self.variants.get('')
+
+
+class StaticFiles:
+    """Thread-safe asset cache for one directory"""
+
+    def __init__(self, root, index='index.html'):
+        self.root = os.path.realpath(root)
+        self.index = index
+        self.assets = {}  # real path -> Asset
+        self.loads = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, url_path):
+        """Real file path for a URL path, or None (missing or outside root)"""
+        rel = unquote(url_path.split('?', 1)[0]).lstrip('/')
+        if not rel or rel.endswith('/'):
+            rel += self.index
+        path = os.path.realpath(os.path.join(self.root, rel))
+        if not path.startswith(self.root + os.sep):
+            return None
+        return path
+
+    def get(self, url_path):
+        """Asset for a URL path, reloaded if the file changed; None if not found"""
+        path = self.resolve(url_path)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self.lock:
+                self.assets.pop(path, None)
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        stamp = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self.lock:
+            asset = self.assets.get(path)
+            if asset is None or asset.stamp != stamp:
+                try:
+                    asset = Asset(path, stamp)
+                except OSError:
+                    return None
+                self.assets[path] = asset
+                self.loads += 1
+            return asset
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'assets': len(self.assets),
+                'bytes': sum(sum(len(v) for v in a.variants.values()) for a in self.assets.values()),
+                'loads': self.loads,
+                'brotli': brotli is not None,
+            }
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+PocketAI stream filter - incremental cleanup of model output
+
+Replaces the line-based awk/sed pipeline of infer (think-block strip,
+clean_response, cleanup_latex) with a filter that works on a token stream.
+feed() takes whatever the model has produced since the last call and
+returns the text that is safe to show; only a possible partial tag, stop
+sequence or LaTeX command at the end of the input, plus trailing
+whitespace, is held back until the next chunk decides it.
+
+- \\r\\n from the PTY becomes \\n
+- <think>...</think> blocks are dropped, even when a tag is split across reads
+- output ends at the first stop sequence of the model's template
+- special tokens (<|im_end|>, </s>, ...) are removed
+- common LaTeX is converted to Unicode (\\times -> ×, \\frac{a}{b} -> a/b)
+- leading and trailing whitespace of the answer is trimmed
+
+Usage:
+  stream_filter.py <model file name>   # filter stdin to stdout as it arrives
+"""
+import codecs
+import os
+import re
+import sys
+
+import prompt_templates
+
+SPECIAL_TOKENS = (
+    '<|im_end|>', '<|im_start|>', '<|eot_id|>', '<|start_header_id|>',
+    '<|end_header_id|>', '<|begin_of_text|>', '<end_of_turn>', '<start_of_turn>',
+    '<|endoftext|>', '<|user|>', '<|assistant|>', '</s>'
+)
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+
+# Same conversions as cleanup_latex in engine.sh
+LATEX_SYMBOLS = {
+    '\\times': '×', '\\div': '÷', '\\pm': '±', '\\leq': '≤', '\\geq': '≥',
+    '\\neq': '≠', '\\approx': '≈', '\\infty': '∞', '\\sqrt': '√',
+    '\\alpha': 'α', '\\beta': 'β', '\\gamma': 'γ', '\\delta': 'δ', '\\pi': 'π',
+    '\\theta': 'θ', '\\lambda': 'λ', '\\mu': 'μ', '\\sigma': 'σ', '\\omega': 'ω',
+    '\\cdot': '·',
+}
+LATEX_PATTERNS = (
+    r'(?P<frac>\\frac\{(?P<num>[^}\n]*)\}\{(?P<den>[^}\n]*)\})',
+    r'(?P<text>\\text\{(?P<body>[^}\n]*)\})',
+    r'(?P<open>\\[\[(] *)',       # \[ and \( with the spaces after them
+    r'(?P<close> *\\[\])])',      # \] and \) with the spaces before them
+)
+LATEX_LITERALS = ('\\frac{', '\\text{', '\\[', '\\(', '\\]', '\\)')
+
+# An unfinished \frac{..}{..} or \text{..} (held until its closing brace, up to MAX_HOLD chars)
+_PARTIAL_BRACE = re.compile(r'\\(?:frac\{[^}\n]*(?:\}(?:\{[^}\n]*)?)?|text\{[^}\n]*)\Z')
+# An opener that may still be followed by more spaces
+_OPEN_TAIL = re.compile(r'\\[\[(] *\Z')
+MAX_HOLD = 256
+
+
+class StreamFilter:
+    """Stateful filter for one answer: feed() chunks as they arrive, then flush()"""
+
+    def __init__(self, stop=(), latex=True):
+        self.stop = tuple(s for s in stop if s)
+        self.latex = latex
+        literals = [THINK_OPEN, *self.stop, *SPECIAL_TOKENS]
+        parts = [f'(?P<think>{re.escape(THINK_OPEN)})']
+        if self.stop:
+            parts.append('(?P<stop>' + '|'.join(map(re.escape, self.stop)) + ')')
+        parts.append('(?P<special>' + '|'.join(map(re.escape, SPECIAL_TOKENS)) + ')')
+        if latex:
+            parts.extend(LATEX_PATTERNS)
+            names = sorted(LATEX_SYMBOLS, key=len, reverse=True)
+            parts.append('(?P<symbol>' + '|'.join(map(re.escape, names)) + ')')
+            literals += [*LATEX_LITERALS, *LATEX_SYMBOLS]
+        self.pattern = re.compile('|'.join(parts))
+        # Every proper prefix of something we match: the tail that may be cut mid-pattern
+        self.prefixes = {lit[:i] for lit in literals for i in range(1, len(lit))}
+        self.close_prefixes = {THINK_CLOSE[:i] for i in range(1, len(THINK_CLOSE))}
+        self.longest = max(map(len, literals))
+        self.pending = ''       # raw text not yet decided
+        self.cr = ''            # a trailing \r that may start a \r\n
+        self.space = ''         # whitespace held until more text follows
+        self.at_start = True    # drop leading whitespace (start, and after a think block)
+        self.in_think = False
+        self.stopped = False    # a stop sequence was seen; later input is ignored
+
+    def feed(self, text):
+        """Add model output; returns the text that can be shown now"""
+        if self.stopped or not text:
+            return ''
+        text = self.cr + text
+        self.cr = '\r' if text.endswith('\r') else ''
+        if self.cr:
+            text = text[:-1]
+        self.pending += text.replace('\r\n', '\n')
+        return self._drain(final=False)
+
+    def flush(self):
+        """End of output: everything still held back, minus trailing whitespace"""
+        if self.stopped:
+            return ''
+        self.pending += self.cr
+        self.cr = ''
+        out = self._drain(final=True)
+        self.space = ''
+        return out
+
+    def _drain(self, final):
+        buf = self.pending
+        out = []
+        while buf:
+            if self.in_think:
+                end = buf.find(THINK_CLOSE)
+                if end < 0:
+                    # Drop the thought, except a possible start of </think>
+                    buf = '' if final else buf[len(buf) - self._tail(buf, self.close_prefixes):]
+                    break
+                buf = buf[end + len(THINK_CLOSE):]
+                self.in_think = False
+                self.at_start = True
+                continue
+            match = self.pattern.search(buf)
+            if match is None or (match.lastgroup == 'open' and match.end() == len(buf) and not final):
+                break
+            out.append(self._text(buf[:match.start()]))
+            kind = match.lastgroup
+            if kind == 'stop':
+                self.stopped = True
+                buf = ''
+                break
+            if kind == 'think':
+                self.in_think = True
+            elif kind == 'frac':
+                out.append(self._text(f"{match.group('num')}/{match.group('den')}"))
+            elif kind == 'text':
+                out.append(self._text(match.group('body')))
+            elif kind == 'symbol':
+                out.append(self._text(LATEX_SYMBOLS[match.group()]))
+            elif kind == 'close':
+                self.space = self.space.rstrip(' ')
+            buf = buf[match.end():]
+        if self.in_think or self.stopped:
+            pass
+        elif final:
+            out.append(self._text(buf))
+            buf = ''
+        else:
+            hold = self._holdback(buf)
+            out.append(self._text(buf[:len(buf) - hold]))
+            buf = buf[len(buf) - hold:]
+        self.pending = buf
+        return ''.join(out)
+
+    def _tail(self, buf, prefixes):
+        """Length of the longest end of buf that is in prefixes"""
+        for size in range(min(len(buf), self.longest - 1), 0, -1):
+            if buf[-size:] in prefixes:
+                return size
+        return 0
+
+    def _holdback(self, buf):
+        """How much of the end of buf must wait for the next chunk"""
+        hold = self._tail(buf, self.prefixes)
+        if self.latex and '\\' in buf[-MAX_HOLD:]:
+            for pattern in (_PARTIAL_BRACE, _OPEN_TAIL):
+                match = pattern.search(buf, max(0, len(buf) - MAX_HOLD))
+                if match:
+                    hold = max(hold, len(buf) - match.start())
+        return hold
+
+    def _text(self, text):
+        """Pass decided text through the whitespace trim"""
+        if not text:
+            return ''
+        if self.at_start:
+            text = text.lstrip()
+            if not text:
+                return ''
+            self.at_start = False
+        text = self.space + text
+        body = text.rstrip()
+        self.space = text[len(body):]
+        return body
+
+
+def for_model(model_name, latex=True):
+    """StreamFilter with the stop sequences of a model's template"""
+    return StreamFilter(prompt_templates.stop_list(model_name), latex)
+
+
+def clean_text(text, model_name):
+    """Filter a complete answer"""
+    flt = for_model(model_name)
+    return flt.feed(text) + flt.flush()
+
+
+def filter_stream(chunks, flt, status=None):
+    """Re-yield a text generator through flt; closes the source at a stop sequence
+
+    A stop sequence ends the answer normally, so status['complete'] is set
+    (status as in run_cmd_stream). Empty chunks (a source's idle ticks) are
+    passed on.
+    """
+    try:
+        for chunk in chunks:
+            text = flt.feed(chunk)
+            if text or not chunk:
+                yield text
+            if flt.stopped:
+                if status is not None:
+                    status['complete'] = True
+                break
+        text = flt.flush()
+        if text:
+            yield text
+    finally:
+        chunks.close()
+
+
+def main(argv):
+    if len(argv) != 2:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    flt = for_model(os.path.basename(argv[1]))
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    out = sys.stdout.buffer
+    wrote = False
+    while not flt.stopped:
+        data = os.read(0, 4096)
+        text = flt.feed(decoder.decode(data, final=not data))
+        if text:
+            out.write(text.encode())
+            out.flush()
+            wrote = True
+        if not data:
+            break
+    text = flt.flush()
+    if text or wrote:
+        # Newline-terminated like the sed pipeline
+        out.write(text.encode() + b'\n')
+        out.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+PocketAI warm pool - which models stay resident, under a slot and memory budget
+
+The API server keeps one llamafile --server per warm model. Before another
+model is loaded, admit() checks two limits: at most `slots` models, and the
+new model's estimated RAM must fit in MemAvailable minus a reserve. Models
+that are not serving a request are evicted least recently used first until
+both hold. Estimates come from the catalog's `ram` figure, raised to the
+file size plus runtime overhead when the file is bigger (weights are mapped
+into memory whole).
+
+The pool only makes decisions; starting and stopping engines is up to the
+caller, which serialises access (the server holds its engine lock).
+"""
+import re
+from collections import OrderedDict
+
+MB = 1024 * 1024
+RUNTIME_OVERHEAD = 64 * MB  # llamafile itself plus the KV cache of a small context
+
+_SIZE = re.compile(r'^\s*([\d.]+)\s*([KMG]?)B?\s*$', re.IGNORECASE)
+_UNITS = {'': MB, 'K': 1024, 'M': MB, 'G': 1024 * MB}  # bare numbers are MB, as in engine.sh
+
+
+def read_meminfo(path='/proc/meminfo'):
+    """/proc/meminfo as {field: bytes}; {} if unreadable"""
+    info = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                parts = value.split()
+                if parts and parts[0].isdigit():
+                    info[name.strip()] = int(parts[0]) * (1024 if parts[1:] == ['kB'] else 1)
+    except OSError:
+        pass
+    return info
+
+
+def mem_available(path='/proc/meminfo'):
+    """MemAvailable in bytes, or None when the kernel doesn't report it"""
+    return read_meminfo(path).get('MemAvailable')
+
+
+def parse_size(text):
+    """Bytes for a catalog size ('512MB', '1.2GB', '400'); None if unparseable"""
+    match = _SIZE.match(str(text))
+    if not match:
+        return None
+    try:
+        return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+    except ValueError:
+        return None
+
+
+def _normalize(name):
+    return re.sub(r'[-_. ]', '', name.lower())
+
+
+def catalog_ram(model_name, catalog):
+    """RAM figure of the first catalog entry whose name prefixes the model file name
+
+    The catalog lists more specific names first (qwen2.5-3b before qwen2),
+    so the first match wins. Returns bytes, or None without a match.
+    """
+    name = _normalize(model_name)
+    for key, info in catalog.items():
+        if name.startswith(_normalize(key)):
+            return parse_size(info.get('ram', ''))
+    return None
+
+
+def estimate_ram(model_name, file_size, catalog):
+    """Bytes a resident engine for this model is expected to need"""
+    return max(catalog_ram(model_name, catalog) or 0, file_size + RUNTIME_OVERHEAD)
+
+
+class WarmPool:
+    """Resident models in least recently used order
+
+    Entries map a key (the model path) to an opaque value (the server's
+    engine) and its RAM estimate.
+    """
+
+    def __init__(self, slots, reserve, meminfo_path='/proc/meminfo'):
+        self.slots = max(1, slots)
+        self.reserve = reserve
+        self.meminfo_path = meminfo_path
+        self.entries = OrderedDict()  # key -> (value, ram), least recently used first
+        self.evictions = 0
+        self.overcommits = 0          # models loaded alone although they don't fit
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Value for key (marked most recently used), or None"""
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def peek(self, key):
+        """Value for key without touching its position, or None"""
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def values(self):
+        """Values, least recently used first"""
+        return [value for value, _ in self.entries.values()]
+
+    def add(self, key, value, ram):
+        self.entries[key] = (value, ram)
+        self.entries.move_to_end(key)
+
+    def remove(self, key):
+        """Drop an entry; returns its value or None"""
+        entry = self.entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        """Drop every entry; returns their values"""
+        values = self.values()
+        self.entries.clear()
+        return values
+
+    def free(self):
+        """Bytes a new model may use (MemAvailable minus the reserve); None if unknown"""
+        available = mem_available(self.meminfo_path)
+        return None if available is None else available - self.reserve
+
+    def admit(self, key, ram, busy=lambda value: False):
+        """Make room for a model needing `ram` bytes
+
+        Evicts idle entries (busy(value) is false), least recently used
+        first, until a slot is free and the model fits. Returns the evicted
+        values for the caller to stop, or None if busy entries leave no room
+        (nothing is evicted then). A model that doesn't fit even in an empty
+        pool is still admitted alone, as a single engine always was.
+        """
+        free = self.free()
+        victims = []
+        freed = 0
+
+        def fits():
+            if len(self.entries) - len(victims) >= self.slots:
+                return False
+            return free is None or ram <= free + freed
+
+        for old_key, (value, old_ram) in self.entries.items():
+            if fits():
+                break
+            if old_key != key and not busy(value):
+                victims.append(old_key)
+                freed += old_ram
+        if not fits():
+            if len(victims) < len(self.entries):
+                return None
+            self.overcommits += 1
+        self.evictions += len(victims)
+        return [self.entries.pop(old_key)[0] for old_key in victims]
+
+    def snapshot(self):
+        free = self.free()
+        return {
+            'slots': self.slots,
+            'models': len(self.entries),
+            'ram_mb': round(sum(ram for _, ram in self.entries.values()) / MB),
+            'free_mb': round(free / MB) if free is not None else None,
+            'reserve_mb': round(self.reserve / MB),
+            'evictions': self.evictions,
+            'overcommits': self.overcommits,
+        }